@@ -0,0 +1,419 @@
+"""Runs chains as coroutines of one asyncio event loop.
+
+ChainExecutor waits for every running link on a thread of its own.
+AsyncChainExecutor starts the link processes with asyncio subprocesses
+instead, so a single event loop can drive hundreds of chains and thousands of
+link processes at once. AsyncRunner keeps such a loop on a background thread,
+and TkEventBridge hands the progress of the chains it runs to the Tk main loop
+as soon as it is posted, without a thread or timer checking for it.
+"""
+import asyncio
+import collections
+import os
+import socket
+import sys
+import threading
+from chain_executor import BaseChainExecutor, ExecutionEvent, BATCH_FINISHED
+from run_logs import pump_async
+from tracing import span
+from utils import BATCH_MAX_REPORTED_FAILURES, EXECUTION_POLL_INTERVAL, LOG_DRAIN_TIMEOUT, kill_process_group
+
+def use_pidfd_child_watcher(loop):
+    """Let 'loop' wait for its child processes through pidfds instead of a thread per process.
+
+    Only needed before Python 3.12, which picks this watcher by itself where the
+    kernel supports it. Returns True if the watcher was installed.
+    """
+    if sys.version_info >= (3, 12) or not hasattr(os, "pidfd_open"):
+        return False
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+    except OSError:
+        return False # Linux older than 5.3
+    watcher = asyncio.PidfdChildWatcher()
+    watcher.attach_loop(loop)
+    asyncio.set_child_watcher(watcher)
+    return True
+
+async def _kill_process_group(process):
+    kill_process_group(process, wait=False)
+    await process.wait()
+
+class AsyncOutputCapture:
+    """Pipes for the stdout and stderr of one asyncio link process, copied into its log files by tasks.
+
+    The pipes are read through the event loop rather than passed as
+    asyncio.subprocess.PIPE, because the wait method of an asyncio subprocess
+    only returns once its pipes are closed before Python 3.12, which processes
+    that inherited them, such as a daemon started by the script, delay
+    indefinitely. Pass 'stdout' and 'stderr' to the process, then call 'start'
+    once it was spawned and 'drain' once it exited.
+    """
+
+    def __init__(self, run_log, link_index, attempt):
+        self._writers = [run_log.open_writer(link_index, attempt, name) for name in ("stdout", "stderr")]
+        self._pipes = [os.pipe() for _ in self._writers]
+        self.stdout, self.stderr = (write_fd for _, write_fd in self._pipes)
+        self._transports = []
+        self._tasks = []
+
+    async def start(self):
+        """Close the write ends held by this process and start copying the pipes."""
+        loop = asyncio.get_running_loop()
+        pipes, self._pipes = self._pipes, []
+        for read_fd, write_fd in pipes:
+            os.close(write_fd)
+        for (read_fd, _), writer in zip(pipes, self._writers):
+            reader = asyncio.StreamReader()
+            transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), open(read_fd, "rb", buffering=0))
+            self._transports.append(transport)
+            self._tasks.append(asyncio.ensure_future(pump_async(reader, writer)))
+
+    async def drain(self, timeout=LOG_DRAIN_TIMEOUT):
+        """Wait up to 'timeout' seconds for the copying to reach end of file, then stop it and close the pipes."""
+        try:
+            if self._tasks:
+                await asyncio.wait(self._tasks, timeout=timeout)
+        finally:
+            self.close()
+            if self._tasks:
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def close(self):
+        """Stop copying and close the pipes and log files, also when the process could not be spawned."""
+        for task in self._tasks:
+            task.cancel()
+        for transport in self._transports:
+            transport.close()
+        for read_fd, write_fd in self._pipes:
+            os.close(read_fd)
+            os.close(write_fd)
+        self._pipes = []
+        for writer in self._writers[len(self._tasks):]:
+            writer.close() # The others are closed by their pump task
+        self._writers = self._writers[:len(self._tasks)]
+
+class AsyncChainExecutor(BaseChainExecutor):
+    """Runs the links of a chain's ExecutionPlan as subprocesses of the running event loop.
+
+    Takes the same arguments as ChainExecutor and follows the same policy,
+    that of BaseChainExecutor: the same order of links, process limits,
+    timeouts, retries, incremental skipping, output capture, history and
+    events. A waiting link costs a task instead of a thread, and waits for the
+    dispatcher without blocking the loop.
+
+    'run' is a coroutine. Cancelling the task running it, or calling 'cancel'
+    from the loop thread, kills the running links and waits for them, reports
+    CHAIN_FINISHED and then raises asyncio.CancelledError, so no link process
+    outlives its chain.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._task = None
+        self._running = {} # task -> link index
+        self._finished = [] # Tasks that finished but were not reported by _wait_link yet
+
+    def cancel(self):
+        """Stop the chain, killing its running links. Must be called from the event loop thread."""
+        self._cancelled.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def run(self):
+        """Run the chain. Returns True if every link exited with 0."""
+        self._task = asyncio.current_task()
+        if self.cancelled:
+            self._task.cancel() # Cancelled before it started
+        try:
+            self._start_run()
+            success, message = await self._run_links()
+        except asyncio.CancelledError:
+            self._cancelled.set()
+            self._finish_run(*self._get_outcome(None))
+            raise
+        except Exception as e:
+            success, message = False, f"Failed to execute chain '{self.chain_name}': {e}"
+        return self._finish_run(success, message)
+
+    async def _run_links(self):
+        try:
+            return await self._drive(self._schedule_links())
+        finally:
+            # Only reached with links still running when the chain is cancelled
+            for task in self._running:
+                task.cancel()
+            if self._running:
+                await asyncio.gather(*self._running, return_exceptions=True)
+
+    async def _drive(self, steps):
+        """Carry out the steps of a policy generator of BaseChainExecutor, awaiting each. Returns what it returns."""
+        result, error = None, None
+        while True:
+            try:
+                step = steps.send(result) if error is None else steps.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            result, error = None, None
+            try:
+                result = await step[0](*step[1:])
+            except BaseException as e:
+                error = e
+
+    async def _start_link(self, index):
+        self._running[asyncio.ensure_future(self._drive(self._run_link(index)))] = index
+
+    async def _wait_link(self):
+        """Return the (index, success, message) of the next link that finished."""
+        if not self._finished:
+            done, _ = await asyncio.wait(self._running, return_when=asyncio.FIRST_COMPLETED)
+            self._finished.extend(done)
+        task = self._finished.pop()
+        return (self._running.pop(task), *task.result())
+
+    async def _check_link(self, index, link):
+        # Hashing reads the script and inputs, which would hold up every other chain of the loop
+        return await asyncio.get_running_loop().run_in_executor(None, self._check_unchanged, index, link)
+
+    async def _sleep(self, delay):
+        await asyncio.sleep(delay)
+        return False # Cancelling the chain cancels its task instead
+
+    async def _acquire(self, shell):
+        await self.dispatcher.acquire_async(shell, self.priority)
+        return True
+
+    async def _spawn(self, index, link, attempt, command):
+        """Start the process of a link. Returns it with the AsyncOutputCapture of its output, if captured."""
+        capture = AsyncOutputCapture(self.run_log, index, attempt) if self.run_log is not None else None
+        try:
+            with span("asyncio.create_subprocess_exec", chain=self.chain_name, link=index):
+                process = await asyncio.create_subprocess_exec(
+                    *command,
+                    cwd=link.cwd, # Ensure the script runs in its directory
+                    stdout=capture.stdout if capture is not None else asyncio.subprocess.DEVNULL,
+                    stderr=capture.stderr if capture is not None else asyncio.subprocess.DEVNULL,
+                    stdin=asyncio.subprocess.DEVNULL,
+                    start_new_session=True,
+                )
+            if capture is not None:
+                await capture.start()
+        except BaseException:
+            if capture is not None:
+                capture.close()
+            raise
+        return process, capture
+
+    async def _wait(self, process, timeout):
+        """Wait for a process to exit. Returns its exit code, or None if it runs longer than 'timeout' seconds."""
+        try:
+            return await asyncio.wait_for(process.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def _kill(self, process):
+        await _kill_process_group(process)
+        return process.returncode
+
+    async def _drain(self, capture):
+        await capture.drain()
+
+    def _forget(self, index, capture):
+        if capture is not None:
+            capture.close()
+
+class ChainBatch:
+    """Several chains started together, whose outcomes are reported as one.
+
+    'chains' holds (name, ExecutionPlan) pairs. The chains run one after
+    another, each whether or not the one before it succeeded, or all at once
+    if 'parallel' is True; the process limits of the dispatcher apply across
+    them either way. 'failures' holds (name, message) pairs for chains that
+    could not be started, which count as failed. Every chain posts its own
+    events to 'events', followed by one BATCH_FINISHED event once the last
+    chain finished. The keyword arguments are passed to AsyncChainExecutor.
+    """
+
+    def __init__(self, chains, events=None, parallel=False, failures=(), **kwargs):
+        self.executors = [AsyncChainExecutor(chain_name, plan, events, **kwargs) for chain_name, plan in chains]
+        self.events = events
+        self.parallel = parallel
+        self.failures = list(failures)
+        self.success = None
+
+    def cancel(self):
+        """Cancel every chain of the batch, including those yet to start. Must be called from the event loop thread."""
+        for executor in self.executors:
+            executor.cancel()
+
+    async def _run_chain(self, executor):
+        # A task of its own, so a cancelled chain is told apart from a cancelled batch
+        task = asyncio.ensure_future(executor.run())
+        try:
+            await asyncio.wait([task])
+        except asyncio.CancelledError:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            raise
+
+    async def run(self):
+        """Run the chains of the batch. Returns True if every chain succeeded."""
+        if self.parallel:
+            await asyncio.gather(*(self._run_chain(executor) for executor in self.executors))
+        else:
+            for executor in self.executors:
+                await self._run_chain(executor)
+        success, message = self.get_outcome()
+        self.success = success
+        if self.events is not None:
+            self.events.put(ExecutionEvent(BATCH_FINISHED, None, None, (success, message)))
+        return success
+
+    def get_outcome(self):
+        """Return the (success, message) of the batch once its chains finished."""
+        failed = self.failures + [(executor.chain_name, executor.message) for executor in self.executors if not executor.success]
+        if len(self.executors) + len(self.failures) == 1:
+            # A single chain is reported just as when it runs on its own
+            return (not failed, failed[0][1] if failed else self.executors[0].message)
+        total = len(self.executors) + len(self.failures)
+        if not failed:
+            return True, f"All {total} chains executed successfully."
+        lines = [f"{len(failed)} of {total} chains failed:"]
+        lines += [f"'{chain_name}': {message}" for chain_name, message in failed[:BATCH_MAX_REPORTED_FAILURES]]
+        if len(failed) > BATCH_MAX_REPORTED_FAILURES:
+            lines.append(f"... and {len(failed) - BATCH_MAX_REPORTED_FAILURES} more.")
+        return False, "\n".join(lines)
+
+class AsyncRunner:
+    """An event loop on a background thread that runs AsyncChainExecutor chains submitted from other threads."""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._run_loop, name="async-runner", daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        use_pidfd_child_watcher(self.loop)
+        self.loop.call_soon(self._started.set)
+        self.loop.run_forever()
+
+    def submit(self, chain_name, plan, events=None, **kwargs):
+        """Start running a chain on the loop. Returns its AsyncChainExecutor.
+
+        The keyword arguments are passed to AsyncChainExecutor.
+        """
+        executor = AsyncChainExecutor(chain_name, plan, events, **kwargs)
+        asyncio.run_coroutine_threadsafe(self._run(executor), self.loop)
+        return executor
+
+    def submit_batch(self, chains, events=None, parallel=False, failures=(), **kwargs):
+        """Start running several chains on the loop as one ChainBatch, which is returned.
+
+        The arguments are passed to ChainBatch.
+        """
+        batch = ChainBatch(chains, events, parallel, failures, **kwargs)
+        asyncio.run_coroutine_threadsafe(self._run(batch), self.loop)
+        return batch
+
+    async def _run(self, runnable):
+        try:
+            await runnable.run()
+        except asyncio.CancelledError:
+            pass # Reported through the executor's events
+
+    def cancel(self, executor):
+        """Cancel a chain started by 'submit'. Can be called from any thread."""
+        self.loop.call_soon_threadsafe(executor.cancel)
+
+    def close(self):
+        """Cancel the running chains, wait for their processes and stop the loop."""
+        async def cancel_all():
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        asyncio.run_coroutine_threadsafe(cancel_all(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+class TkEventBridge:
+    """Delivers events posted from any thread to callbacks on the Tk main thread.
+
+    'channel(callback)' returns an object with a put method, which can be used
+    as the 'events' of an executor. On platforms where Tk can watch a file
+    descriptor, posting writes one byte to a socket pair when the bridge is
+    idle and Tk runs the callbacks as soon as it becomes readable; elsewhere
+    (Windows) the posted events are checked every EXECUTION_POLL_INTERVAL.
+    """
+
+    def __init__(self, root):
+        import tkinter # Imported here so the daemon and the command line never load tkinter
+        self.root = root
+        self._pending = collections.deque() # (callback, event) pairs
+        self._lock = threading.Lock()
+        self._woken = False
+        self._reader = self._writer = None
+        if hasattr(root, "createfilehandler") and hasattr(socket, "socketpair"):
+            try:
+                self._reader, self._writer = socket.socketpair()
+                self._reader.setblocking(False)
+                root.createfilehandler(self._reader, tkinter.READABLE, self._on_readable)
+            except Exception:
+                self._reader = self._writer = None # Tk cannot watch sockets on this platform
+        if self._reader is None:
+            self.root.after(EXECUTION_POLL_INTERVAL, self._poll)
+
+    def channel(self, callback):
+        bridge = self
+
+        class Channel:
+            def put(self, event):
+                bridge._post(callback, event)
+        return Channel()
+
+    def _post(self, callback, event):
+        with self._lock:
+            self._pending.append((callback, event))
+            if self._woken or self._writer is None:
+                return
+            self._woken = True
+        self._writer.send(b"\0")
+
+    def _deliver(self):
+        try:
+            while True:
+                with self._lock:
+                    if not self._pending:
+                        return
+                    callback, event = self._pending.popleft()
+                try:
+                    if callback(event) is False:
+                        return # The callback closed the application
+                except Exception:
+                    # Reported like an error in any other Tk callback, the events after it are still delivered
+                    self.root.report_callback_exception(*sys.exc_info())
+        finally:
+            # Even if delivery stopped early, the next post wakes the bridge again
+            with self._lock:
+                self._woken = False
+
+    def _on_readable(self, file, mask):
+        try:
+            self._reader.recv(4096)
+        except BlockingIOError:
+            pass
+        self._deliver()
+
+    def _poll(self):
+        self._deliver()
+        self.root.after(EXECUTION_POLL_INTERVAL, self._poll)
+
+    def close(self):
+        if self._reader is not None:
+            self.root.deletefilehandler(self._reader)
+            self._reader.close()
+            self._writer.close()
@@ -0,0 +1,401 @@
+"""Command line interface for running execution chains without the GUI.
+
+Usage:
+    python -m automation_hub run <chain> [--wait] [--json]
+    python -m automation_hub history [<chain>] [--json]
+    python -m automation_hub schedule list|add|remove|run
+    python -m automation_hub daemon serve|list|run|status|cancel
+    python -m automation_hub limits list|set|remove
+    python -m automation_hub incremental list|enable|disable
+
+Any command takes --trace <file> to write a Chrome trace of the functions it
+runs and --profile <file> to write a cProfile dump, see tracing.py.
+
+Only the modules needed to load and run a chain are imported, tkinter is never loaded.
+"""
+import argparse
+import json
+import os
+import queue
+import subprocess
+import sys
+import time
+from tracing import enable_tracing
+
+# Exit statuses for errors that happen before any link runs
+EXIT_CHAIN_FAILED = 1
+EXIT_USAGE_ERROR = 2
+
+def _print_result(result, as_json):
+    if as_json:
+        print(json.dumps(result))
+    elif result["success"]:
+        print(result["message"])
+    else:
+        print(result["message"], file=sys.stderr)
+
+def _drain(events):
+    drained = []
+    while True:
+        try:
+            drained.append(events.get_nowait())
+        except queue.Empty:
+            return drained
+
+def run_chain(args):
+    """Run a chain and return its exit status."""
+    from chain_executor import ChainExecutor, LINK_STARTED, LINK_FINISHED, LINK_SKIPPED
+    from execution_plan import get_execution_plan
+    from storage import get_storage
+
+    storage = get_storage()
+    if not storage.chain_exists(args.chain):
+        _print_result({"chain": args.chain, "success": False, "exit_code": EXIT_USAGE_ERROR, "message": f"Chain '{args.chain}' does not exist."}, args.json)
+        return EXIT_USAGE_ERROR
+
+    if not args.wait:
+        # Hand the chain to a detached copy of this command and return immediately
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "-C", os.getcwd(), "run", args.chain, "--wait"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            stdin=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        _print_result({"chain": args.chain, "success": True, "exit_code": None, "message": f"Chain '{args.chain}' started."}, args.json)
+        return 0
+
+    plan = get_execution_plan(args.chain)
+    events = queue.SimpleQueue()
+    start_time = time.time()
+    executor = ChainExecutor(args.chain, plan, events)
+    success = executor.run()
+    duration = time.time() - start_time
+
+    links = {}
+    message = None
+    for event in _drain(events):
+        if event.kind == LINK_STARTED:
+            links[event.link_index] = {"index": event.link_index, "command": event.detail, "exit_code": None}
+        elif event.kind == LINK_FINISHED:
+            links[event.link_index]["exit_code"] = event.detail
+        elif event.kind == LINK_SKIPPED:
+            links[event.link_index] = {"index": event.link_index, "command": event.detail, "exit_code": None, "skipped": True}
+        else:
+            message = event.detail[1]
+
+    for index, link in links.items():
+        if index in executor.attempts:
+            link.update(attempts=executor.attempts[index], duration=round(executor.durations[index], 6), timed_out=index in executor.timed_out)
+    exit_code = executor.get_exit_code()
+
+    _print_result({
+        "chain": args.chain,
+        "success": success,
+        "exit_code": exit_code,
+        "message": message,
+        "duration": round(duration, 6),
+        "links": [links[i] for i in sorted(links)],
+    }, args.json)
+    return exit_code
+
+def run_storage(args):
+    """Copy chains and shells between the CSV layout and the SQLite database."""
+    from storage import import_csv, export_csv
+    from utils import DATABASE_FILE
+
+    if args.action == "import":
+        import_csv(DATABASE_FILE)
+        print(f"Imported the CSV layout into '{DATABASE_FILE}'.")
+    else:
+        export_csv(DATABASE_FILE)
+        print(f"Exported '{DATABASE_FILE}' to the CSV layout.")
+    return 0
+
+def run_discover_shells(args):
+    """Register the shells found in the PATH directories that are not registered yet."""
+    from shell_discovery import discover_shells, register_discovered_shells
+    from storage import get_storage
+
+    storage = get_storage()
+    if args.dry_run:
+        discovered = discover_shells(storage.list_shells())
+    else:
+        discovered = register_discovered_shells(storage)
+
+    if args.json:
+        print(json.dumps([{"shell": shell, "identity": identity} for shell, identity in discovered]))
+    else:
+        for shell, identity in discovered:
+            print(f"{shell}\t{identity}")
+        action = "Found" if args.dry_run else "Registered"
+        print(f"{action} {len(discovered)} new shell(s).")
+    return 0
+
+def _format_stats(name, stats):
+    def seconds(value):
+        return "-" if value is None else f"{value:.3f}s"
+    failure_rate = "-" if stats["failure_rate"] is None else f"{stats['failure_rate']:.1%}"
+    line = f"{name:<30} {stats['runs']:>7} {seconds(stats['p50']):>10} {seconds(stats['p95']):>10} {seconds(stats['max']):>10} {failure_rate:>8}"
+    if "retries" in stats:
+        line += f" {stats['retries']:>8} {stats['timeouts']:>9}"
+    return line
+
+def run_history(args):
+    """Print duration percentiles and failure rates of past runs, per chain or per link of one chain."""
+    from run_history import get_run_history
+
+    history = get_run_history()
+    if args.chain is None:
+        results = {chain: history.get_chain_stats(chain) for chain in history.list_chains()}
+        rows = [(chain, stats) for chain, stats in results.items()]
+    else:
+        results = {"chain": history.get_chain_stats(args.chain), "links": history.get_link_stats(args.chain)}
+        rows = [(args.chain, results["chain"])] + [(f"  link {index}", stats) for index, stats in results["links"].items()]
+
+    if args.json:
+        print(json.dumps(results))
+    else:
+        header = f"{'Name':<30} {'Runs':>7} {'p50':>10} {'p95':>10} {'Max':>10} {'Failed':>8}"
+        if args.chain is not None:
+            header += f" {'Retries':>8} {'Timeouts':>9}" # Only links record retries and timeouts
+        print(header)
+        for name, stats in rows:
+            print(_format_stats(name, stats))
+    return 0
+
+def run_schedule(args):
+    """List, add or remove chain schedules, or run the scheduler without the GUI."""
+    from scheduler import CronSchedule, IntervalSchedule, SchedulerLoop, load_schedules, save_schedules
+    from utils import SCHEDULES_FILE
+
+    schedules = load_schedules(SCHEDULES_FILE)
+    if args.action == "list":
+        for chain_name, schedule in sorted(schedules.items()):
+            print(f"{chain_name}\t{schedule.kind}\t{schedule.spec}")
+        return 0
+
+    if args.action == "add":
+        from storage import get_storage
+        if not get_storage().chain_exists(args.chain):
+            print(f"Chain '{args.chain}' does not exist.", file=sys.stderr)
+            return EXIT_USAGE_ERROR
+        schedules[args.chain] = CronSchedule(args.cron) if args.cron else IntervalSchedule(args.every)
+        save_schedules(SCHEDULES_FILE, schedules)
+        print(f"Scheduled '{args.chain}' ({schedules[args.chain].kind} {schedules[args.chain].spec}).")
+        return 0
+
+    if args.action == "remove":
+        if schedules.pop(args.chain, None) is None:
+            print(f"Chain '{args.chain}' is not scheduled.", file=sys.stderr)
+            return EXIT_USAGE_ERROR
+        save_schedules(SCHEDULES_FILE, schedules)
+        print(f"Removed the schedule of '{args.chain}'.")
+        return 0
+
+    # Headless mode: run the scheduler in this process until interrupted
+    import threading
+    from chain_executor import ChainExecutor
+    from dispatcher import PRIORITY_BACKGROUND
+    from execution_plan import get_execution_plan
+
+    def run(chain_name):
+        try:
+            executor = ChainExecutor(chain_name, get_execution_plan(chain_name), priority=PRIORITY_BACKGROUND)
+            success = executor.run()
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} '{chain_name}' {'succeeded' if success else 'failed'}", flush=True)
+        except Exception as e:
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} Failed to run '{chain_name}': {e}", file=sys.stderr, flush=True)
+
+    def dispatch(chain_name):
+        threading.Thread(target=run, args=(chain_name,), name=f"scheduled-{chain_name}", daemon=True).start()
+
+    loop = SchedulerLoop(dispatch)
+    loop.reload_if_changed()
+    if loop.error:
+        print(loop.error, file=sys.stderr)
+        return EXIT_USAGE_ERROR
+    print(f"Running {len(loop.scheduler)} schedule(s). Press Ctrl+C to stop.", flush=True)
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+def run_daemon(args):
+    """Start the daemon in this process, or send a request to the running daemon and print the response."""
+    if args.action == "serve":
+        import asyncio
+        from daemon import Daemon
+        print("Daemon listening. Press Ctrl+C to stop.", flush=True)
+        asyncio.run(Daemon().serve())
+        return 0
+
+    from daemon_client import send_request
+    request = {"action": args.action}
+    if args.action == "run":
+        request.update(chain=args.chain, wait=args.wait)
+    elif getattr(args, "run_id", None) is not None:
+        request["run_id"] = args.run_id
+    try:
+        response = send_request(request)
+    except OSError as e:
+        print(f"Could not reach the daemon ({e}). Start it with 'python -m automation_hub daemon serve'.", file=sys.stderr)
+        return EXIT_USAGE_ERROR
+
+    print(json.dumps(response))
+    if not response["ok"]:
+        return EXIT_USAGE_ERROR
+    if args.action == "run" and args.wait:
+        return response["run"]["exit_code"]
+    return 0
+
+def run_limits(args):
+    """List, set or remove the process and resource limits of shells."""
+    from dispatcher import ShellLimits, load_shell_limits, save_shell_limits
+    from utils import SHELL_LIMITS_FILE
+
+    limits = load_shell_limits(SHELL_LIMITS_FILE)
+    if args.action == "list":
+        def show(value):
+            return "-" if value is None else str(value)
+        print(f"{'Shell':<40} {'Processes':>10} {'Memory MB':>10} {'CPU s':>10}")
+        for shell, shell_limits in sorted(limits.items()):
+            print(f"{shell:<40} {show(shell_limits.max_processes):>10} {show(shell_limits.max_memory_mb):>10} {show(shell_limits.max_cpu_seconds):>10}")
+        return 0
+
+    if args.action == "set":
+        for value in (args.max_processes, args.memory, args.cpu_seconds):
+            if value is not None and value < 1:
+                print("Limits must be positive whole numbers.", file=sys.stderr)
+                return EXIT_USAGE_ERROR
+        limits[args.shell] = ShellLimits(args.max_processes, args.memory, args.cpu_seconds)
+        save_shell_limits(SHELL_LIMITS_FILE, limits)
+        print(f"Set the limits of '{args.shell}'.")
+        return 0
+
+    if limits.pop(args.shell, None) is None:
+        print(f"Shell '{args.shell}' has no limits.", file=sys.stderr)
+        return EXIT_USAGE_ERROR
+    save_shell_limits(SHELL_LIMITS_FILE, limits)
+    print(f"Removed the limits of '{args.shell}'.")
+    return 0
+
+def run_incremental(args):
+    """List the incremental chains, or turn incremental execution on or off for a chain."""
+    from incremental import get_fingerprint_cache, load_incremental_chains, save_incremental_chains
+    from utils import INCREMENTAL_CHAINS_FILE
+
+    chain_names = load_incremental_chains(INCREMENTAL_CHAINS_FILE)
+    if args.action == "list":
+        for chain_name in sorted(chain_names):
+            print(chain_name)
+        return 0
+
+    if args.action == "enable":
+        from storage import get_storage
+        if not get_storage().chain_exists(args.chain):
+            print(f"Chain '{args.chain}' does not exist.", file=sys.stderr)
+            return EXIT_USAGE_ERROR
+        chain_names.add(args.chain)
+        save_incremental_chains(INCREMENTAL_CHAINS_FILE, chain_names)
+        print(f"Links of '{args.chain}' are skipped when unchanged.")
+        return 0
+
+    if args.chain not in chain_names:
+        print(f"Chain '{args.chain}' is not incremental.", file=sys.stderr)
+        return EXIT_USAGE_ERROR
+    chain_names.discard(args.chain)
+    save_incremental_chains(INCREMENTAL_CHAINS_FILE, chain_names)
+    get_fingerprint_cache().forget_chain(args.chain)
+    print(f"Every link of '{args.chain}' runs again.")
+    return 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="automation_hub", description="Run Automation-Hub execution chains without the GUI.")
+    parser.add_argument("-C", "--directory", help="Directory containing the Chains, Shells and Settings folders (defaults to the current directory).")
+    parser.add_argument("--trace", metavar="FILE", help="Write the timing of the traced functions to FILE as Chrome trace events (or set AUTOMATION_HUB_TRACE).")
+    parser.add_argument("--profile", metavar="FILE", help="Write a cProfile dump of the command to FILE (or set AUTOMATION_HUB_PROFILE).")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run an execution chain.")
+    run_parser.add_argument("chain", help="Name of the chain, as shown in the main window.")
+    run_parser.add_argument("--wait", action="store_true", help="Wait for the chain to finish and exit with its status.")
+    run_parser.add_argument("--json", action="store_true", help="Print the result as JSON.")
+    run_parser.set_defaults(handler=run_chain)
+
+    history_parser = subparsers.add_parser("history", help="Show duration percentiles and failure rates of past runs.")
+    history_parser.add_argument("chain", nargs="?", help="Show the statistics of each link of this chain instead of every chain.")
+    history_parser.add_argument("--json", action="store_true", help="Print the statistics as JSON.")
+    history_parser.set_defaults(handler=run_history)
+
+    schedule_parser = subparsers.add_parser("schedule", help="Manage chain schedules or run them without the GUI.")
+    schedule_subparsers = schedule_parser.add_subparsers(dest="action", required=True)
+    schedule_subparsers.add_parser("list", help="List the schedules.")
+    add_parser = schedule_subparsers.add_parser("add", help="Schedule a chain, replacing its current schedule.")
+    add_parser.add_argument("chain", help="Name of the chain, as shown in the main window.")
+    when_group = add_parser.add_mutually_exclusive_group(required=True)
+    when_group.add_argument("--cron", help="A cron expression such as '*/15 * * * *' or '@daily', in local time.")
+    when_group.add_argument("--every", help="Run the chain every this many seconds.")
+    remove_parser = schedule_subparsers.add_parser("remove", help="Remove the schedule of a chain.")
+    remove_parser.add_argument("chain", help="Name of the chain.")
+    schedule_subparsers.add_parser("run", help="Run the scheduled chains until interrupted, without the GUI.")
+    schedule_parser.set_defaults(handler=run_schedule)
+
+    discover_parser = subparsers.add_parser("discover-shells", help="Register the shells found in the PATH directories.")
+    discover_parser.add_argument("--dry-run", action="store_true", help="List the shells that would be registered without registering them.")
+    discover_parser.add_argument("--json", action="store_true", help="Print the shells as JSON.")
+    discover_parser.set_defaults(handler=run_discover_shells)
+
+    daemon_parser = subparsers.add_parser("daemon", help="Run chains through a resident daemon listening on a Unix socket.")
+    daemon_subparsers = daemon_parser.add_subparsers(dest="action", required=True)
+    daemon_subparsers.add_parser("serve", help="Start the daemon in this process and serve requests until interrupted.")
+    daemon_subparsers.add_parser("list", help="List the chains and the ids of the running runs.")
+    daemon_run_parser = daemon_subparsers.add_parser("run", help="Start a chain and print its run id.")
+    daemon_run_parser.add_argument("chain", help="Name of the chain, as shown in the main window.")
+    daemon_run_parser.add_argument("--wait", action="store_true", help="Wait for the chain to finish and exit with its status.")
+    status_parser = daemon_subparsers.add_parser("status", help="Show the status of a run, or of every run the daemon knows.")
+    status_parser.add_argument("run_id", type=int, nargs="?", help="Id of the run.")
+    cancel_parser = daemon_subparsers.add_parser("cancel", help="Stop a run, killing its running links.")
+    cancel_parser.add_argument("run_id", type=int, help="Id of the run.")
+    daemon_parser.set_defaults(handler=run_daemon)
+
+    limits_parser = subparsers.add_parser("limits", help="Manage the process and resource limits of shells.")
+    limits_subparsers = limits_parser.add_subparsers(dest="action", required=True)
+    limits_subparsers.add_parser("list", help="List the shells with limits.")
+    set_parser = limits_subparsers.add_parser("set", help="Set the limits of a shell, replacing its current limits. Omitted limits are unlimited.")
+    set_parser.add_argument("shell", help="Path of the shell, as shown in the shells window.")
+    set_parser.add_argument("--max-processes", type=int, help="Links that may run with this shell at the same time.")
+    set_parser.add_argument("--memory", type=int, help="Address space limit of each link process, in megabytes.")
+    set_parser.add_argument("--cpu-seconds", type=int, help="CPU time limit of each link process, in seconds.")
+    remove_limits_parser = limits_subparsers.add_parser("remove", help="Remove the limits of a shell.")
+    remove_limits_parser.add_argument("shell", help="Path of the shell.")
+    limits_parser.set_defaults(handler=run_limits)
+
+    incremental_parser = subparsers.add_parser("incremental", help="Manage the chains whose unchanged links are skipped.")
+    incremental_subparsers = incremental_parser.add_subparsers(dest="action", required=True)
+    incremental_subparsers.add_parser("list", help="List the incremental chains.")
+    enable_parser = incremental_subparsers.add_parser("enable", help="Skip the links of a chain whose script, command and inputs did not change since they last succeeded.")
+    enable_parser.add_argument("chain", help="Name of the chain, as shown in the main window.")
+    disable_parser = incremental_subparsers.add_parser("disable", help="Run every link of a chain again and forget its fingerprints.")
+    disable_parser.add_argument("chain", help="Name of the chain, as shown in the main window.")
+    incremental_parser.set_defaults(handler=run_incremental)
+
+    storage_parser = subparsers.add_parser("storage", help="Copy chains and shells between the CSV layout and the SQLite database.")
+    storage_parser.add_argument("action", choices=["import", "export"], help="'import' replaces the database with the CSV layout, 'export' replaces the CSV layout with the database.")
+    storage_parser.set_defaults(handler=run_storage)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    enable_tracing(args.trace, args.profile)
+    if args.directory:
+        os.chdir(args.directory)
+    try:
+        return args.handler(args)
+    except Exception as e:
+        _print_result({"success": False, "exit_code": EXIT_CHAIN_FAILED, "message": f"Error: {e}"}, getattr(args, "json", False))
+        return EXIT_CHAIN_FAILED
+
+if __name__ == "__main__":
+    sys.exit(main())
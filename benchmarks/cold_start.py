@@ -0,0 +1,79 @@
+"""Compare the cold start of the headless CLI with the GUI startup path.
+
+Each measurement starts a fresh Python process, so module import time is included.
+
+    python benchmarks/cold_start.py [--runs N]
+
+The CLI is timed running a one link chain to completion. The GUI path is timed
+importing main.py (tkinter and the four window modules), creating the Tk root
+when a display is available, and running validate_state. It exits with status 1
+if the median CLI time exceeds CLI_COLD_START_BUDGET_MS.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLI_COLD_START_BUDGET_MS = 100
+
+GUI_STARTUP = """
+import sys
+sys.path.insert(0, {repo!r})
+import main, utils
+try:
+    import tkinter as tk
+    tk.Tk().destroy()
+except tk.TclError:
+    pass # No display available, only the imports are measured
+utils.validate_state()
+"""
+
+def create_tree(directory):
+    """Create a minimal Chains/Shells/Settings tree with a one link chain."""
+    for name in ("Chains", "Shells", "Settings"):
+        os.makedirs(os.path.join(directory, name), exist_ok=True)
+    for name in os.listdir(os.path.join(REPO_DIR, "Settings")):
+        with open(os.path.join(REPO_DIR, "Settings", name)) as src, open(os.path.join(directory, "Settings", name), "w") as dst:
+            dst.write(src.read())
+
+    shell = os.path.normpath("/bin/sh")
+    script = os.path.join(directory, "noop.sh")
+    with open(script, "w") as f:
+        f.write("exit 0\n")
+    with open(os.path.join(directory, "Shells", "shells.csv"), "w") as f:
+        f.write(f"{shell}\n")
+    with open(os.path.join(directory, "Shells", "identities.csv"), "w") as f:
+        f.write(f"{shell},Bourne Shell\n")
+    with open(os.path.join(directory, "Shells", "shell_options.csv"), "w") as f:
+        f.write(f"{shell},,<your-script>,\n")
+    with open(os.path.join(directory, "Chains", "cold_start.csv"), "w") as f:
+        f.write(f"{shell},{script}\n")
+
+def time_command(command, cwd, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=cwd, check=True, stdout=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        create_tree(directory)
+        cli_ms = time_command([sys.executable, os.path.join(REPO_DIR, "automation_hub.py"), "run", "cold_start", "--wait"], directory, args.runs)
+        gui_ms = time_command([sys.executable, "-c", GUI_STARTUP.format(repo=REPO_DIR)], directory, args.runs)
+
+    print(f"CLI run --wait: {cli_ms:.1f} ms (budget {CLI_COLD_START_BUDGET_MS} ms)")
+    print(f"GUI startup:    {gui_ms:.1f} ms")
+    return 0 if cli_ms <= CLI_COLD_START_BUDGET_MS else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
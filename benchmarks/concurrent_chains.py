@@ -0,0 +1,177 @@
+"""Compare running many chains at once with ChainExecutor threads and with AsyncChainExecutor.
+
+    python benchmarks/concurrent_chains.py [--chains N] [--links N] [--max-processes N]
+                                           [--repeat N] [--output results.json] [--compare baseline.json]
+
+'--chains' chains of '--links' links each are started together and run to
+completion, first as ChainExecutor threads and then as AsyncChainExecutor tasks
+of one event loop, with at most '--max-processes' link processes at a time. The
+links of a chain run one after another, so the chains only overlap with each
+other. The stand-in shell is a copy of the 'true' executable, as in
+hot_paths.py, so the spawn rate measures the executors rather than the scripts.
+
+For each backend the median wall time, the spawn throughput (link processes
+started and reaped per second) and the most threads alive at once are reported,
+together with the latency of a 1 ms ticker: a thread sleeping in a loop for the
+thread backend, and a coroutine on the chains' event loop for the asyncio
+backend. Its p50, p99 and maximum lateness show how long the main thread, or
+the event loop, is kept from reacting while the chains run.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from hot_paths import create_tree, get_commit
+
+TICK_INTERVAL = 0.001 # Seconds the latency ticker sleeps between samples
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of 'samples' in milliseconds."""
+    ordered = sorted(samples)
+    return round(ordered[max(0, math.ceil(len(ordered) * fraction) - 1)] * 1000, 3) if ordered else None
+
+def summarize(timings, lags, peak_threads, spawns):
+    median = statistics.median(timings)
+    return {
+        "median_ms": round(median * 1000, 3),
+        "min_ms": round(min(timings) * 1000, 3),
+        "spawns_per_second": round(spawns / median, 1),
+        "latency_p50_ms": percentile(lags, 0.50),
+        "latency_p99_ms": percentile(lags, 0.99),
+        "latency_max_ms": round(max(lags) * 1000, 3) if lags else None,
+        "peak_threads": peak_threads,
+    }
+
+def run_threads(plans, make_kwargs, repeat):
+    from chain_executor import ChainExecutor
+
+    timings, lags, peak_threads = [], [], 0
+    for _ in range(repeat):
+        executors = [ChainExecutor(name, plan, **make_kwargs()) for name, plan in plans]
+        start = time.perf_counter()
+        for executor in executors:
+            executor.start()
+        # Tick on the main thread, as the Tk loop would, until every chain finished
+        while any(executor.success is None for executor in executors):
+            before = time.perf_counter()
+            time.sleep(TICK_INTERVAL)
+            lags.append(time.perf_counter() - before - TICK_INTERVAL)
+            peak_threads = max(peak_threads, threading.active_count())
+        for executor in executors:
+            executor.join()
+        timings.append(time.perf_counter() - start)
+        if not all(executor.success for executor in executors):
+            raise Exception("a stand-in chain failed")
+    return timings, lags, peak_threads
+
+def run_asyncio(plans, make_kwargs, repeat):
+    from async_executor import AsyncChainExecutor, use_pidfd_child_watcher
+
+    timings, lags, peak_threads = [], [], 0
+
+    async def tick(done):
+        nonlocal peak_threads
+        loop = asyncio.get_running_loop()
+        while not done.is_set():
+            before = loop.time()
+            await asyncio.sleep(TICK_INTERVAL)
+            lags.append(loop.time() - before - TICK_INTERVAL)
+            peak_threads = max(peak_threads, threading.active_count())
+
+    async def run_all():
+        use_pidfd_child_watcher(asyncio.get_running_loop())
+        for _ in range(repeat):
+            executors = [AsyncChainExecutor(name, plan, **make_kwargs()) for name, plan in plans]
+            done = asyncio.Event()
+            ticker = asyncio.ensure_future(tick(done))
+            start = time.perf_counter()
+            results = await asyncio.gather(*(executor.run() for executor in executors))
+            timings.append(time.perf_counter() - start)
+            done.set()
+            await ticker
+            if not all(results):
+                raise Exception("a stand-in chain failed")
+
+    asyncio.run(run_all())
+    return timings, lags, peak_threads
+
+def run_benchmarks(args, shell_path, script_paths):
+    from dispatcher import RunDispatcher
+    from execution_plan import compile_plan
+    from run_history import RunHistory
+
+    history = RunHistory(os.path.join("Database", "benchmark_history.db"))
+    dispatcher = RunDispatcher(os.path.join("Shells", "limits.csv"), max_processes=lambda: args.max_processes)
+    plans = [
+        (f"chain{c}", compile_plan(f"chain{c}", [[shell_path, script_paths[(c + i) % len(script_paths)]] for i in range(args.links)]))
+        for c in range(args.chains)
+    ]
+
+    def make_kwargs():
+        return {"max_workers": 1, "capture_output": False, "history": history, "dispatcher": dispatcher, "incremental": False}
+
+    spawns = args.chains * args.links
+    return {
+        "threads": summarize(*run_threads(plans, make_kwargs, args.repeat), spawns),
+        "asyncio": summarize(*run_asyncio(plans, make_kwargs, args.repeat), spawns),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chains", type=int, default=200)
+    parser.add_argument("--links", type=int, default=10, help="Links per chain.")
+    parser.add_argument("--max-processes", type=int, default=64, help="Link processes running at once, across all chains.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--compare", help="A results file from a previous run to compare against.")
+    args = parser.parse_args()
+
+    parameters = {"chains": args.chains, "links": args.links, "max_processes": args.max_processes, "repeat": args.repeat}
+    with tempfile.TemporaryDirectory() as directory:
+        shell_paths, script_paths = create_tree(directory, 1, 1, 1, "CSV")
+        previous_directory = os.getcwd()
+        os.chdir(directory) # The application resolves its files relative to the working directory
+        try:
+            results = run_benchmarks(args, shell_paths[0], script_paths)
+        finally:
+            os.chdir(previous_directory)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("parameters") != parameters:
+            print(f"Warning: the baseline was measured with {baseline.get('parameters')}")
+
+    print(f"{args.chains} chains x {args.links} links, at most {args.max_processes} processes at once")
+    for name, result in results.items():
+        line = (
+            f"{name:<8} {result['median_ms']:>10.2f} ms {result['spawns_per_second']:>9.1f} spawns/s"
+            f"   latency p50 {result['latency_p50_ms']:.3f} ms p99 {result['latency_p99_ms']:.3f} ms max {result['latency_max_ms']:.3f} ms"
+            f"   {result['peak_threads']} threads"
+        )
+        previous = baseline["results"].get(name) if baseline else None
+        if previous:
+            line += f"  x{result['spawns_per_second'] / previous['spawns_per_second']:.2f} spawns/s vs baseline"
+        print(line)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "commit": get_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "parameters": parameters,
+                "results": results,
+            }, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""Time the hot paths of the application on a large synthetic tree.
+
+    python benchmarks/hot_paths.py [--chains N] [--links N] [--shells N] [--storage CSV|SQLite]
+                                   [--repeat N] [--output results.json] [--compare baseline.json]
+
+A Chains/Shells/Settings tree is generated in a temporary directory and the code
+behind each action of the GUI is timed without opening a window:
+
+    load_chains          listing the chains shown in the main window
+    validate_state_cold  startup validation without a validation cache
+    validate_state_warm  startup validation with an up to date validation cache
+    compile_plan         loading a chain and building the command of every link
+    build_commands       getting the cached execution plan of an unchanged chain (execute_chain)
+    save_chain           checking the dependencies of a chain and saving it (EditChainWindow._save_chain)
+    remove_shell         removing one shell and the links that use it (ShellsWindow.remove_selected_shell)
+    spawn_sequential     running a chain whose links run one after another
+    spawn_parallel       running a chain whose links all start immediately
+
+The shells are copies of the 'true' executable, so spawning measures process
+creation rather than interpreter startup. Results are printed and written as
+JSON; with --compare, the ratio to a previous result file is shown as well.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT_COUNT = 1000 # Distinct scripts referenced by the generated chains
+SPAWN_LINKS = 100 # Links of the chains used by the spawn benchmarks
+
+def create_tree(directory, chains, links, shells, storage_backend):
+    """Create a tree of 'chains' chains of 'links' links each, using 'shells' stand-in shells."""
+    sys.path.insert(0, REPO_DIR)
+    from utils import DELIMITER, SCRIPT_PLACEHOLDER
+
+    for name in ("Chains", "Shells", "Settings", "Scripts", "Bin"):
+        os.makedirs(os.path.join(directory, name), exist_ok=True)
+    settings_dir = os.path.join(REPO_DIR, "Settings")
+    for name in os.listdir(settings_dir):
+        shutil.copyfile(os.path.join(settings_dir, name), os.path.join(directory, "Settings", name))
+    with open(os.path.join(directory, "Settings", "storage_backend.csv"), "w") as f:
+        f.write(f"# Selected\n{storage_backend}\n# Options\nCSV\nSQLite\n")
+
+    true_executable = shutil.which("true")
+    shell_paths = []
+    for i in range(shells):
+        path = os.path.join(directory, "Bin", f"shell{i}")
+        shutil.copyfile(true_executable, path)
+        os.chmod(path, 0o755)
+        shell_paths.append(path)
+    with open(os.path.join(directory, "Shells", "shells.csv"), "w") as f:
+        f.writelines(f"{shell}\n" for shell in shell_paths)
+    with open(os.path.join(directory, "Shells", "identities.csv"), "w") as f:
+        f.writelines(f"{shell}{DELIMITER}Stand-in Shell\n" for shell in shell_paths)
+    with open(os.path.join(directory, "Shells", "shell_options.csv"), "w") as f:
+        f.writelines(f"{shell}{DELIMITER}{DELIMITER}{SCRIPT_PLACEHOLDER}{DELIMITER}\n" for shell in shell_paths)
+
+    script_paths = []
+    for i in range(SCRIPT_COUNT):
+        path = os.path.join(directory, "Scripts", f"script{i}.sh")
+        with open(path, "w") as f:
+            f.write("exit 0\n")
+        script_paths.append(path)
+
+    for c in range(chains):
+        with open(os.path.join(directory, "Chains", f"chain{c}.csv"), "w") as f:
+            for i in range(links):
+                n = c * links + i
+                f.write(f"{shell_paths[n % shells]}{DELIMITER}{script_paths[n % SCRIPT_COUNT]}\n")
+    return shell_paths, script_paths
+
+def time_runs(function, repeat):
+    """Call function(run) 'repeat' times. Returns the median and minimum time in milliseconds."""
+    timings = []
+    for run in range(repeat):
+        start = time.perf_counter()
+        function(run)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {"median_ms": round(statistics.median(timings), 3), "min_ms": round(min(timings), 3), "runs": repeat}
+
+def run_benchmarks(args, shell_paths, script_paths):
+    from chain_executor import ChainExecutor
+    from execution_plan import compile_plan, get_execution_plan
+    from run_history import RunHistory
+    from storage import get_storage
+    from utils import VALIDATION_CACHE_FILE, get_link_dependencies, validate_state
+
+    storage = get_storage()
+    results = {}
+
+    results["load_chains"] = time_runs(lambda run: storage.list_chains(), args.repeat)
+
+    def validate_cold(run):
+        if os.path.exists(VALIDATION_CACHE_FILE):
+            os.remove(VALIDATION_CACHE_FILE)
+        validate_state()
+    results["validate_state_cold"] = time_runs(validate_cold, args.repeat)
+    validate_state()
+    results["validate_state_warm"] = time_runs(lambda run: validate_state(), args.repeat)
+
+    results["compile_plan"] = time_runs(lambda run: compile_plan(f"chain{run % args.chains}", storage.load_chain(f"chain{run % args.chains}")), args.repeat)
+    for run in range(args.repeat):
+        get_execution_plan(f"chain{run % args.chains}")
+    results["build_commands"] = time_runs(lambda run: get_execution_plan(f"chain{run % args.chains}"), args.repeat)
+
+    def save_chain(run):
+        rows = storage.load_chain(f"chain{run % args.chains}")
+        for i, row in enumerate(rows):
+            get_link_dependencies(row, i)
+        storage.save_chain(f"chain{run % args.chains}", rows)
+    results["save_chain"] = time_runs(save_chain, args.repeat)
+
+    # Each run removes a different shell, so the later runs find fewer links to remove
+    results["remove_shell"] = time_runs(lambda run: storage.remove_shells([shell_paths[run]]), min(args.repeat, len(shell_paths)))
+
+    history = RunHistory(os.path.join("Database", "benchmark_history.db"))
+    shell = shell_paths[-1]
+    sequential_links = [[shell, script_paths[i % len(script_paths)]] for i in range(SPAWN_LINKS)]
+    parallel_links = [[shell, script_paths[i % len(script_paths)], ""] for i in range(SPAWN_LINKS)]
+    for name, chain_links, max_workers in (("spawn_sequential", sequential_links, 1), ("spawn_parallel", parallel_links, 8)):
+        plan = compile_plan(name, chain_links)
+        def spawn(run):
+            if not ChainExecutor(name, plan, max_workers=max_workers, capture_output=False, history=history).run():
+                raise Exception(f"stand-in chain '{name}' failed")
+        results[name] = time_runs(spawn, args.repeat)
+        results[name]["links_per_second"] = round(SPAWN_LINKS / (results[name]["median_ms"] / 1000), 1)
+    return results
+
+def get_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chains", type=int, default=10000)
+    parser.add_argument("--links", type=int, default=100, help="Links per chain.")
+    parser.add_argument("--shells", type=int, default=500)
+    parser.add_argument("--storage", choices=["CSV", "SQLite"], default="CSV")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--compare", help="A results file from a previous run to compare against.")
+    args = parser.parse_args()
+
+    parameters = {"chains": args.chains, "links": args.links, "shells": args.shells, "storage": args.storage, "repeat": args.repeat}
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        shell_paths, script_paths = create_tree(directory, args.chains, args.links, args.shells, args.storage)
+        print(f"Generated {args.chains} chains x {args.links} links and {args.shells} shells in {time.perf_counter() - start:.1f} s")
+        previous_directory = os.getcwd()
+        os.chdir(directory) # The application resolves its files relative to the working directory
+        try:
+            results = run_benchmarks(args, shell_paths, script_paths)
+        finally:
+            os.chdir(previous_directory)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("parameters") != parameters:
+            print(f"Warning: the baseline was measured with {baseline.get('parameters')}")
+
+    for name, result in results.items():
+        line = f"{name:<22} {result['median_ms']:>10.2f} ms (min {result['min_ms']:.2f} ms)"
+        previous = baseline["results"].get(name) if baseline else None
+        if previous:
+            line += f"  x{result['median_ms'] / previous['median_ms']:.2f} vs baseline"
+        print(line)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "commit": get_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "parameters": parameters,
+                "results": results,
+            }, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,428 @@
+import heapq
+import queue
+import shlex
+import subprocess
+import threading
+import time
+from collections import namedtuple
+from dispatcher import PRIORITY_INTERACTIVE, apply_resource_limits, get_dispatcher
+from incremental import get_fingerprint_cache, is_incremental_chain
+from tracing import span
+from utils import RETRY_BACKOFF_BASE, RETRY_BACKOFF_MAX, get_max_parallel_links, is_output_capture_enabled, kill_process_group
+
+# Event kinds posted by ChainExecutor
+LINK_STARTED = "link_started"
+LINK_FINISHED = "link_finished"
+LINK_SKIPPED = "link_skipped"
+LINK_RETRYING = "link_retrying"
+CHAIN_FINISHED = "chain_finished"
+BATCH_FINISHED = "batch_finished" # Posted by ChainBatch once every chain of a batch finished
+
+# 'detail' is the command for LINK_STARTED and LINK_SKIPPED, the exit code for
+# LINK_FINISHED, an (attempt, delay in seconds) tuple for LINK_RETRYING and a
+# (success, message) tuple for CHAIN_FINISHED and BATCH_FINISHED, whose
+# 'chain_name' and 'link_index' are None.
+ExecutionEvent = namedtuple("ExecutionEvent", ["kind", "chain_name", "link_index", "detail"])
+
+def get_critical_path_lengths(dependencies):
+    """Return, for each link, the number of links on the longest path starting at it."""
+    lengths = [1] * len(dependencies)
+    # Dependencies always refer to earlier links, so a reverse walk visits dependents first.
+    for i in range(len(dependencies) - 1, -1, -1):
+        for dependency in dependencies[i]:
+            lengths[dependency] = max(lengths[dependency], lengths[i] + 1)
+    return lengths
+
+def get_retry_delay(attempt):
+    """Return the seconds to wait before retry 'attempt' (1 for the first retry).
+
+    The delay doubles with every retry up to RETRY_BACKOFF_MAX, and a random
+    half of it is jittered so links that failed together do not retry together.
+    """
+    import random # Imported here, like the modules only some runs need, to keep the command line's start fast
+    delay = min(RETRY_BACKOFF_BASE * 2 ** (attempt - 1), RETRY_BACKOFF_MAX)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+class LinkQueue:
+    """Tracks which links of a plan are ready to start, the one heading the longest remaining path first."""
+
+    def __init__(self, links):
+        dependencies = [link.dependencies for link in links]
+        self._priorities = get_critical_path_lengths(dependencies)
+        self._dependents = [[] for _ in dependencies]
+        self._remaining = [len(deps) for deps in dependencies]
+        for i, deps in enumerate(dependencies):
+            for dependency in deps:
+                self._dependents[dependency].append(i)
+        self._ready = [(-self._priorities[i], i) for i, count in enumerate(self._remaining) if count == 0]
+        heapq.heapify(self._ready)
+
+    def __bool__(self):
+        return bool(self._ready)
+
+    def pop(self):
+        """Return the index of the next link to start."""
+        return heapq.heappop(self._ready)[1]
+
+    def succeeded(self, index):
+        """Make the links whose last dependency was link 'index' ready."""
+        for dependent in self._dependents[index]:
+            self._remaining[dependent] -= 1
+            if self._remaining[dependent] == 0:
+                heapq.heappush(self._ready, (-self._priorities[dependent], dependent))
+
+class BaseChainExecutor:
+    """The state, bookkeeping and policy shared by ChainExecutor and AsyncChainExecutor.
+
+    This class decides when links start, retries them and runs each attempt:
+    _schedule_links, _run_link and _run_attempt are generators that yield
+    every step needing the backend as a (method, *args) tuple. The subclass
+    drives them with '_drive', calling (or awaiting) the method and sending
+    its result back, or throwing the exception it raised into the generator.
+    Subclasses only provide these steps: _start_link, _wait_link, _check_link,
+    _sleep, _acquire, _spawn, _wait, _kill, _drain and _forget.
+    """
+
+    def __init__(self, chain_name, plan, events=None, max_workers=None, capture_output=None, history=None, priority=PRIORITY_INTERACTIVE, dispatcher=None, incremental=None):
+        self.chain_name = chain_name
+        self.plan = plan
+        self.events = events
+        self.max_workers = max_workers if max_workers is not None else get_max_parallel_links()
+        self.capture_output = capture_output if capture_output is not None else is_output_capture_enabled()
+        self.run_log = None
+        self.history = history
+        self.run_id = None
+        self.priority = priority
+        self.dispatcher = dispatcher if dispatcher is not None else get_dispatcher()
+        self.incremental = incremental if incremental is not None else is_incremental_chain(chain_name)
+        self.fingerprints = get_fingerprint_cache() if self.incremental else None
+        self.returncodes = {}
+        self.attempts = {}
+        self.durations = {}
+        self.timed_out = set()
+        self.success = None
+        self.message = None
+        self._cancelled = threading.Event()
+        self._start_time = None
+
+    def _post(self, kind, link_index=None, detail=None):
+        if self.events is not None:
+            self.events.put(ExecutionEvent(kind, self.chain_name, link_index, detail))
+
+    def _record(self, method, *args):
+        """Call a RunHistory method, returning None if the history cannot be written."""
+        import sqlite3 # Loaded by run_history already
+        try:
+            return method(*args)
+        except sqlite3.Error:
+            return None
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def get_exit_code(self):
+        """Return the exit status for a finished run: 0 on success, else that of the first failing link (1 if none ran)."""
+        if self.success:
+            return 0
+        failed_codes = [code for _, code in sorted(self.returncodes.items()) if code != 0]
+        return min(max(failed_codes[0], 1), 255) if failed_codes else 1
+
+    def _start_run(self):
+        """Record the start of the run and open its log directory if output is captured."""
+        if self.history is None:
+            from run_history import get_run_history
+            self.history = get_run_history()
+        self._start_time = time.monotonic()
+        self.run_id = self._record(self.history.start_run, self.chain_name, time.time())
+        if self.capture_output:
+            from run_logs import start_run_log
+            self.run_log = start_run_log(self.chain_name)
+
+    def _finish_run(self, success, message):
+        """Record and report the outcome of the run. Returns 'success'."""
+        if not success and self.run_log is not None:
+            message += f" Output was saved to '{self.run_log.directory}'."
+        self.success, self.message = success, message
+        if self.run_id is not None:
+            self._record(self.history.finish_run, self.run_id, time.monotonic() - self._start_time, success)
+        self._post(CHAIN_FINISHED, detail=(success, message))
+        return success
+
+    def _get_outcome(self, failure):
+        """Return the (success, message) of a run whose links stopped with 'failure' (None if none failed)."""
+        if self.cancelled:
+            return False, f"Chain '{self.chain_name}' was cancelled."
+        if failure is not None:
+            return False, failure
+        return True, f"Chain '{self.chain_name}' executed successfully."
+
+    def _check_unchanged(self, index, link):
+        """Return the fingerprint of a link and whether it can be skipped because it did not change."""
+        if self.fingerprints is None:
+            return None, False
+        fingerprint = self.fingerprints.get_link_fingerprint(link)
+        if self.fingerprints.is_unchanged(self.chain_name, index, fingerprint):
+            self._post(LINK_SKIPPED, index, list(link.argv))
+            return fingerprint, True
+        return fingerprint, False
+
+    def _record_fingerprint(self, index, fingerprint, succeeded):
+        if self.fingerprints is None:
+            return
+        if succeeded:
+            self.fingerprints.record_success(self.chain_name, index, fingerprint)
+        else:
+            self.fingerprints.forget(self.chain_name, index)
+
+    def _finish_attempt(self, index, link, attempt, command, started, duration, returncode, timed_out):
+        """Record an attempt of a link whose process exited. Returns a (success, message, exited) tuple."""
+        self.returncodes[index] = returncode
+        self.attempts[index] = attempt + 1
+        self.durations[index] = duration
+        if timed_out:
+            self.timed_out.add(index)
+        else:
+            self.timed_out.discard(index)
+        if self.run_id is not None:
+            self._record(self.history.record_link, self.run_id, self.chain_name, index, shlex.join(command), started, duration, returncode, attempt, timed_out)
+        self._post(LINK_FINISHED, index, returncode)
+        if timed_out:
+            return False, f"Script '{link.script}' timed out after {link.timeout:g} seconds.", True
+        if returncode != 0:
+            return False, f"Script '{link.script}' exited with code {returncode}.", True
+        return True, None, True
+
+    def _schedule_links(self):
+        """Start the links as their dependencies succeed. Returns the (success, message) of the run."""
+        ready = LinkQueue(self.plan.links)
+        running = 0
+        failure = None
+
+        while ready or running:
+            while ready and failure is None and not self.cancelled and running < self.max_workers:
+                yield self._start_link, ready.pop()
+                running += 1
+            if not running:
+                break
+
+            i, succeeded, message = yield (self._wait_link,)
+            running -= 1
+            if not succeeded:
+                if failure is None: failure = message
+                continue
+            ready.succeeded(i)
+
+        return self._get_outcome(failure)
+
+    def _run_link(self, index):
+        """Run a single link, retrying it if it fails. Returns a (success, message) tuple."""
+        try:
+            link = self.plan.links[index]
+            if link.error is not None:
+                return False, link.error
+            fingerprint, unchanged = None, False
+            if self.fingerprints is not None:
+                fingerprint, unchanged = yield self._check_link, index, link
+            if unchanged:
+                return True, None
+
+            attempt = 0
+            while True:
+                succeeded, message, exited = yield from self._run_attempt(index, link, attempt)
+                if succeeded or not exited or attempt >= link.retries or self.cancelled:
+                    break
+                attempt += 1
+                delay = get_retry_delay(attempt)
+                self._post(LINK_RETRYING, index, (attempt, delay))
+                if (yield self._sleep, delay):
+                    return False, f"Chain '{self.chain_name}' was cancelled."
+
+            self._record_fingerprint(index, fingerprint, succeeded)
+            return succeeded, message
+        except Exception as e:
+            return False, f"Failed to run link {index}: {e}"
+
+    def _run_attempt(self, index, link, attempt):
+        """Start a link once and wait for it, killing it if it times out.
+
+        Returns a (success, message, exited) tuple, where 'exited' is False if
+        the process could not be started.
+        """
+        # Wait for the process limits, giving up if the chain is cancelled meanwhile
+        shell = link.argv[0]
+        if not (yield self._acquire, shell):
+            return False, f"Chain '{self.chain_name}' was cancelled.", False
+        process = None
+        capture = None
+        timed_out = False
+        try:
+            command = list(link.argv)
+            self._post(LINK_STARTED, index, command)
+            started = time.time()
+            start_time = time.monotonic()
+            process, capture = yield self._spawn, index, link, attempt, apply_resource_limits(command, self.dispatcher.get_limits(shell))
+            returncode = yield self._wait, process, link.timeout
+            if returncode is None:
+                timed_out = True
+                returncode = yield self._kill, process
+            if capture is not None:
+                yield self._drain, capture
+        except GeneratorExit:
+            raise
+        except Exception as e:
+            return False, f"Error executing '{link.script}': {e}", False
+        except BaseException:
+            # The chain was cancelled (asyncio.CancelledError) while the link ran, which must not outlive it
+            if process is not None:
+                returncode = yield self._kill, process
+                if capture is not None:
+                    yield self._drain, capture
+                self._finish_attempt(index, link, attempt, command, started, time.monotonic() - start_time, returncode, False)
+            raise
+        finally:
+            self._forget(index, capture)
+            self.dispatcher.release(shell)
+
+        return self._finish_attempt(index, link, attempt, command, started, time.monotonic() - start_time, returncode, timed_out)
+
+class ChainExecutor(BaseChainExecutor):
+    """Runs the links of a chain's ExecutionPlan on worker threads and waits for each exit status.
+
+    Links start as soon as the links they depend on have succeeded, with at most
+    'max_workers' links running at once. When several links are ready, the one
+    heading the longest remaining path starts first. After a failure no new
+    links are started. 'cancel' can be called from any thread to stop starting
+    links and kill the running ones.
+
+    Each link process is started through 'dispatcher' (the application's
+    RunDispatcher by default), so a link may wait in its queue, with
+    'priority', for the process limits before starting. The memory and CPU
+    time limits of its shell are applied to the process.
+
+    A link with a timeout has its process group killed once it runs longer,
+    and a failed or timed out link with retries is started again after
+    get_retry_delay seconds. The number of attempts, the duration of the last
+    attempt and whether it timed out are kept per link index in 'attempts',
+    'durations' and 'timed_out'.
+
+    When 'capture_output' is enabled, the stdout and stderr of each link are
+    streamed into a new run directory under Logs/.
+
+    When 'incremental' is enabled (by default, when the chain is listed in the
+    incremental chains file), a link whose fingerprint equals the one of its
+    last successful run is skipped and counts as succeeded.
+
+    Every run and every link that was started is recorded in 'history' (the
+    application's RunHistory by default). Failing to record never fails the chain.
+
+    Progress is reported as ExecutionEvent objects put on 'events', which can be
+    any object with a put method (typically a queue.Queue drained by the UI).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._thread = None
+        self._processes = {} # link index -> running process
+        self._finished = queue.SimpleQueue() # (index, success, message) of the links whose thread ended
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Run the chain on a background worker thread."""
+        self._thread = threading.Thread(target=self.run, name=f"chain-{self.chain_name}", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def cancel(self):
+        """Stop starting links and kill the running links together with their children."""
+        with self._lock:
+            self._cancelled.set()
+            processes = list(self._processes.values())
+        self.dispatcher.wake()
+        for process in processes:
+            kill_process_group(process)
+
+    def run(self):
+        """Run the chain in the calling thread. Returns True if every link exited with 0."""
+        try:
+            self._start_run()
+            success, message = self._drive(self._schedule_links())
+        except Exception as e:
+            success, message = False, f"Failed to execute chain '{self.chain_name}': {e}"
+        return self._finish_run(success, message)
+
+    def _drive(self, steps):
+        """Carry out the steps of a policy generator of BaseChainExecutor. Returns what it returns."""
+        result, error = None, None
+        while True:
+            try:
+                step = steps.send(result) if error is None else steps.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            result, error = None, None
+            try:
+                result = step[0](*step[1:])
+            except BaseException as e:
+                error = e
+
+    def _start_link(self, index):
+        threading.Thread(target=self._run_link_thread, args=(index,), name=f"chain-{self.chain_name}-link-{index}", daemon=True).start()
+
+    def _run_link_thread(self, index):
+        self._finished.put((index, *self._drive(self._run_link(index))))
+
+    def _wait_link(self):
+        """Return the (index, success, message) of the next link that finished."""
+        return self._finished.get()
+
+    def _check_link(self, index, link):
+        return self._check_unchanged(index, link)
+
+    def _sleep(self, delay):
+        """Wait 'delay' seconds. Returns True if the chain was cancelled meanwhile."""
+        return self._cancelled.wait(delay)
+
+    def _acquire(self, shell):
+        return self.dispatcher.acquire(shell, self.priority, self._cancelled)
+
+    def _spawn(self, index, link, attempt, command):
+        """Start the process of a link. Returns it with the OutputCapture of its output, if captured."""
+        output = subprocess.PIPE if self.run_log is not None else subprocess.DEVNULL
+        with span("subprocess.Popen", chain=self.chain_name, link=index):
+            process = subprocess.Popen(
+                command,
+                cwd=link.cwd, # Ensure the script runs in its directory
+                stdout=output,
+                stderr=output,
+                stdin=subprocess.DEVNULL,
+                start_new_session=True,
+            )
+        with self._lock:
+            self._processes[index] = process
+            cancelled = self.cancelled
+        if cancelled:
+            kill_process_group(process) # Cancelled while the link was starting
+        capture = self.run_log.capture(process, index, attempt) if self.run_log is not None else None
+        return process, capture
+
+    def _wait(self, process, timeout):
+        """Wait for a process to exit. Returns its exit code, or None if it runs longer than 'timeout' seconds."""
+        try:
+            return process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            return None
+
+    def _kill(self, process):
+        kill_process_group(process)
+        return process.returncode
+
+    def _drain(self, capture):
+        capture.drain()
+
+    def _forget(self, index, capture):
+        with self._lock:
+            self._processes.pop(index, None)
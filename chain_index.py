@@ -0,0 +1,102 @@
+import bisect
+from itertools import accumulate, compress
+
+SHORT_QUERY_LENGTH = 3 # Queries shorter than this match so many names that scanning them one by one is faster
+SEPARATOR = "\0" # Cannot appear in a file name, so a match never spans two names
+
+def chain_sort_key(name):
+    """Return the key chain names are sorted by: case-insensitive, then by name."""
+    return (name.lower(), name)
+
+class ChainIndex:
+    """An in-memory index of chain names for listing and as-you-type filtering.
+
+    Names are kept sorted case-insensitively, so adding or removing a name
+    returns the position at which the list shown to the user changes. For
+    filtering, the lowercase names are joined into a single string in sorted
+    order, which is searched with str.find; the offset of each match is mapped
+    back to its name by a binary search over the start offsets of the names, and
+    the search resumes at the next name. The joined string is rebuilt by the
+    first search after a change. Queries shorter than SHORT_QUERY_LENGTH test
+    each name instead.
+    """
+
+    def __init__(self, names=()):
+        self._keys = [] # Lowercase names, sorted
+        self._names = [] # Names, in the order of _keys
+        self._text = None # _keys joined by SEPARATOR
+        self._starts = None # Offset of each name in _text
+        self.reset(names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def _position(self, name, key):
+        """Return the position of 'name' in the sorted names, or the position it would be inserted at."""
+        position = bisect.bisect_left(self._keys, key)
+        # Names that only differ in case share a key and are ordered by name
+        while position < len(self._keys) and self._keys[position] == key and self._names[position] < name:
+            position += 1
+        return position
+
+    def __contains__(self, name):
+        position = self._position(name, name.lower())
+        return position < len(self._names) and self._names[position] == name
+
+    def reset(self, names):
+        """Replace the indexed names."""
+        entries = sorted((name.lower(), name) for name in set(names))
+        self._keys = [key for key, _ in entries]
+        self._names = [name for _, name in entries]
+        self._text = None
+
+    def names(self):
+        """Return every name in sorted order."""
+        return list(self._names)
+
+    def add(self, name):
+        """Add a name. Returns its position in the sorted names, or None if it was already indexed."""
+        key = name.lower()
+        position = self._position(name, key)
+        if position < len(self._names) and self._names[position] == name:
+            return None
+        self._keys.insert(position, key)
+        self._names.insert(position, name)
+        self._text = None
+        return position
+
+    def remove(self, name):
+        """Remove a name. Returns the position it had in the sorted names, or None if it was not indexed."""
+        position = self._position(name, name.lower())
+        if position == len(self._names) or self._names[position] != name:
+            return None
+        del self._keys[position]
+        del self._names[position]
+        self._text = None
+        return position
+
+    def search(self, query):
+        """Return the names containing 'query', ignoring case, in sorted order."""
+        query = query.lower()
+        if not query:
+            return self.names()
+        if len(query) < SHORT_QUERY_LENGTH:
+            return list(compress(self._names, [query in key for key in self._keys]))
+
+        if self._text is None:
+            self._text = SEPARATOR.join(self._keys)
+            self._starts = [0]
+            self._starts.extend(accumulate(len(key) + 1 for key in self._keys[:-1]))
+
+        matches = []
+        find = self._text.find
+        starts = self._starts
+        count = len(starts)
+        offset = find(query)
+        while offset != -1:
+            position = bisect.bisect_right(starts, offset) - 1
+            matches.append(self._names[position])
+            if position + 1 == count:
+                break
+            offset = find(query, starts[position + 1])
+        return matches
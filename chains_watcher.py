@@ -0,0 +1,143 @@
+import ctypes
+import ctypes.util
+import os
+import struct
+import sys
+
+# inotify event flags, see inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+INOTIFY_EVENT = struct.Struct("iIII")
+INOTIFY_READ_SIZE = 64 * 1024
+
+class Inotify:
+    """A non-blocking inotify watch on the entries of one directory (Linux only)."""
+
+    def __init__(self, directory):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch failed for '{directory}'")
+
+    def read_events(self):
+        """Return the pending (mask, name) events, or an empty list if there are none."""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, INOTIFY_READ_SIZE)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+                offset += length
+                events.append((mask, name))
+
+    def close(self):
+        os.close(self.fd)
+
+def create_inotify(directory):
+    """Return an Inotify watch on 'directory', or None if inotify is not available."""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        return Inotify(directory)
+    except (OSError, AttributeError):
+        return None
+
+class ChainsWatcher:
+    """Reports the chain files added to and removed from the Chains directory.
+
+    With inotify, the file names are taken from the events, so the directory is
+    only listed again if the kernel dropped events. Without it, the modification
+    time of the directory is compared on every poll and the directory is listed
+    again when it changed. Replacing a chain file with a new version is not
+    reported by 'poll', since it neither adds nor removes a chain, but collected
+    for 'take_changed'.
+    """
+
+    def __init__(self, chains_dir, use_inotify=True):
+        self.chains_dir = chains_dir
+        self._names = set()
+        self._changed = set() # Chains written since take_changed, None if unknown
+        self._dir_mtime = None
+        self._inotify = create_inotify(chains_dir) if use_inotify else None
+        self._scan()
+
+    @staticmethod
+    def _chain_name(filename):
+        if filename.endswith(".csv"):
+            return filename[:-len(".csv")]
+        return None
+
+    def _scan(self):
+        """List the directory again. Returns the (added, removed) chain names."""
+        self._dir_mtime = os.stat(self.chains_dir).st_mtime_ns
+        names = {name for name in map(self._chain_name, os.listdir(self.chains_dir)) if name is not None}
+        added, removed = names - self._names, self._names - names
+        self._names = names
+        return added, removed
+
+    def _apply_events(self, events):
+        added, removed = set(), set()
+        for mask, filename in events:
+            if mask & (IN_Q_OVERFLOW | IN_IGNORED):
+                # Events were lost or the directory itself went away, fall back to listing it
+                if mask & IN_IGNORED:
+                    self._inotify.close()
+                    self._inotify = None
+                self._changed = None # The writes in the lost events are not known
+                scan_added, scan_removed = self._scan()
+                return (added | scan_added) - scan_removed, (removed | scan_removed) - scan_added
+
+            name = self._chain_name(filename)
+            if name is None:
+                continue
+            if self._changed is not None and mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                self._changed.add(name)
+            if mask & IN_CLOSE_WRITE:
+                continue
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                if name not in self._names:
+                    self._names.add(name)
+                    added.add(name)
+                    removed.discard(name)
+            elif name in self._names:
+                self._names.remove(name)
+                removed.add(name)
+                added.discard(name)
+        return added, removed
+
+    def poll(self):
+        """Return the (added, removed) chain names since the previous poll."""
+        if self._inotify is not None:
+            events = self._inotify.read_events()
+            return self._apply_events(events) if events else (set(), set())
+        if os.stat(self.chains_dir).st_mtime_ns == self._dir_mtime:
+            return set(), set()
+        return self._scan()
+
+    def take_changed(self):
+        """Return the chains written since the previous call, or None if inotify dropped events.
+
+        Only 'poll' collects them, so call it first. Without inotify, chain files
+        that were written but not added are not noticed.
+        """
+        changed, self._changed = self._changed, set()
+        return changed
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
@@ -0,0 +1,277 @@
+"""A resident process that runs chains on request over a Unix domain socket.
+
+Each request is one line of JSON holding an "action" and its arguments, and is
+answered by one line of JSON with "ok" set to true, or to false with an "error"
+message. A request's "id", if any, is copied into its response.
+
+    {"action": "list"}
+    {"action": "run", "chain": <name>, "wait": false, "priority": 0}
+    {"action": "status", "run_id": <id>}    (every known run without "run_id")
+    {"action": "cancel", "run_id": <id>}
+
+The storage backend, the shell tables and the settings stay loaded between
+requests, and with the CSV backend the chain names are kept up to date by a
+ChainsWatcher. The compiled plan of each chain run is kept in memory, so a
+request costs neither a Python start nor a validation pass, and running an
+unchanged chain again costs a few stat calls. Chains run as
+AsyncChainExecutor tasks of the daemon's event loop, so many concurrent runs
+do not cost a thread per running link.
+"""
+import asyncio
+import json
+import os
+import signal
+import socket
+import time
+from collections import deque
+from async_executor import AsyncChainExecutor, use_pidfd_child_watcher
+from chain_executor import LINK_STARTED, LINK_FINISHED, LINK_SKIPPED, CHAIN_FINISHED
+from chain_index import chain_sort_key
+from chains_watcher import ChainsWatcher
+from dispatcher import PRIORITY_INTERACTIVE, get_dispatcher
+from execution_plan import PlanCache
+from storage import get_storage
+from utils import CHAINS_DIR, PLANS_DIR, DAEMON_SOCKET_FILE, DAEMON_MAX_REQUEST_SIZE, DAEMON_MAX_FINISHED_RUNS, confirm_dir_existence
+
+class RequestError(Exception):
+    """A request that cannot be served. The message is sent back to the client."""
+
+class LoopEvents:
+    """Passes the events of an executor, which may be posted from worker threads, to a callback on the event loop."""
+
+    def __init__(self, loop, callback):
+        self.loop = loop
+        self.callback = callback
+
+    def put(self, event):
+        self.loop.call_soon_threadsafe(self.callback, event)
+
+class DaemonRun:
+    """A chain run started by the daemon. Only used from the event loop thread."""
+
+    def __init__(self, run_id, chain_name, plan, priority, loop, on_finished):
+        self.run_id = run_id
+        self.chain_name = chain_name
+        self.state = "running"
+        self.message = None
+        self.exit_code = None
+        self.started = time.time()
+        self.duration = None
+        self.links = {}
+        self.done = asyncio.Event()
+        self.on_finished = on_finished
+        self.executor = AsyncChainExecutor(chain_name, plan, LoopEvents(loop, self._on_event), priority=priority)
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        try:
+            await self.executor.run()
+        except asyncio.CancelledError:
+            pass # Reported by the CHAIN_FINISHED event
+
+    def _on_event(self, event):
+        if event.kind == LINK_STARTED:
+            self.links[event.link_index] = {"index": event.link_index, "command": event.detail, "exit_code": None}
+        elif event.kind == LINK_FINISHED:
+            self.links[event.link_index]["exit_code"] = event.detail
+        elif event.kind == LINK_SKIPPED:
+            self.links[event.link_index] = {"index": event.link_index, "command": event.detail, "exit_code": None, "skipped": True}
+        elif event.kind == CHAIN_FINISHED:
+            success, self.message = event.detail
+            if success:
+                self.state = "succeeded"
+            else:
+                self.state = "cancelled" if self.executor.cancelled else "failed"
+            self.exit_code = self.executor.get_exit_code()
+            self.duration = time.time() - self.started
+            self.done.set()
+            self.on_finished(self)
+
+    def _link_dict(self, index):
+        link = dict(self.links[index])
+        if index in self.executor.attempts:
+            link.update(
+                attempts=self.executor.attempts[index],
+                duration=round(self.executor.durations[index], 6),
+                timed_out=index in self.executor.timed_out,
+            )
+        return link
+
+    def to_dict(self):
+        return {
+            "run_id": self.run_id,
+            "chain": self.chain_name,
+            "state": self.state,
+            "message": self.message,
+            "exit_code": self.exit_code,
+            "started": self.started,
+            "duration": None if self.duration is None else round(self.duration, 6),
+            "links": [self._link_dict(i) for i in sorted(self.links)],
+        }
+
+class Daemon:
+    """Serves run, status, cancel and list requests on 'socket_path' until stopped."""
+
+    def __init__(self, socket_path=DAEMON_SOCKET_FILE):
+        self.socket_path = socket_path
+        self.storage = get_storage()
+        self.storage.list_shells() # Load the shell tables before the first request
+        self.watcher = ChainsWatcher(CHAINS_DIR) if self.storage.name == "CSV" else None
+        self.chain_names = set(self.storage.list_chains())
+        self.plans = PlanCache(PLANS_DIR)
+        self.runs = {}
+        self._finished = deque() # Ids of finished runs, oldest first
+        self._next_run_id = 1
+        self._loop = None
+        self._stopping = None
+
+    def _refresh_chain_names(self):
+        if self.watcher is None:
+            self.chain_names = set(self.storage.list_chains())
+            return
+        added, removed = self.watcher.poll()
+        self.chain_names -= removed
+        self.chain_names |= added
+
+    def _get_run(self, request):
+        run_id = request.get("run_id")
+        run = self.runs.get(run_id)
+        if run is None:
+            raise RequestError(f"Run {run_id} does not exist.")
+        return run
+
+    async def _run(self, request):
+        chain_name = request.get("chain")
+        self._refresh_chain_names()
+        if chain_name not in self.chain_names:
+            raise RequestError(f"Chain '{chain_name}' does not exist.")
+        priority = request.get("priority", PRIORITY_INTERACTIVE)
+        if not isinstance(priority, int):
+            raise RequestError("'priority' must be a whole number, lower ones start first.")
+
+        run = DaemonRun(self._next_run_id, chain_name, self.plans.get(chain_name, self.storage), priority, self._loop, self._retire)
+        self._next_run_id += 1
+        self.runs[run.run_id] = run
+        run.start()
+        if request.get("wait"):
+            await run.done.wait()
+        return {"run": run.to_dict()}
+
+    def _retire(self, run):
+        """Forget the oldest finished runs once more than DAEMON_MAX_FINISHED_RUNS have finished."""
+        self._finished.append(run.run_id)
+        while len(self._finished) > DAEMON_MAX_FINISHED_RUNS:
+            self.runs.pop(self._finished.popleft(), None)
+
+    async def _status(self, request):
+        if "run_id" not in request:
+            return {"runs": [run.to_dict() for run in self.runs.values()]}
+        return {"run": self._get_run(request).to_dict()}
+
+    async def _cancel(self, request):
+        run = self._get_run(request)
+        if run.state == "running":
+            run.executor.cancel()
+            await run.done.wait()
+        return {"run": run.to_dict()}
+
+    async def _list(self, request):
+        self._refresh_chain_names()
+        return {
+            "chains": sorted(self.chain_names, key=chain_sort_key),
+            "running": [run.run_id for run in self.runs.values() if run.state == "running"],
+            "queued_links": get_dispatcher().get_queue_depth(),
+        }
+
+    async def handle_request(self, line):
+        """Serve one request line. Returns the response as a dict."""
+        handlers = {"run": self._run, "status": self._status, "cancel": self._cancel, "list": self._list}
+        request = {}
+        try:
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                raise RequestError(f"Request is not valid JSON: {e}.")
+            if not isinstance(request, dict) or request.get("action") not in handlers:
+                raise RequestError(f"Request needs an 'action' out of {', '.join(handlers)}.")
+            response = {"ok": True}
+            response.update(await handlers[request["action"]](request))
+        except RequestError as e:
+            response = {"ok": False, "error": str(e)}
+        except Exception as e:
+            response = {"ok": False, "error": f"Error: {e}"}
+        if isinstance(request, dict) and "id" in request:
+            response["id"] = request["id"]
+        return response
+
+    async def _serve_client(self, reader, writer):
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    writer.write(b'{"ok": false, "error": "Request is too long."}\n')
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                response = await self.handle_request(line)
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass # The client went away
+        finally:
+            writer.close()
+
+    def _remove_stale_socket(self):
+        """Remove a socket file left behind by a daemon that did not stop cleanly. Raises RuntimeError if one is running."""
+        if not os.path.exists(self.socket_path):
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.socket_path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.remove(self.socket_path)
+            return
+        finally:
+            probe.close()
+        raise RuntimeError(f"A daemon is already listening on '{self.socket_path}'.")
+
+    def stop(self):
+        """Stop serving. Can be called from the event loop thread only."""
+        if self._stopping is not None:
+            self._stopping.set()
+
+    async def serve(self):
+        """Serve requests until stop() is called, then cancel the runs still going."""
+        self._loop = asyncio.get_running_loop()
+        use_pidfd_child_watcher(self._loop)
+        self._stopping = asyncio.Event()
+        confirm_dir_existence(os.path.dirname(self.socket_path) or ".")
+        self._remove_stale_socket()
+        server = await asyncio.start_unix_server(self._serve_client, self.socket_path, limit=DAEMON_MAX_REQUEST_SIZE)
+        os.chmod(self.socket_path, 0o600) # Only the owner may run chains through the daemon
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            self._loop.add_signal_handler(signum, self.stop)
+        try:
+            await self._stopping.wait()
+        finally:
+            server.close()
+            await server.wait_closed()
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                self._loop.remove_signal_handler(signum)
+            running = [run for run in self.runs.values() if run.state == "running"]
+            for run in running:
+                run.executor.cancel()
+            for run in running:
+                await run.done.wait()
+            if self.watcher is not None:
+                self.watcher.close()
+            try:
+                os.remove(self.socket_path)
+            except FileNotFoundError:
+                pass
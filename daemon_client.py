@@ -0,0 +1,16 @@
+"""A client for the daemon in daemon.py, kept free of heavy imports so that sending a request starts quickly."""
+import json
+import socket
+from utils import DAEMON_SOCKET_FILE
+
+def send_request(request, socket_path=DAEMON_SOCKET_FILE, timeout=None):
+    """Send one request to a running daemon and return its response. Raises OSError if no daemon is listening."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(socket_path)
+        client.sendall(json.dumps(request).encode() + b"\n")
+        with client.makefile("rb") as responses:
+            line = responses.readline()
+    if not line:
+        raise ConnectionError("The daemon closed the connection without responding.")
+    return json.loads(line)
@@ -0,0 +1,237 @@
+import csv
+import heapq
+import itertools
+import os
+import threading
+from collections import Counter, namedtuple
+from utils import SHELL_LIMITS_FILE, get_max_processes
+
+# Priorities of queued links, lower ones start first
+PRIORITY_INTERACTIVE = 0 # Chains started by the user
+PRIORITY_BACKGROUND = 1 # Chains started by the scheduler
+
+# Limits for the links run with a shell. None means no limit.
+ShellLimits = namedtuple("ShellLimits", ["max_processes", "max_memory_mb", "max_cpu_seconds"])
+
+RESOURCE_LIMITER_SHELL = "/bin/sh" # Sets the memory and CPU time limits of a link before running it
+
+def _parse_limit(value, name):
+    value = value.strip()
+    if value == "":
+        return None
+    if not value.isdigit() or int(value) == 0:
+        raise ValueError(f"{name} '{value}' is not a positive whole number")
+    return int(value)
+
+def load_shell_limits(limits_file):
+    """Return a dict of shell path -> ShellLimits read from 'limits_file'."""
+    limits = {}
+    try:
+        with open(limits_file, "r", newline="") as f:
+            for row in csv.reader(f):
+                if not row:
+                    continue
+                if len(row) != 4:
+                    raise ValueError(f"limits '{','.join(row)}' are improperly formatted")
+                limits[row[0]] = ShellLimits(
+                    _parse_limit(row[1], "process limit"),
+                    _parse_limit(row[2], "memory limit"),
+                    _parse_limit(row[3], "CPU time limit"),
+                )
+    except FileNotFoundError:
+        pass
+    return limits
+
+def save_shell_limits(limits_file, limits):
+    os.makedirs(os.path.dirname(limits_file) or ".", exist_ok=True)
+    directory, filename = os.path.split(limits_file)
+    temp_file = os.path.join(directory, f".{filename}.tmp")
+    with open(temp_file, "w", newline="") as f:
+        csv.writer(f, lineterminator="\n").writerows(
+            [shell] + ["" if value is None else value for value in shell_limits] for shell, shell_limits in sorted(limits.items())
+        )
+    os.replace(temp_file, limits_file)
+
+def apply_resource_limits(command, shell_limits):
+    """Return the argument list that runs 'command' under the memory and CPU time limits of its shell.
+
+    The limits are set with 'ulimit' by a POSIX shell that then replaces itself
+    with the command, so they apply from the command's first instruction. A
+    preexec_fn would do the same without the extra exec, but is not safe in a
+    process running threads. Commands without limits, and every command on
+    Windows, are returned unchanged.
+    """
+    if os.name != "posix" or shell_limits is None:
+        return command
+    limits = []
+    if shell_limits.max_memory_mb is not None:
+        limits.append(f"ulimit -v {shell_limits.max_memory_mb * 1024}") # In kilobytes
+    if shell_limits.max_cpu_seconds is not None:
+        limits.append(f"ulimit -t {shell_limits.max_cpu_seconds}")
+    if not limits:
+        return command
+    return [RESOURCE_LIMITER_SHELL, "-c", " && ".join(limits) + ' && exec "$@"', RESOURCE_LIMITER_SHELL] + list(command)
+
+class RunDispatcher:
+    """Hands out the right to start a link process, limiting how many run at once.
+
+    At most 'get_max_processes()' link processes run in the whole application
+    (None means no limit), and at most the 'max_processes' of its ShellLimits
+    per shell. Links that cannot start wait in a queue ordered by priority and
+    then by arrival; when a process exits, the queued links that fit are
+    started in that order, so a link waiting for a busy shell does not hold up
+    the links of other shells. Both limits are read again whenever links are
+    dispatched, so changes take effect without a restart. Callbacks passed to
+    'subscribe' are called with the new queue depth whenever it changes, from
+    whichever thread changed it.
+    """
+
+    def __init__(self, limits_file=SHELL_LIMITS_FILE, max_processes=get_max_processes):
+        self.limits_file = limits_file
+        self.max_processes = max_processes
+        self._condition = threading.Condition()
+        self._queue = [] # Heap of [priority, sequence, shell, granted, on_granted]
+        self._sequence = itertools.count()
+        self._running = 0
+        self._running_per_shell = Counter()
+        self._limits = {}
+        self._limits_signature = None
+        self._subscribers = []
+        self._reported_depth = 0
+
+    def get_limits(self, shell):
+        """Return the ShellLimits of 'shell', or None. The limits file is read again when it changes."""
+        try:
+            stat = os.stat(self.limits_file)
+            signature = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            signature = None
+        with self._condition:
+            if signature != self._limits_signature:
+                try:
+                    self._limits = load_shell_limits(self.limits_file)
+                except (OSError, ValueError):
+                    self._limits = {} # Reported by the state validation
+                self._limits_signature = signature
+            return self._limits.get(shell)
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def _queue_changed(self):
+        """Report a new queue depth to the subscribers. Called with the condition held, so callbacks must not block."""
+        depth = len(self._queue)
+        if depth == self._reported_depth:
+            return
+        self._reported_depth = depth
+        for callback in list(self._subscribers):
+            callback(depth)
+
+    def _dispatch(self):
+        """Grant the queued links that fit within the limits. Called with the condition held."""
+        max_processes = self.max_processes()
+        skipped = []
+        granted = False
+        while self._queue and (max_processes is None or self._running < max_processes):
+            entry = heapq.heappop(self._queue)
+            shell = entry[2]
+            shell_limits = self.get_limits(shell)
+            if shell_limits is not None and shell_limits.max_processes is not None and self._running_per_shell[shell] >= shell_limits.max_processes:
+                skipped.append(entry)
+                continue
+            if entry[4] is not None and not entry[4]():
+                continue # Its event loop was closed, so nothing waits for the link anymore
+            entry[3] = True
+            self._running += 1
+            self._running_per_shell[shell] += 1
+            granted = True
+        for entry in skipped:
+            heapq.heappush(self._queue, entry)
+        if granted:
+            self._condition.notify_all()
+        self._queue_changed()
+
+    def acquire(self, shell, priority=PRIORITY_INTERACTIVE, cancelled=None):
+        """Wait until a link of 'shell' may start. Returns False if 'cancelled' (a threading.Event) was set first."""
+        with self._condition:
+            entry = [priority, next(self._sequence), shell, False, None]
+            heapq.heappush(self._queue, entry)
+            self._dispatch()
+            while not entry[3]:
+                if cancelled is not None and cancelled.is_set():
+                    self._queue.remove(entry)
+                    heapq.heapify(self._queue)
+                    self._queue_changed()
+                    return False
+                self._condition.wait()
+            return True
+
+    async def acquire_async(self, shell, priority=PRIORITY_INTERACTIVE):
+        """Like acquire, but waits without blocking the running event loop.
+
+        If the waiting coroutine is cancelled, the link leaves the queue (or
+        gives its process slot back if it was granted meanwhile).
+        """
+        import asyncio # Imported here so the command line and the thread executors do not load it
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def on_granted():
+            # Called by whichever thread dispatches the link, with the condition held
+            try:
+                loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+                return True
+            except RuntimeError:
+                return False
+
+        with self._condition:
+            entry = [priority, next(self._sequence), shell, False, on_granted]
+            heapq.heappush(self._queue, entry)
+            self._dispatch()
+        try:
+            await granted
+        except asyncio.CancelledError:
+            with self._condition:
+                if entry[3]:
+                    self.release(shell)
+                else:
+                    self._queue.remove(entry)
+                    heapq.heapify(self._queue)
+                    self._queue_changed()
+            raise
+
+    def release(self, shell):
+        """Report that a link process of 'shell' exited, letting queued links start."""
+        with self._condition:
+            self._running -= 1
+            self._running_per_shell[shell] -= 1
+            if self._running_per_shell[shell] == 0:
+                del self._running_per_shell[shell]
+            self._dispatch()
+
+    def wake(self):
+        """Let waiting links check whether they were cancelled."""
+        with self._condition:
+            self._condition.notify_all()
+
+    def get_queue_depth(self):
+        """Return the number of links waiting to start."""
+        return len(self._queue)
+
+    def get_running_count(self):
+        return self._running
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+def get_dispatcher():
+    """Return the dispatcher shared by every chain run in this process."""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = RunDispatcher()
+        return _dispatcher
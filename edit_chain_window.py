@@ -1,16 +1,19 @@
 import tkinter as tk
 from tkinter import Toplevel, messagebox, filedialog, ttk, StringVar
 import os
-import csv
-from utils import listbox_clicked_dead_space, get_setting, prevent_focus, normalize_path
+from chain_index import chain_sort_key
+from execution_plan import find_chain_cycle
+from incremental import is_incremental_chain, set_incremental_chain
+from storage import get_storage
+from tracing import traced_methods
+from utils import CHAIN_LINK_SHELL, INPUT_DELIMITER, listbox_clicked_dead_space, get_setting, prevent_focus, normalize_path, get_link_dependencies, get_link_inputs, is_chain_link, validate_link_options, remove_chain_links, split_link_row, join_link_row, settings
 
+@traced_methods
 class EditChainWindow:
-    def __init__(self, root, chain_listbox, load_chains, chains_dir, shells_file, file_display_file, chain_name=None):
+    def __init__(self, root, chain_listbox, load_chains, file_display_file, chain_name=None):
         self.root = root
         self.chain_listbox = chain_listbox
         self.load_chains = load_chains
-        self.chains_dir = chains_dir
-        self.shells_file = shells_file
         self.file_display_file = file_display_file
         self.chain_name = chain_name
         self.file_display_setting = get_setting(self.file_display_file)
@@ -22,18 +25,27 @@ class EditChainWindow:
         self.selected_script = StringVar() # The stored value of the selected script
         self.selected_shell_alias = StringVar() # The display value of the selected shell. The stored value is accessed by index in the shells list
         self.selected_script_alias = StringVar() # The display value of the selected script
+        self.selected_chain = StringVar() # The name of the chain to include
+        self.custom_order = tk.BooleanVar() # Whether the link lists its own dependencies instead of following the previous link
+        self.run_after = StringVar() # The indices of the links the link depends on, separated by DEPENDENCY_DELIMITER
+        self.inputs = StringVar() # The input files of the link, separated by INPUT_DELIMITER
+        self.timeout = StringVar() # The seconds the link may run before it is killed, empty for no limit
+        self.retries = StringVar() # How many times the link is run again after failing, empty for none
+        self.incremental = tk.BooleanVar(value=bool(chain_name) and is_incremental_chain(chain_name)) # Whether unchanged links are skipped
 
         self._create_window()
 
     def _create_window(self):
         self.edit_chain_window = Toplevel(self.root)
         self.edit_chain_window.title("Edit Execution Chain")
-        self.edit_chain_window.geometry("500x500")
+        self.edit_chain_window.geometry("500x675")
         self.edit_chain_window.resizable(False, False)
         self.edit_chain_window.bind("<Button-1>", self._handle_outside_click)
         self.edit_chain_window.transient(self.root)
         self.edit_chain_window.grab_set()
         self.edit_chain_window.protocol("WM_DELETE_WINDOW", self._on_close)
+        self.edit_chain_window.bind("<Destroy>", self._on_destroy)
+        settings.subscribe(self._on_setting_changed)
 
         self._create_widgets()
         self._initialize_data()
@@ -43,6 +55,23 @@ class EditChainWindow:
         self.edit_chain_window.grab_release()
         self.edit_chain_window.destroy()
 
+    def _on_destroy(self, event):
+        if event.widget == self.edit_chain_window:
+            settings.unsubscribe(self._on_setting_changed)
+
+    def _on_setting_changed(self, settings_file, value):
+        """Display the shell and script paths again when the file display setting changes."""
+        if settings_file != self.file_display_file:
+            return
+        selected_shell_index = self.shell_dropdown.current()
+        self.file_display_setting = value
+        self.displayed_shells = self.get_display_strings(self.shells)
+        self.shell_dropdown['values'] = self.displayed_shells
+        if selected_shell_index != -1:
+            self.selected_shell_alias.set(self.displayed_shells[selected_shell_index])
+        if self.selected_script.get():
+            self.selected_script_alias.set(self.get_display_string(self.selected_script.get()))
+
     def _create_widgets(self):
         field_width = 50
         button_width = 8
@@ -56,6 +85,12 @@ class EditChainWindow:
         if self.chain_name:
             self.chain_name_entry.insert(0, self.chain_name)
 
+        # Incremental execution
+        incremental_frame = tk.Frame(self.edit_chain_window)
+        incremental_frame.pack(fill=tk.X)
+        self.incremental_checkbutton = tk.Checkbutton(incremental_frame, text="Incremental (skip links whose script and inputs are unchanged)", variable=self.incremental)
+        self.incremental_checkbutton.pack(side=tk.LEFT, padx=5)
+
         # Shell dropdown
         shell_frame = tk.Frame(self.edit_chain_window)
         shell_frame.pack(pady=5, fill=tk.X)
@@ -83,6 +118,48 @@ class EditChainWindow:
         self.select_script_button = tk.Button(script_frame, width=button_width, text="Browse", command=self._select_script)
         self.select_script_button.pack(side=tk.LEFT, padx=5)
 
+        # Input files
+        inputs_frame = tk.Frame(self.edit_chain_window)
+        inputs_frame.pack(pady=5, fill=tk.X)
+        ttk.Label(inputs_frame, text="Inputs:", width=15).pack(side=tk.LEFT, padx=5)
+        self.inputs_entry = tk.Entry(inputs_frame, textvariable=self.inputs, width=field_width)
+        self.inputs_entry.pack(side=tk.LEFT, padx=5)
+        self.select_inputs_button = tk.Button(inputs_frame, width=button_width, text="Browse", command=self._select_inputs)
+        self.select_inputs_button.pack(side=tk.LEFT, padx=5)
+
+        # Timeout and retries
+        limits_frame = tk.Frame(self.edit_chain_window)
+        limits_frame.pack(pady=5, fill=tk.X)
+        ttk.Label(limits_frame, text="Timeout (s):", width=15).pack(side=tk.LEFT, padx=5)
+        self.timeout_entry = tk.Entry(limits_frame, textvariable=self.timeout, width=10)
+        self.timeout_entry.pack(side=tk.LEFT, padx=5)
+        ttk.Label(limits_frame, text="Retries:").pack(side=tk.LEFT, padx=5)
+        self.retries_entry = tk.Entry(limits_frame, textvariable=self.retries, width=10)
+        self.retries_entry.pack(side=tk.LEFT, padx=5)
+
+        # Included chain
+        include_frame = tk.Frame(self.edit_chain_window)
+        include_frame.pack(pady=5, fill=tk.X)
+        ttk.Label(include_frame, text="Include Chain:", width=15).pack(side=tk.LEFT, padx=5)
+        self.chain_dropdown = ttk.Combobox(
+            include_frame,
+            textvariable=self.selected_chain,
+            state="readonly",
+            width=field_width - 3
+        )
+        self.chain_dropdown.pack(side=tk.LEFT, padx=5)
+        self.chain_dropdown.bind("<FocusIn>", prevent_focus)
+        self.add_chain_link_button = tk.Button(include_frame, width=button_width, text="Include", command=self._add_chain_include_link)
+        self.add_chain_link_button.pack(side=tk.LEFT, padx=5)
+
+        # Link dependencies
+        order_frame = tk.Frame(self.edit_chain_window)
+        order_frame.pack(pady=5, fill=tk.X)
+        self.custom_order_checkbutton = tk.Checkbutton(order_frame, text="Run After:", width=12, anchor="w", variable=self.custom_order, command=self._on_custom_order_toggle)
+        self.custom_order_checkbutton.pack(side=tk.LEFT, padx=5)
+        self.run_after_entry = tk.Entry(order_frame, textvariable=self.run_after, width=field_width, state="disabled")
+        self.run_after_entry.pack(side=tk.LEFT, padx=5)
+
         # Link buttons
         link_button_frame = tk.Frame(self.edit_chain_window)
         link_button_frame.pack(pady=10)
@@ -104,34 +181,36 @@ class EditChainWindow:
 
     def _initialize_data(self):
         self._load_shells_into_dropdown()
+        self._load_chains_into_dropdown()
         self._load_chain_links()
 
     def _load_shells_into_dropdown(self):
         """Load shells into the dropdown menu."""
         try:
-            with open(self.shells_file, "r") as f:
-                reader = csv.reader(f)
-                self.shells.clear()
-                for row in reader:
-                    if row:
-                        self.shells.append(row[0])
-                self.displayed_shells = self.get_display_strings(self.shells)
-                self.shell_dropdown['values'] = self.displayed_shells
+            self.shells.clear()
+            self.shells.extend(get_storage().list_shells())
+            self.displayed_shells = self.get_display_strings(self.shells)
+            self.shell_dropdown['values'] = self.displayed_shells
         except Exception as e:
             messagebox.showerror("Error", f"Failed to load shells: {e}")
 
+    def _load_chains_into_dropdown(self):
+        """Load the chains that can be included into the include chain dropdown."""
+        try:
+            chains = [chain for chain in get_storage().list_chains() if chain != self.chain_name]
+            self.chain_dropdown['values'] = sorted(chains, key=chain_sort_key)
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to load chains: {e}")
+
     def _load_chain_links(self):
         """Load chain links for editing."""
         self.link_listbox.delete(0, tk.END)
         if self.chain_name:
-            chain_file = os.path.join(self.chains_dir, f"{self.chain_name}.csv")
             try:
-                with open(chain_file, "r") as f:
-                    reader = csv.reader(f)
-                    for i, row in enumerate(reader):
-                        if len(row) == 2:
-                            self.link_listbox.insert(tk.END, f"Link-{i}")
-                            self.chain_links.append(row)
+                for row in get_storage().load_chain(self.chain_name):
+                    if len(split_link_row(row)[0]) in (2, 3):
+                        self.chain_links.append(row)
+                self._refresh_link_listbox()
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to load chain: {e}")
 
@@ -145,6 +224,14 @@ class EditChainWindow:
             # Enable the add link button if a shell is also selected
             if self.selected_shell_alias.get(): self.add_link_button.config(state="normal")
 
+    def _select_inputs(self):
+        """Open a file dialog to add input files to the link."""
+        filepaths = filedialog.askopenfilenames(title="Select Input Files")
+        if filepaths:
+            inputs = get_link_inputs({"inputs": self.inputs.get()})
+            inputs.extend(path for path in map(normalize_path, filepaths) if path not in inputs)
+            self.inputs.set(INPUT_DELIMITER.join(inputs))
+
     def _add_chain_link(self):
         """Add a new chain link."""
         shell = self.shells[self.shell_dropdown.current()]
@@ -152,9 +239,18 @@ class EditChainWindow:
         if not shell or not script:
             messagebox.showwarning("Warning", "Please select a shell and script.")
             return
-        self.chain_links.append([shell, script])
-        self.link_listbox.insert(tk.END, f"Link-{len(self.chain_links) - 1}")
+        self.chain_links.append(self._build_link(shell, script))
+        self._refresh_link_listbox()
     
+    def _add_chain_include_link(self):
+        """Add a link that runs the links of another chain."""
+        included_chain = self.selected_chain.get()
+        if not included_chain:
+            messagebox.showwarning("Warning", "Please select a chain to include.")
+            return
+        self.chain_links.append(self._build_link(CHAIN_LINK_SHELL, included_chain))
+        self._refresh_link_listbox()
+
     def _delete_chain_link(self):
         """Delete the selected chain link."""
         selected_index = self.link_listbox.curselection()
@@ -163,13 +259,11 @@ class EditChainWindow:
             return
 
         index = selected_index[0]
-        del self.chain_links[index]
+        self.chain_links = remove_chain_links(self.chain_links, [index])
         self.link_listbox.delete(index)
 
         # Update listbox display
-        self.link_listbox.delete(0, tk.END)
-        for i, _ in enumerate(self.chain_links):
-            self.link_listbox.insert(tk.END, f"Link-{i}")
+        self._refresh_link_listbox()
         messagebox.showinfo("Success", "Selected link deleted.")
     
     def _overwrite_selected_chain_link(self):
@@ -187,8 +281,41 @@ class EditChainWindow:
             messagebox.showwarning("Warning", "Please select both a shell and a script.")
             return
 
-        self.chain_links[index] = [shell, script]
+        self.chain_links[index] = self._build_link(shell, script)
+        self._refresh_link_listbox()
         messagebox.showinfo("Success", "Selected link updated.")
+
+    def _build_link(self, shell, script):
+        """Return the chain file row for a link, including its dependencies if custom order is enabled and its input files."""
+        columns = [shell, script]
+        if self.custom_order.get():
+            columns.append(self.run_after.get().replace(" ", ""))
+        options = {}
+        if shell != CHAIN_LINK_SHELL:
+            inputs = [normalize_path(path.strip()) for path in self.inputs.get().split(INPUT_DELIMITER) if path.strip()]
+            options["inputs"] = INPUT_DELIMITER.join(inputs)
+            options["timeout"] = self.timeout.get().strip()
+            options["retries"] = self.retries.get().strip()
+        return join_link_row(columns, options)
+
+    def _refresh_link_listbox(self):
+        self.link_listbox.delete(0, tk.END)
+        for i, link in enumerate(self.chain_links):
+            columns, options = split_link_row(link)
+            label = f"Link-{i}: chain '{link[1]}'" if is_chain_link(link) else f"Link-{i}"
+            if len(columns) > 2:
+                label += " (runs immediately)" if columns[2] == "" else f" (runs after {columns[2]})"
+            inputs = get_link_inputs(options)
+            if inputs:
+                label += f" [{len(inputs)} input(s)]"
+            if options.get("timeout"):
+                label += f" [timeout {options['timeout']}s]"
+            if options.get("retries"):
+                label += f" [{options['retries']} retries]"
+            self.link_listbox.insert(tk.END, label)
+
+    def _on_custom_order_toggle(self):
+        self.run_after_entry.config(state="normal" if self.custom_order.get() else "disabled")
     
     def _save_chain(self):
         """Save the chain to a CSV file."""
@@ -197,11 +324,26 @@ class EditChainWindow:
             messagebox.showwarning("Warning", "Please enter a chain name.")
             return
 
-        chain_file = os.path.join(self.chains_dir, f"{chain_name}.csv")
+        for i, link in enumerate(self.chain_links):
+            try:
+                get_link_dependencies(link, i)
+            except Exception as e:
+                messagebox.showwarning("Warning", f"Link-{i} has invalid dependencies: {e}.")
+                return
+            try:
+                validate_link_options(split_link_row(link)[1])
+            except Exception as e:
+                messagebox.showwarning("Warning", f"Link-{i} has invalid options: {e}.")
+                return
+
         try:
-            with open(chain_file, "w", newline="") as f:
-                writer = csv.writer(f)
-                writer.writerows(self.chain_links)
+            storage = get_storage()
+            cycle = find_chain_cycle(chain_name, self.chain_links, storage.load_chain)
+            if cycle is not None:
+                messagebox.showwarning("Warning", f"Chain '{chain_name}' would include itself: {' -> '.join(cycle)}.")
+                return
+            storage.save_chain(chain_name, self.chain_links)
+            set_incremental_chain(chain_name, self.incremental.get())
             messagebox.showinfo("Success", f"Chain '{chain_name}' saved successfully.")
             self.load_chains()
             self.edit_chain_window.destroy()
@@ -213,9 +355,19 @@ class EditChainWindow:
         try:
             selected_index = self.link_listbox.curselection()[0]
             selected_link = self.chain_links[selected_index]
-            self.selected_script.set(selected_link[1])
-            self.selected_shell_alias.set(self.get_display_string(selected_link[0]))
-            self.selected_script_alias.set(self.get_display_string(selected_link[1]))
+            columns, options = split_link_row(selected_link)
+            if is_chain_link(selected_link):
+                self.selected_chain.set(selected_link[1])
+            else:
+                self.selected_script.set(selected_link[1])
+                self.selected_shell_alias.set(self.get_display_string(selected_link[0]))
+                self.selected_script_alias.set(self.get_display_string(selected_link[1]))
+            self.custom_order.set(len(columns) > 2)
+            self.run_after.set(columns[2] if len(columns) > 2 else "")
+            self.inputs.set(options.get("inputs", ""))
+            self.timeout.set(options.get("timeout", ""))
+            self.retries.set(options.get("retries", ""))
+            self._on_custom_order_toggle()
 
             # Enable the delete and overwrite button if a selection is made
             self.add_link_button.config(state="normal")
@@ -238,7 +390,7 @@ class EditChainWindow:
                 self._on_deselect_link()
             else:
                 self._on_link_selection(event)
-        if widget != self.link_listbox and widget != self.chain_name_entry and widget != self.shell_dropdown and widget != self.select_script_button and widget != self.add_link_button and widget != self.delete_link_button and widget != self.overwrite_selected_link_button:
+        if widget != self.link_listbox and widget != self.chain_name_entry and widget != self.shell_dropdown and widget != self.chain_dropdown and widget != self.add_chain_link_button and widget != self.select_script_button and widget != self.add_link_button and widget != self.delete_link_button and widget != self.overwrite_selected_link_button and widget != self.custom_order_checkbutton and widget != self.run_after_entry and widget != self.inputs_entry and widget != self.timeout_entry and widget != self.retries_entry and widget != self.select_inputs_button and widget != self.incremental_checkbutton:
             self._on_deselect_link()
     
     def get_display_string(self, path):
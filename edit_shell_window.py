@@ -1,16 +1,19 @@
 import tkinter as tk
 from tkinter import Toplevel, messagebox, ttk
-from utils import detect_shell, normalize_path, get_shell_options, IDENTITIES_FILE, SHELL_OPTIONS_FILE
+from storage import get_storage
+from shell_detection import DETECTING_IDENTITY, submit_detection
+from tracing import traced_methods
+from utils import EXECUTION_POLL_INTERVAL, normalize_path
 
+@traced_methods
 class EditShellWindow:
     """A class to encapsulate the edit shell window logic."""
 
-    def __init__(self, root, selected_shell, selected_shell_identity, shell_index):
+    def __init__(self, root, selected_shell, selected_shell_identity):
         self.root = root
         self.selected_shell = selected_shell
         self.selected_shell_identity = selected_shell_identity
-        self.shell_index = shell_index
-        self.shell_options = get_shell_options(self.selected_shell)
+        self.shell_options = get_storage().get_shell_options(self.selected_shell)
         self.create_window()
         self.create_widgets()
 
@@ -37,7 +40,8 @@ class EditShellWindow:
         self.shell_identity_entry = tk.Entry(shell_identity_frame)
         self.shell_identity_entry.grid(row=0, column=1, sticky="w", padx=5, pady=5)
         self.shell_identity_entry.insert(0, self.selected_shell_identity)
-        ttk.Button(shell_identity_frame, text="Auto Detect", command=self.run_auto_detect).grid(row=0, column=2)
+        self.auto_detect_button = ttk.Button(shell_identity_frame, text="Auto Detect", command=self.run_auto_detect)
+        self.auto_detect_button.grid(row=0, column=2)
 
         # Command
         command_frame = tk.Frame(self.edit_shell_window)
@@ -59,12 +63,13 @@ class EditShellWindow:
 
         self.post_script_command_entry = tk.Entry(command_frame)
         self.post_script_command_entry.grid(row=1, column=4, sticky="w", padx=5, pady=5)
-        self.post_script_command_entry.insert(0, self.shell_options[3].rstrip())
+        self.post_script_command_entry.insert(0, self.shell_options[3])
 
         # Save button
         button_frame = tk.Frame(self.edit_shell_window)
         button_frame.grid(row=2, column=0, columnspan=2, sticky="s", pady=pady)
-        ttk.Button(button_frame, text="Save", command=self.save_shell_options).grid(row=0, column=0)
+        self.save_button = ttk.Button(button_frame, text="Save", command=self.save_shell_options)
+        self.save_button.grid(row=0, column=0)
 
     def _on_close(self):
         """Release grab and close the edit shell window."""
@@ -72,31 +77,32 @@ class EditShellWindow:
         self.edit_shell_window.destroy()
 
     def save_shell_options(self):
-        # Save identity
-        with open(IDENTITIES_FILE, "r") as f:
-            lines = f.readlines()
+        if self.shell_identity_entry.get() == DETECTING_IDENTITY:
+            messagebox.showwarning("Warning", "Wait for the shell identity to be detected before saving.")
+            return
 
-        lines[self.shell_index] = self.selected_shell + "," + self.shell_identity_entry.get() + "\n"
+        # Save identity and command
+        options = [self.shell_command_entry.get(), self.pre_script_command_entry.get(), self.script_command_entry.get(), self.post_script_command_entry.get().rstrip()]
+        get_storage().update_shell(self.selected_shell, self.shell_identity_entry.get(), options)
 
-        with open(IDENTITIES_FILE, "w") as f:
-            f.writelines(lines)
-
-        # Save command
-        with open(SHELL_OPTIONS_FILE, "r") as f:
-            lines = f.readlines()
-
-        for i in range(0, len(lines)):
-            options = lines[i].split(",")
-            if options[0] == self.selected_shell:
-                lines[i] = self.shell_command_entry.get() + "," + self.pre_script_command_entry.get() + "," + self.script_command_entry.get() + "," + self.post_script_command_entry.get().rstrip() + "\n"
-                break
-
-        with open(SHELL_OPTIONS_FILE, "w") as f:
-            f.writelines(lines)
-        
         messagebox.showinfo("Success", "Shell options saved successfully!")
         self.edit_shell_window.destroy()
 
     def run_auto_detect(self):
+        """Detect the shell identity on a worker thread, showing a placeholder until it finishes."""
+        self.shell_identity_entry.delete(0, tk.END)
+        self.shell_identity_entry.insert(0, DETECTING_IDENTITY)
+        self.auto_detect_button.config(state="disabled")
+        self.save_button.config(state="disabled") # The placeholder must not be saved as the identity
+        self._wait_for_detection(submit_detection(normalize_path(self.selected_shell)))
+
+    def _wait_for_detection(self, future):
+        if not self.edit_shell_window.winfo_exists():
+            return
+        if not future.done():
+            self.edit_shell_window.after(EXECUTION_POLL_INTERVAL, self._wait_for_detection, future)
+            return
         self.shell_identity_entry.delete(0, tk.END)
-        self.shell_identity_entry.insert(0, detect_shell(normalize_path(self.selected_shell)))
+        self.shell_identity_entry.insert(0, future.result())
+        self.auto_detect_button.config(state="normal")
+        self.save_button.config(state="normal")
@@ -0,0 +1,231 @@
+import json
+import os
+import threading
+from collections import namedtuple
+from storage import get_storage
+from tracing import traced
+from utils import PLANS_DIR, get_link_dependencies, get_link_inputs, get_link_retries, get_link_timeout, is_chain_link, split_link_row
+
+PLAN_FORMAT_VERSION = 4 # Plans saved in an older format are compiled again
+
+# 'argv' is empty and 'error' holds the message the link fails with when it
+# cannot run, for example because its script does not exist. 'inputs',
+# 'timeout' and 'retries' hold the input files, the seconds the link may run
+# (None for no limit) and the number of retries declared by its options.
+PlannedLink = namedtuple("PlannedLink", ["script", "argv", "cwd", "dependencies", "error", "inputs", "timeout", "retries"])
+# 'chains' holds the names of the chains included directly or indirectly.
+ExecutionPlan = namedtuple("ExecutionPlan", ["chain_name", "links", "chains"])
+
+def build_command(shell, script):
+    """Build the argument list used to run 'script' with 'shell'."""
+    shell_options = get_storage().get_shell_options(shell)
+    command = [shell]
+    if shell_options[1] != "": command.append(shell_options[1])
+    command.append(script)
+    if shell_options[3] != "": command.append(shell_options[3])
+    return command
+
+def _compile_link(row, dependencies):
+    columns, options = split_link_row(row)
+    shell, script = columns[:2]
+    argv, error, timeout, retries = (), None, None, 0
+    if not os.path.exists(script):
+        error = f"Script not found: {script}"
+    else:
+        try:
+            argv = tuple(build_command(shell, script))
+            timeout, retries = get_link_timeout(options), get_link_retries(options)
+        except Exception as e:
+            argv, error = (), f"Error executing '{script}': {e}"
+    return PlannedLink(script, argv, os.path.dirname(script), dependencies, error, tuple(get_link_inputs(options)), timeout, retries)
+
+def compile_plan(chain_name, chain_links, get_plan=None):
+    """Resolve the command, working directory and dependencies of every link of a chain.
+
+    A link that includes another chain is replaced by the links of the plan
+    returned by 'get_plan(name)', or by a failing link if it returns None. The
+    first links of the included chain run after the links the including link
+    runs after, and the links that run after the including link run after the
+    last links of the included chain.
+    """
+    links = []
+    chains = set()
+    exits = [] # Per row, the links that must succeed before the links that run after the row
+    for i, row in enumerate(chain_links):
+        dependencies = tuple(sorted({link for dependency in get_link_dependencies(row, i) for link in exits[dependency]}))
+        if not is_chain_link(row):
+            exits.append((len(links),))
+            links.append(_compile_link(row, dependencies))
+            continue
+
+        included_name = row[1]
+        included = get_plan(included_name) if get_plan is not None else None
+        if included is None:
+            exits.append((len(links),))
+            links.append(PlannedLink(included_name, (), "", dependencies, f"Chain not found: {included_name}", (), None, 0))
+            continue
+        chains.add(included_name)
+        chains.update(included.chains)
+        offset = len(links)
+        has_dependents = set()
+        for link in included.links:
+            has_dependents.update(link.dependencies)
+            if link.dependencies:
+                links.append(link._replace(dependencies=tuple(offset + dependency for dependency in link.dependencies)))
+            else:
+                links.append(link._replace(dependencies=dependencies))
+        # An empty chain is passed through to the links it runs after
+        exits.append(tuple(offset + j for j in range(len(included.links)) if j not in has_dependents) or dependencies)
+    return ExecutionPlan(chain_name, tuple(links), tuple(sorted(chains)))
+
+def find_chain_cycle(chain_name, chain_links, load_chain):
+    """Return the names along a cycle of included chains through 'chain_name' if it had 'chain_links', else None."""
+    visited = set()
+
+    def visit(rows, path):
+        for row in rows:
+            if not is_chain_link(row):
+                continue
+            included_name = row[1]
+            if included_name == chain_name:
+                return path + [included_name]
+            if included_name in visited:
+                continue
+            visited.add(included_name)
+            try:
+                included_rows = load_chain(included_name)
+            except Exception:
+                continue # A chain that does not exist cannot close a cycle
+            cycle = visit(included_rows, path + [included_name])
+            if cycle is not None:
+                return cycle
+        return None
+
+    return visit(chain_links, [chain_name])
+
+def get_script_signatures(scripts):
+    """Return the [mtime, size] of each script, or None for the scripts that do not exist."""
+    signatures = []
+    for script in scripts:
+        try:
+            stat = os.stat(script)
+            signatures.append([stat.st_mtime_ns, stat.st_size])
+        except OSError:
+            signatures.append(None)
+    return signatures
+
+class PlanCache:
+    """Keeps the compiled plan of each chain in memory and in one JSON file per chain.
+
+    A plan is reused while the storage signature (its chain file and the shell
+    options file, or the database) of the chain and of every chain it includes
+    and the modification time and size of every script it references are
+    unchanged. Reusing a plan costs one stat per file and, the first time in a
+    process, reading its JSON file. Included chains are flattened from their
+    own cached plans, so a change to one only compiles that chain again and
+    flattens the chains including it.
+    """
+
+    def __init__(self, plans_dir):
+        self.plans_dir = plans_dir
+        self._entries = {} # chain name -> ([storage name, {chain name: storage signature}], scripts, script signatures, plan)
+        self._lock = threading.Lock()
+
+    def _plan_file(self, chain_name):
+        return os.path.join(self.plans_dir, f"{chain_name}.json")
+
+    def _read(self, chain_name):
+        try:
+            with open(self._plan_file(chain_name), "r") as f:
+                data = json.load(f)
+            if data["version"] != PLAN_FORMAT_VERSION:
+                return None
+            links = tuple(
+                PlannedLink(script, tuple(argv), cwd, tuple(dependencies), error, tuple(inputs), timeout, retries)
+                for script, argv, cwd, dependencies, error, inputs, timeout, retries in data["links"]
+            )
+            return data["signature"], data["scripts"], data["script_signatures"], ExecutionPlan(chain_name, links, tuple(data["chains"]))
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _write(self, chain_name, entry):
+        signature, scripts, script_signatures, plan = entry
+        data = {
+            "version": PLAN_FORMAT_VERSION,
+            "signature": signature,
+            "scripts": scripts,
+            "script_signatures": script_signatures,
+            "links": [list(link) for link in plan.links],
+            "chains": list(plan.chains),
+        }
+        try:
+            os.makedirs(self.plans_dir, exist_ok=True)
+            temp_file = os.path.join(self.plans_dir, f".{chain_name}.json.tmp")
+            with open(temp_file, "w") as f:
+                json.dump(data, f)
+            os.replace(temp_file, self._plan_file(chain_name))
+        except OSError:
+            pass # The cache only speeds up the next run
+
+    def _signature(self, storage, chain_name):
+        try:
+            return json.loads(json.dumps(storage.get_plan_signature(chain_name))) # Normalize tuples to lists
+        except FileNotFoundError:
+            return None
+
+    def _is_current(self, entry, storage):
+        storage_name, signatures = entry[0]
+        if storage_name != storage.name:
+            return False
+        if any(self._signature(storage, name) != signature for name, signature in signatures.items()):
+            return False
+        return entry[2] == get_script_signatures(entry[1])
+
+    @traced
+    def get(self, chain_name, storage=None):
+        """Return the plan of a chain, compiling it again if anything it was compiled from changed.
+
+        Raises an exception if the chain includes itself, directly or through other chains.
+        """
+        storage = storage if storage is not None else get_storage()
+        with self._lock:
+            return self._get(chain_name, storage, [])
+
+    def _get(self, chain_name, storage, including):
+        """Return the plan of a chain included by the chains in 'including', outermost first."""
+        if chain_name in including:
+            cycle = including[including.index(chain_name):] + [chain_name]
+            raise Exception(f"chain '{chain_name}' includes itself ({' -> '.join(cycle)})")
+        entry = self._entries.get(chain_name)
+        if entry is None:
+            entry = self._read(chain_name)
+        if entry is not None and self._is_current(entry, storage):
+            self._entries[chain_name] = entry
+            return entry[3]
+
+        # Taken before loading the chain, so a change made while compiling is noticed by the next lookup
+        signatures = {chain_name: self._signature(storage, chain_name)}
+
+        def get_included_plan(name):
+            if not storage.chain_exists(name):
+                signatures[name] = self._signature(storage, name) # Compiled again once the chain is added
+                return None
+            plan = self._get(name, storage, including + [chain_name])
+            signatures.update(self._entries[name][0][1])
+            return plan
+
+        plan = compile_plan(chain_name, storage.load_chain(chain_name), get_included_plan)
+        scripts = sorted({link.script for link in plan.links})
+        entry = ([storage.name, signatures], scripts, get_script_signatures(scripts), plan)
+        self._entries[chain_name] = entry
+        self._write(chain_name, entry)
+        return plan
+
+_plan_cache = None
+
+def get_execution_plan(chain_name):
+    """Return the compiled plan of a chain, using the application's plan cache."""
+    global _plan_cache
+    if _plan_cache is None:
+        _plan_cache = PlanCache(PLANS_DIR)
+    return _plan_cache.get(chain_name)
@@ -0,0 +1,190 @@
+"""Incremental execution, which skips the links whose inputs did not change since they last succeeded.
+
+A link's fingerprint covers its command (the shell, the shell's options from
+shell_options.csv and the script path), the content of its script and the
+content of the input files declared in its 'inputs' option. In a chain listed
+in the incremental chains file, a link whose fingerprint equals the one of its
+last successful run is skipped.
+"""
+import csv
+import json
+import os
+import threading
+from utils import FINGERPRINTS_FILE, HASH_CHUNK_SIZE, INCREMENTAL_CHAINS_FILE
+
+def load_incremental_chains(chains_file):
+    """Return the set of chain names read from 'chains_file', one per row."""
+    chain_names = set()
+    try:
+        with open(chains_file, "r", newline="") as f:
+            for row in csv.reader(f):
+                if not row:
+                    continue
+                if len(row) != 1:
+                    raise ValueError(f"row '{','.join(row)}' is not a single chain name")
+                chain_names.add(row[0])
+    except FileNotFoundError:
+        pass
+    return chain_names
+
+def save_incremental_chains(chains_file, chain_names):
+    os.makedirs(os.path.dirname(chains_file) or ".", exist_ok=True)
+    directory, filename = os.path.split(chains_file)
+    temp_file = os.path.join(directory, f".{filename}.tmp")
+    with open(temp_file, "w", newline="") as f:
+        csv.writer(f, lineterminator="\n").writerows([chain_name] for chain_name in sorted(chain_names))
+    os.replace(temp_file, chains_file)
+
+def is_incremental_chain(chain_name):
+    """Return True if links of 'chain_name' are skipped when their fingerprint did not change."""
+    try:
+        return chain_name in load_incremental_chains(INCREMENTAL_CHAINS_FILE)
+    except (OSError, ValueError):
+        return False # Reported by the state validation
+
+def set_incremental_chain(chain_name, enabled):
+    chain_names = load_incremental_chains(INCREMENTAL_CHAINS_FILE)
+    if enabled == (chain_name in chain_names):
+        return
+    if enabled:
+        chain_names.add(chain_name)
+    else:
+        chain_names.discard(chain_name)
+    save_incremental_chains(INCREMENTAL_CHAINS_FILE, chain_names)
+
+def hash_file(path):
+    """Return the SHA-256 hex digest of a file, read HASH_CHUNK_SIZE bytes at a time."""
+    import hashlib # Imported here so checking whether a chain is incremental does not load it
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class FingerprintCache:
+    """The content hash of files and the fingerprint of each link's last successful run.
+
+    A file is hashed again only when its modification time or size changed, so
+    fingerprinting an unchanged link costs one stat per file. Like the schedule
+    state, the cache is a journal of JSON lines that is appended to on every
+    change and compacted when it grows to more than twice its entries. Links
+    are identified by their chain and their index in the chain's ExecutionPlan.
+    """
+
+    def __init__(self, cache_file):
+        self.cache_file = cache_file
+        self._hashes = {} # path -> [mtime, size, hash]
+        self._fingerprints = {} # (chain name, link index) -> fingerprint
+        self._journal_length = 0
+        self._lock = threading.Lock()
+        try:
+            with open(cache_file, "r") as f:
+                for line in f:
+                    try:
+                        self._apply(json.loads(line))
+                    except (ValueError, KeyError, TypeError):
+                        continue # A partially written last line
+                    self._journal_length += 1
+        except FileNotFoundError:
+            pass
+
+    def _apply(self, record):
+        if "file" in record:
+            self._hashes[record["file"]] = record["hash"]
+        elif record.get("fingerprint") is None:
+            self._fingerprints.pop((record["chain"], record["link"]), None)
+        else:
+            self._fingerprints[(record["chain"], record["link"])] = record["fingerprint"]
+
+    def _records(self):
+        for path, entry in self._hashes.items():
+            yield {"file": path, "hash": entry}
+        for (chain_name, index), fingerprint in self._fingerprints.items():
+            yield {"chain": chain_name, "link": index, "fingerprint": fingerprint}
+
+    def _append(self, record):
+        """Apply and save a change. Called with the lock held."""
+        self._apply(record)
+        try:
+            os.makedirs(os.path.dirname(self.cache_file) or ".", exist_ok=True)
+            with open(self.cache_file, "a") as f:
+                f.write(json.dumps(record) + "\n")
+            self._journal_length += 1
+            if self._journal_length > 2 * (len(self._hashes) + len(self._fingerprints)) + 16:
+                self._compact()
+        except OSError:
+            pass # Only costs hashing or running the link again next time
+
+    def _compact(self):
+        temp_file = self.cache_file + ".tmp"
+        with open(temp_file, "w") as f:
+            for record in self._records():
+                f.write(json.dumps(record) + "\n")
+        os.replace(temp_file, self.cache_file)
+        self._journal_length = len(self._hashes) + len(self._fingerprints)
+
+    def get_file_hash(self, path):
+        """Return the content hash of a file, or None if it does not exist."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        with self._lock:
+            entry = self._hashes.get(path)
+        if entry is not None and entry[:2] == [stat.st_mtime_ns, stat.st_size]:
+            return entry[2]
+        try:
+            file_hash = hash_file(path)
+        except OSError:
+            return None
+        with self._lock:
+            self._append({"file": path, "hash": [stat.st_mtime_ns, stat.st_size, file_hash]})
+        return file_hash
+
+    def get_link_fingerprint(self, link):
+        """Return the fingerprint of a PlannedLink, or None if its script or one of its inputs does not exist."""
+        script_hash = self.get_file_hash(link.script)
+        input_hashes = [[path, self.get_file_hash(path)] for path in link.inputs]
+        if script_hash is None or any(input_hash is None for _, input_hash in input_hashes):
+            return None
+        data = json.dumps([list(link.argv), script_hash, input_hashes])
+        import hashlib # Loaded by hash_file already
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def is_unchanged(self, chain_name, index, fingerprint):
+        """Return True if 'fingerprint' is the one recorded for the last successful run of the link."""
+        with self._lock:
+            return fingerprint is not None and self._fingerprints.get((chain_name, index)) == fingerprint
+
+    def record_success(self, chain_name, index, fingerprint):
+        if fingerprint is None:
+            return
+        with self._lock:
+            if self._fingerprints.get((chain_name, index)) != fingerprint:
+                self._append({"chain": chain_name, "link": index, "fingerprint": fingerprint})
+
+    def forget(self, chain_name, index):
+        """Make the link run the next time, for example because it failed."""
+        with self._lock:
+            if (chain_name, index) in self._fingerprints:
+                self._append({"chain": chain_name, "link": index, "fingerprint": None})
+
+    def forget_chain(self, chain_name):
+        """Forget the fingerprints of every link of a chain, so it runs completely the next time."""
+        with self._lock:
+            for key in [key for key in self._fingerprints if key[0] == chain_name]:
+                self._append({"chain": chain_name, "link": key[1], "fingerprint": None})
+
+_fingerprint_cache = None
+_fingerprint_cache_lock = threading.Lock()
+
+def get_fingerprint_cache():
+    """Return the fingerprint cache shared by every chain run in this process."""
+    global _fingerprint_cache
+    with _fingerprint_cache_lock:
+        if _fingerprint_cache is None:
+            _fingerprint_cache = FingerprintCache(FINGERPRINTS_FILE)
+        return _fingerprint_cache
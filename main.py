@@ -1,45 +1,113 @@
 import tkinter as tk
 from tkinter import Menu, messagebox, ttk
-import csv
-import os
-import subprocess
+import bisect
+import queue
+import threading
 from settings_window import SettingsWindow
 from shells_window import ShellsWindow
 from edit_chain_window import EditChainWindow
-from utils import FILE_DISPLAY_FILE, EXIT_AFTER_EXECUTION_FILE, SHELLS_FILE, IDENTITIES_FILE, CHAINS_DIR, listbox_clicked_dead_space, setup_application_files, get_setting, get_shell_options, validate_state
+from async_executor import AsyncRunner, TkEventBridge
+from chain_executor import LINK_STARTED, LINK_FINISHED, LINK_SKIPPED, LINK_RETRYING, CHAIN_FINISHED, BATCH_FINISHED
+from chain_index import ChainIndex, chain_sort_key
+from chains_watcher import ChainsWatcher
+from dispatcher import PRIORITY_BACKGROUND, get_dispatcher
+from execution_plan import get_execution_plan
+from incremental import get_fingerprint_cache, set_incremental_chain
+from scheduler import SchedulerLoop
+from virtual_listbox import VirtualListbox
+from storage import get_storage
+from tracing import enable_tracing, traced
+from utils import FILE_DISPLAY_FILE, EXIT_AFTER_EXECUTION_FILE, MAX_PARALLEL_LINKS_FILE, STORAGE_BACKEND_FILE, CAPTURE_OUTPUT_FILE, MISSED_RUNS_FILE, MAX_PROCESSES_FILE, BATCH_EXECUTION_FILE, CHAINS_DIR, EXECUTION_POLL_INTERVAL, CHAINS_WATCH_INTERVAL, listbox_clicked_dead_space, setup_application_files, get_setting, is_batch_execution_parallel, validate_state
 
+# Runs the chains on one asyncio event loop in the background
+runner = None
+# Progress reported by running chains and batches, handled on the Tk main thread
+execution_events = None
+# Outcome of the startup state validation: None or the exception it raised
+validation_results = queue.Queue()
+# Names of every chain, filtered into chain_listbox
+chain_index = ChainIndex()
+# Reports chain files added or removed by this or other programs, None if chains are not stored as files
+chains_watcher = None
+
+@traced
 def open_settings_window():
-    SettingsWindow(root, FILE_DISPLAY_FILE, EXIT_AFTER_EXECUTION_FILE)
+    SettingsWindow(root, FILE_DISPLAY_FILE, EXIT_AFTER_EXECUTION_FILE, MAX_PARALLEL_LINKS_FILE, STORAGE_BACKEND_FILE, CAPTURE_OUTPUT_FILE, MISSED_RUNS_FILE, MAX_PROCESSES_FILE, BATCH_EXECUTION_FILE)
 
+@traced
 def open_shells_window():
-    ShellsWindow(root, SHELLS_FILE, IDENTITIES_FILE, FILE_DISPLAY_FILE, CHAINS_DIR)
+    ShellsWindow(root, FILE_DISPLAY_FILE)
 
+@traced
 def open_edit_chain_window(chain_name=None):
     EditChainWindow(
         root=root,
         chain_listbox=chain_listbox,
-        load_chains=load_chains,
-        chains_dir=CHAINS_DIR,
-        shells_file=SHELLS_FILE,
+        load_chains=refresh_chains,
         file_display_file=FILE_DISPLAY_FILE,
         chain_name=chain_name
     )
 
+@traced
 def quit_program():
     """Exit the program gracefully."""
     if messagebox.askokcancel("Quit", "Do you really want to quit?"):
         root.destroy()
 
+@traced
 def load_chains():
     """Load execution chains from the Chains directory."""
     edit_button.config(state="disabled")
     delete_button.config(state="disabled")
     execute_button.config(state="disabled")
-    chain_listbox.delete(0, tk.END)
-    for filename in os.listdir(CHAINS_DIR):
-        if filename.endswith(".csv"):
-            chain_listbox.insert(tk.END, os.path.splitext(filename)[0])
+    chain_listbox.selection_clear(0, tk.END)
+    chain_index.reset(get_storage().list_chains())
+    filter_chains()
+
+@traced
+def refresh_chains():
+    """Apply the chains added or removed since the last check to the list, keeping the selection and scroll position."""
+    if chains_watcher is None:
+        load_chains()
+        return
+
+    added, removed = chains_watcher.poll()
+    changed = chains_watcher.take_changed()
+    if changed is None or changed or added or removed:
+        # The shell usage index only reads chain files again when told which ones were written
+        try:
+            get_storage().refresh_chain_usage(None if changed is None else changed | added | removed)
+        except Exception:
+            pass # Chain files that cannot be read are reported by the state validation
+    if not added and not removed:
+        return
+    query = filter_var.get().lower()
+    for chain_name in removed:
+        if chain_index.remove(chain_name) is not None and query in chain_name.lower():
+            chain_listbox.delete_item(bisect.bisect_left(chain_listbox.items, chain_sort_key(chain_name), key=chain_sort_key))
+    for chain_name in added:
+        if chain_index.add(chain_name) is not None and query in chain_name.lower():
+            chain_listbox.insert_item(bisect.bisect_left(chain_listbox.items, chain_sort_key(chain_name), key=chain_sort_key), chain_name)
+    chain_listbox.render()
+    if not chain_listbox.curselection():
+        main_window_deselect_link()
+
+@traced
+def poll_chains_watcher():
+    """Check for chains added or removed by other programs."""
+    refresh_chains()
+    root.after(CHAINS_WATCH_INTERVAL, poll_chains_watcher)
+
+@traced
+def filter_chains(*args):
+    """Show the chains whose name contains the filter text."""
+    chain_listbox.set_items(chain_index.search(filter_var.get()))
+    if not chain_listbox.curselection():
+        edit_button.config(state="disabled")
+        delete_button.config(state="disabled")
+        execute_button.config(state="disabled")
 
+@traced
 def delete_selected_chains():
     """Delete selected execution chains."""
     selected_indices = chain_listbox.curselection()
@@ -53,78 +121,126 @@ def delete_selected_chains():
 
     for i in selected_indices[::-1]:
         chain_name = chain_listbox.get(i)
-        chain_file = os.path.join(CHAINS_DIR, f"{chain_name}.csv")
         try:
-            os.remove(chain_file)
+            get_storage().delete_chain(chain_name)
+            set_incremental_chain(chain_name, False)
+            get_fingerprint_cache().forget_chain(chain_name)
         except Exception as e:
             messagebox.showerror("Error", f"Failed to delete {chain_name}: {e}")
-    load_chains()
+    refresh_chains()
 
+@traced
 def execute_chain():
-    """Execute the selected execution chain."""
+    """Execute the selected execution chains as one batch."""
     selected_indices = chain_listbox.curselection()
     if not selected_indices:
         messagebox.showwarning("Warning", "No chain selected to execute.")
         return
 
-    exit_after_execution_setting = get_setting(EXIT_AFTER_EXECUTION_FILE)
-    chain_name = chain_listbox.get(selected_indices[0])
-    chain_file = os.path.join(CHAINS_DIR, f"{chain_name}.csv")
+    chain_names = [chain_listbox.get(i) for i in selected_indices]
+
+    # Load the compiled links of every chain before starting any, only parsing the chains that changed
+    chains = []
+    failures = []
+    for chain_name in chain_names:
+        try:
+            plan = get_execution_plan(chain_name)
+        except Exception as e:
+            failures.append((chain_name, f"Failed to execute chain '{chain_name}': {e}"))
+            continue
+        if plan.links:
+            chains.append((chain_name, plan))
+
+    if not chains and not failures:
+        if len(chain_names) == 1:
+            messagebox.showwarning("Warning", f"Chain '{chain_names[0]}' has no links to execute.")
+        else:
+            messagebox.showwarning("Warning", "None of the selected chains has links to execute.")
+        return
+
+    # Run the chains in the background, progress and the combined outcome are reported through execution_events
+    parallel = is_batch_execution_parallel()
+    runner.submit_batch(chains, execution_events, parallel=parallel, failures=failures)
+    if len(chains) == 1:
+        status_var.set(f"Running '{chains[0][0]}'...")
+    elif chains:
+        status_var.set(f"Running {len(chains)} chains {'in parallel' if parallel else 'one after another'}...")
 
+@traced
+def run_scheduled_chain(chain_name):
+    """Start a chain whose scheduled time has come. Its outcome is only shown in the status bar."""
     try:
-        # Load chain links
-        with open(chain_file, "r") as f:
-            reader = csv.reader(f)
-            chain_links = list(reader)
-
-        if not chain_links:
-            messagebox.showwarning("Warning", f"Chain '{chain_name}' has no links to execute.")
-            return
-
-        # Execute each link
-        for shell, script in chain_links:
-            if not os.path.exists(script):
-                messagebox.showerror("Error", f"Script not found: {script}")
-                return
-
-            # Ensure the script runs in its directory
-            script_dir = os.path.dirname(script)
-
-            # Build command
-            shell_options = get_shell_options(shell)
-            command = [shell]
-            if shell_options[1] != "": command.append(shell_options[1])
-            command.append(script)
-            if shell_options[3] != "": command.append(shell_options[3])
-
-            try:
-                # Launch process in a detached mode
-                subprocess.Popen(
-                    command,
-                    cwd=script_dir,
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.DEVNULL,
-                    stdin=subprocess.DEVNULL,
-                    start_new_session=True,
-                )
-            except Exception as e:
-                if exit_after_execution_setting == "Always" or exit_after_execution_setting == "After failure only":
-                    root.destroy()
-                    return
-                messagebox.showerror("Error", f"Error executing '{script}': {e}")
-                return
+        runner.submit(chain_name, get_execution_plan(chain_name), execution_events, priority=PRIORITY_BACKGROUND)
+        status_var.set(f"Running '{chain_name}' (scheduled)...")
+    except Exception as e:
+        status_var.set(f"Failed to run scheduled chain '{chain_name}': {e}")
 
+@traced
+def finish_execution(success, message):
+    """Apply the exit after execution setting to the outcome of a batch of chains. Returns True if the application was closed."""
+    exit_after_execution_setting = get_setting(EXIT_AFTER_EXECUTION_FILE)
+    if success:
         if exit_after_execution_setting == "Always" or exit_after_execution_setting == "After success only":
             root.destroy()
-            return
-        messagebox.showinfo("Success", f"Chain '{chain_name}' executed successfully.")
-
-    except Exception as e:
+            return True
+        messagebox.showinfo("Success", message)
+    else:
         if exit_after_execution_setting == "Always" or exit_after_execution_setting == "After failure only":
             root.destroy()
-            return
-        messagebox.showerror("Error", f"Failed to execute chain '{chain_name}': {e}")
+            return True
+        messagebox.showerror("Error", message)
+    return False
+
+@traced
+def handle_execution_event(event):
+    """Show the progress of a running chain or batch. Returns False if the application was closed."""
+    if event.kind == LINK_STARTED:
+        status_var.set(f"Running '{event.chain_name}': Link-{event.link_index}")
+    elif event.kind == LINK_FINISHED:
+        status_var.set(f"'{event.chain_name}': Link-{event.link_index} exited with code {event.detail}")
+    elif event.kind == LINK_SKIPPED:
+        status_var.set(f"'{event.chain_name}': Link-{event.link_index} skipped (unchanged)")
+    elif event.kind == LINK_RETRYING:
+        attempt, delay = event.detail
+        status_var.set(f"'{event.chain_name}': Link-{event.link_index} failed, retry {attempt} in {delay:.1f}s")
+    elif event.kind == CHAIN_FINISHED:
+        success, message = event.detail
+        status_var.set(f"'{event.chain_name}' {'succeeded' if success else 'failed'}")
+    elif event.kind == BATCH_FINISHED:
+        # Only chains started by the user run as a batch, and the exit after execution setting only applies to them
+        success, message = event.detail
+        if finish_execution(success, message):
+            return False
+    return True
+
+def show_queue_depth(queue_depth):
+    """Show the number of links waiting for the process limits of the dispatcher."""
+    queue_var.set(f"{queue_depth} link(s) waiting for a free process slot" if queue_depth else "")
+
+@traced
+def start_state_validation():
+    """Validate the application state on a worker thread so the window opens immediately."""
+    def validate():
+        try:
+            validate_state()
+            validation_results.put(None)
+        except Exception as e:
+            validation_results.put(e)
+    threading.Thread(target=validate, name="validate-state", daemon=True).start()
+    root.after(EXECUTION_POLL_INTERVAL, poll_state_validation)
 
+@traced
+def poll_state_validation():
+    """Report the result of the state validation once it is available."""
+    try:
+        error = validation_results.get_nowait()
+    except queue.Empty:
+        root.after(EXECUTION_POLL_INTERVAL, poll_state_validation)
+        return
+    if error is not None:
+        messagebox.showerror("Error", f"An error occurred while attempting to validate the application state. Some features may not work as intended. Error: {error}")
+
+@traced
 def main_window_on_link_select(event):
     """Handel chain_listbox item selection."""
     # Enable buttons if a selection is made
@@ -132,6 +248,7 @@ def main_window_on_link_select(event):
     delete_button.config(state="normal")
     execute_button.config(state="normal")
 
+@traced
 def main_window_deselect_link():
     """Deselect the currently selected chain."""
     chain_listbox.selection_clear(0, tk.END)
@@ -139,6 +256,7 @@ def main_window_deselect_link():
     delete_button.config(state="disabled")
     execute_button.config(state="disabled")
 
+@traced
 def main_window_handle_outside_click(event):
     """Handle clicks outside of specific widgets to deselect the chain."""
     widget = event.widget
@@ -147,10 +265,12 @@ def main_window_handle_outside_click(event):
             main_window_deselect_link()
         else:
             main_window_on_link_select(event)
-    if widget != chain_listbox and widget != edit_button and widget != delete_button and widget != execute_button:
+    if widget != chain_listbox.listbox and widget != filter_entry and widget != edit_button and widget != delete_button and widget != execute_button:
         main_window_deselect_link()
 
 if __name__ == "__main__":
+    # Write a trace or a profile of the session if AUTOMATION_HUB_TRACE or AUTOMATION_HUB_PROFILE is set
+    enable_tracing()
     setup_application_files()
 
     # Main application window
@@ -181,14 +301,15 @@ if __name__ == "__main__":
     # Main listbox label
     ttk.Label(frame, text="Execution Chains", width=15).pack(side=tk.TOP)
     
-    # Listbox for displaying execution chains
-    chain_listbox = tk.Listbox(frame, activestyle=tk.NONE, exportselection=False)
-    chain_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-    
-    # Scrollbar for the listbox
-    scrollbar = tk.Scrollbar(frame, orient=tk.VERTICAL, command=chain_listbox.yview)
-    scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-    chain_listbox.config(yscrollcommand=scrollbar.set)
+    # Filter for the listbox, matching any part of a chain name
+    filter_var = tk.StringVar()
+    filter_var.trace_add("write", filter_chains)
+    filter_entry = ttk.Entry(frame, textvariable=filter_var)
+    filter_entry.pack(side=tk.TOP, fill=tk.X, pady=(0, 5))
+
+    # Listbox for displaying execution chains, only the rows in view are created. Ctrl and Shift select several chains.
+    chain_listbox = VirtualListbox(frame, selectmode=tk.EXTENDED)
+    chain_listbox.pack_listbox()
     
     # Button panel
     button_frame = tk.Frame(root)
@@ -201,8 +322,16 @@ if __name__ == "__main__":
     delete_button.pack(side=tk.LEFT, padx=5)
     execute_button = tk.Button(button_frame, text="Execute", command=execute_chain, state=tk.DISABLED)
     execute_button.pack(side=tk.LEFT, padx=5)
+
+    # Execution status
+    status_var = tk.StringVar()
+    ttk.Label(root, textvariable=status_var).pack(side=tk.BOTTOM, pady=(0, 5))
+    queue_var = tk.StringVar()
+    ttk.Label(root, textvariable=queue_var).pack(side=tk.BOTTOM)
     
-    # Display chains
+    # Display chains and watch the Chains directory for changes made by other programs
+    if get_storage().name == "CSV":
+        chains_watcher = ChainsWatcher(CHAINS_DIR)
     load_chains()
     
     # Initially disable Edit, Delete, and Execute buttons
@@ -210,11 +339,17 @@ if __name__ == "__main__":
     delete_button.config(state=tk.DISABLED)
     execute_button.config(state=tk.DISABLED)
     
-    # Validate the application state
-    try:
-        validate_state()
-    except Exception as e:
-        messagebox.showerror("Error", f"An error occurred while attempting to validate the application state. Some features may not work as intended. Error: {e}")
+    # Validate the application state in the background
+    start_state_validation()
+
+    # Run chains on a background event loop, their progress arrives on the Tk main thread through the bridge
+    runner = AsyncRunner()
+    event_bridge = TkEventBridge(root)
+    execution_events = event_bridge.channel(handle_execution_event)
+    get_dispatcher().subscribe(event_bridge.channel(show_queue_depth).put) # Posted as soon as links are queued or start
+    if chains_watcher is not None:
+        root.after(CHAINS_WATCH_INTERVAL, poll_chains_watcher)
 
     # Run the application
+    SchedulerLoop(run_scheduled_chain).run_in_tk(root)
     root.mainloop()
\ No newline at end of file
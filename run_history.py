@@ -0,0 +1,138 @@
+import math
+import os
+import sqlite3
+import threading
+from utils import HISTORY_FILE
+
+class RunHistory:
+    """An append-only record of chain and link executions in an SQLite database.
+
+    Each run and each link execution is one row, and every retry of a link is
+    a row of its own with its attempt number. Rows are indexed by chain (and
+    link) together with their duration, so the statistics of one chain are read
+    from its index entries without scanning the rest of the history.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS runs (
+            id INTEGER PRIMARY KEY,
+            chain TEXT NOT NULL,
+            started REAL NOT NULL,
+            duration REAL,
+            success INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS link_runs (
+            run_id INTEGER NOT NULL,
+            chain TEXT NOT NULL,
+            link_index INTEGER NOT NULL,
+            command TEXT NOT NULL,
+            started REAL NOT NULL,
+            duration REAL NOT NULL,
+            exit_code INTEGER,
+            attempt INTEGER NOT NULL DEFAULT 0,
+            timed_out INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS runs_by_chain ON runs(chain, duration, success);
+        CREATE INDEX IF NOT EXISTS link_runs_by_chain ON link_runs(chain, link_index, duration, exit_code);
+    """
+
+    def __init__(self, history_file=HISTORY_FILE):
+        self.history_file = history_file
+        os.makedirs(os.path.dirname(history_file) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(history_file, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.execute("PRAGMA synchronous = NORMAL") # Losing the last rows on power failure is acceptable
+        self._connection.executescript(self.SCHEMA)
+        link_run_columns = [name for _, name, *_ in self._connection.execute("PRAGMA table_info(link_runs)")]
+        if "attempt" not in link_run_columns: # Histories recorded before link retries
+            self._connection.execute("ALTER TABLE link_runs ADD COLUMN attempt INTEGER NOT NULL DEFAULT 0")
+            self._connection.execute("ALTER TABLE link_runs ADD COLUMN timed_out INTEGER NOT NULL DEFAULT 0")
+        self._lock = threading.Lock()
+
+    def _execute(self, sql, parameters=()):
+        with self._lock:
+            return self._connection.execute(sql, parameters)
+
+    def _query(self, sql, parameters=()):
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def close(self):
+        self._connection.close()
+
+    def start_run(self, chain_name, started):
+        """Record the start of a chain run. Returns the id of the run."""
+        return self._execute("INSERT INTO runs (chain, started) VALUES (?, ?)", (chain_name, started)).lastrowid
+
+    def finish_run(self, run_id, duration, success):
+        self._execute("UPDATE runs SET duration = ?, success = ? WHERE id = ?", (duration, int(success), run_id))
+
+    def record_link(self, run_id, chain_name, link_index, command, started, duration, exit_code, attempt=0, timed_out=False):
+        self._execute(
+            "INSERT INTO link_runs (run_id, chain, link_index, command, started, duration, exit_code, attempt, timed_out) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (run_id, chain_name, link_index, command, started, duration, exit_code, attempt, int(timed_out)),
+        )
+
+    def list_chains(self):
+        return [row[0] for row in self._query("SELECT DISTINCT chain FROM runs ORDER BY chain")]
+
+    def _stats(self, table, where, parameters, failed):
+        """Return the run count, failure rate and p50/p95/max duration of the finished rows matching 'where'."""
+        where += " AND duration IS NOT NULL"
+        count, failures, maximum = self._query(
+            f"SELECT COUNT(*), SUM({failed}), MAX(duration) FROM {table} WHERE {where}", parameters
+        )[0]
+        stats = {"runs": count, "failures": failures or 0, "failure_rate": (failures or 0) / count if count else None,
+                 "p50": None, "p95": None, "max": maximum}
+        for name, percentile in (("p50", 0.50), ("p95", 0.95)):
+            if count:
+                # Nearest-rank percentile, read by walking the index in duration order
+                offset = max(0, math.ceil(count * percentile) - 1)
+                stats[name] = self._query(
+                    f"SELECT duration FROM {table} WHERE {where} ORDER BY duration LIMIT 1 OFFSET ?", (*parameters, offset)
+                )[0][0]
+        return stats
+
+    def get_chain_stats(self, chain_name):
+        """Return the statistics of every finished run of a chain."""
+        return self._stats("runs", "chain = ?", (chain_name,), "success = 0")
+
+    def get_link_stats(self, chain_name):
+        """Return the statistics of each link of a chain, keyed by link index.
+
+        Every attempt of a link counts as a run; 'retries' and 'timeouts' count
+        the attempts that were retries and the attempts that were killed for
+        running too long.
+        """
+        rows = self._query(
+            "SELECT link_index, SUM(attempt > 0), SUM(timed_out) FROM link_runs WHERE chain = ? GROUP BY link_index ORDER BY link_index",
+            (chain_name,)
+        )
+        stats = {}
+        for index, retries, timeouts in rows:
+            stats[index] = self._stats("link_runs", "chain = ? AND link_index = ?", (chain_name, index), "exit_code != 0")
+            stats[index].update(retries=retries or 0, timeouts=timeouts or 0)
+        return stats
+
+    def clear(self, chain_name=None):
+        """Delete the history of one chain, or of every chain."""
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            if chain_name is None:
+                self._connection.execute("DELETE FROM link_runs")
+                self._connection.execute("DELETE FROM runs")
+            else:
+                self._connection.execute("DELETE FROM link_runs WHERE chain = ?", (chain_name,))
+                self._connection.execute("DELETE FROM runs WHERE chain = ?", (chain_name,))
+            self._connection.execute("COMMIT")
+
+_history = None
+_history_lock = threading.Lock()
+
+def get_run_history():
+    """Return the run history of the application, opening it on first use."""
+    global _history
+    with _history_lock:
+        if _history is None:
+            _history = RunHistory(HISTORY_FILE)
+        return _history
@@ -0,0 +1,148 @@
+import os
+import select
+import shutil
+import threading
+import time
+from utils import LOGS_DIR, LOG_CHUNK_SIZE, LOG_MAX_FILE_SIZE, LOG_BACKUP_COUNT, LOG_MAX_RUNS, LOG_DRAIN_TIMEOUT, LOG_POLL_INTERVAL
+
+class RotatingLogWriter:
+    """Writes bytes to a file, rotating it to '.1', '.2', ... when it exceeds 'max_size'.
+
+    Only 'backup_count' rotated files are kept, so the disk space used by one
+    stream is bounded as well.
+    """
+
+    def __init__(self, path, max_size=LOG_MAX_FILE_SIZE, backup_count=LOG_BACKUP_COUNT):
+        self.path = path
+        self.max_size = max_size
+        self.backup_count = backup_count
+        self._file = open(path, "wb")
+        self._size = 0
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{i}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        self._file = open(self.path, "wb")
+        self._size = 0
+
+    def write(self, data):
+        while data:
+            if self._size >= self.max_size:
+                self._rotate()
+            chunk = data[:self.max_size - self._size]
+            self._file.write(chunk)
+            self._size += len(chunk)
+            data = data[len(chunk):]
+
+    def close(self):
+        self._file.close()
+
+def pump(stream, writer, stop=None):
+    """Copy 'stream' to 'writer' in fixed-size chunks until end of file, then close both.
+
+    If 'stop' (a threading.Event) is given, the copy also ends once it is set.
+    It is checked every LOG_POLL_INTERVAL seconds where select.poll exists;
+    elsewhere a blocked read only returns at end of file.
+    """
+    poller = None
+    if stop is not None and hasattr(select, "poll"):
+        poller = select.poll()
+        poller.register(stream, select.POLLIN)
+    try:
+        while stop is None or not stop.is_set():
+            if poller is not None and not poller.poll(LOG_POLL_INTERVAL * 1000):
+                continue
+            chunk = stream.read1(LOG_CHUNK_SIZE) if hasattr(stream, "read1") else stream.read(LOG_CHUNK_SIZE)
+            if not chunk:
+                break
+            writer.write(chunk)
+    finally:
+        stream.close()
+        writer.close()
+
+async def pump_async(stream, writer):
+    """Like pump, for an asyncio.StreamReader. Only closes 'writer'."""
+    try:
+        while True:
+            chunk = await stream.read(LOG_CHUNK_SIZE)
+            if not chunk:
+                break
+            writer.write(chunk)
+    finally:
+        writer.close()
+
+class OutputCapture:
+    """The threads copying the stdout and stderr pipes of one link process into its log files."""
+
+    def __init__(self, threads, stop):
+        self.threads = threads
+        self.stop = stop
+
+    def drain(self, timeout=LOG_DRAIN_TIMEOUT):
+        """Wait up to 'timeout' seconds for the copying to reach end of file, then stop it.
+
+        Called once the link process exited. Processes that inherited its pipes,
+        such as a daemon started by the script, keep them open after it exited;
+        their output is no longer logged and the pipes are closed shortly after.
+        """
+        deadline = time.monotonic() + timeout
+        for thread in self.threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        self.stop.set()
+
+class RunLog:
+    """The log directory of one chain run, holding one stdout and one stderr file per link."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def open_writer(self, link_index, attempt, name):
+        """Return a RotatingLogWriter for the 'stdout' or 'stderr' of an attempt of a link."""
+        prefix = f"link-{link_index}" if attempt == 0 else f"link-{link_index}.retry-{attempt}"
+        return RotatingLogWriter(os.path.join(self.directory, f"{prefix}.{name}.log"))
+
+    def capture(self, process, link_index, attempt=0):
+        """Stream the stdout and stderr pipes of 'process' into the link's log files.
+
+        Retries of a link ('attempt' above 0) get their own files. Returns an
+        OutputCapture to drain after the process exits.
+        """
+        threads = []
+        stop = threading.Event()
+        for name, stream in (("stdout", process.stdout), ("stderr", process.stderr)):
+            writer = self.open_writer(link_index, attempt, name)
+            thread = threading.Thread(target=pump, args=(stream, writer, stop), name=f"log-{link_index}-{name}", daemon=True)
+            thread.start()
+            threads.append(thread)
+        return OutputCapture(threads, stop)
+
+def get_chain_log_dir(chain_name):
+    return os.path.join(LOGS_DIR, chain_name)
+
+def start_run_log(chain_name, max_runs=LOG_MAX_RUNS):
+    """Create the log directory for a new run of a chain, deleting its oldest runs beyond 'max_runs'."""
+    chain_log_dir = get_chain_log_dir(chain_name)
+    os.makedirs(chain_log_dir, exist_ok=True)
+
+    # Run directories are named by start time, so sorting them orders them by age
+    runs = sorted(entry for entry in os.listdir(chain_log_dir) if os.path.isdir(os.path.join(chain_log_dir, entry)))
+    for run in runs[:max(0, len(runs) - max_runs + 1)]:
+        shutil.rmtree(os.path.join(chain_log_dir, run), ignore_errors=True)
+
+    base_name = time.strftime("%Y%m%d-%H%M%S")
+    run_name = base_name
+    suffix = 1
+    while True:
+        try:
+            os.mkdir(os.path.join(chain_log_dir, run_name))
+            break
+        except FileExistsError:
+            # Several runs started within the same second
+            run_name = f"{base_name}-{suffix:03d}"
+            suffix += 1
+    return RunLog(os.path.join(chain_log_dir, run_name))
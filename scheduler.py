@@ -0,0 +1,374 @@
+import csv
+import heapq
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from utils import SCHEDULES_FILE, SCHEDULE_STATE_FILE, MISSED_RUNS_FILE, MISSED_RUNS_DEFAULT, MISSED_RUNS_OPTIONS, MISSED_RUN_GRACE, MAX_MISSED_RUNS, SCHEDULER_MAX_SLEEP, get_setting
+
+CRON_FIELDS = [ # (name, minimum, maximum)
+    ("minute", 0, 59),
+    ("hour", 0, 23),
+    ("day of month", 1, 31),
+    ("month", 1, 12),
+    ("day of week", 0, 7), # 0 and 7 are both Sunday
+]
+CRON_ALIASES = {
+    "@hourly": "0 * * * *",
+    "@daily": "0 0 * * *",
+    "@weekly": "0 0 * * 0",
+    "@monthly": "0 0 1 * *",
+    "@yearly": "0 0 1 1 *",
+}
+CRON_SEARCH_LIMIT = 100000 # Steps before an expression is considered to never fire (such as February 30th)
+CRON_LOOKBACK = 3600 # Seconds before a time searched first for the last fire up to it, doubled until one is found
+
+def parse_cron_field(field, name, minimum, maximum):
+    """Return the set of values matched by one field of a cron expression."""
+    values = set()
+    for part in field.split(","):
+        value_range, _, step = part.partition("/")
+        if value_range == "*":
+            start, end = minimum, maximum
+        elif "-" in value_range:
+            start, end = (int(value) for value in value_range.split("-", 1))
+        else:
+            start = end = int(value_range)
+            if step:
+                end = maximum # 'n/step' means from n to the maximum
+        step = int(step) if step else 1
+        if start < minimum or end > maximum or start > end or step < 1:
+            raise ValueError(f"invalid {name} field '{field}'")
+        values.update(range(start, end + 1, step))
+    return values
+
+class CronSchedule:
+    """A five field cron expression (minute hour day-of-month month day-of-week) in local time.
+
+    As in cron, when both the day of month and the day of week are restricted, a
+    day matches if either of them matches.
+    """
+
+    kind = "cron"
+
+    def __init__(self, expression):
+        self.expression = expression
+        fields = CRON_ALIASES.get(expression.strip(), expression).split()
+        if len(fields) != len(CRON_FIELDS):
+            raise ValueError(f"cron expression '{expression}' does not have {len(CRON_FIELDS)} fields")
+        try:
+            self.minutes, self.hours, self.days, self.months, weekdays = (
+                parse_cron_field(field, *spec) for field, spec in zip(fields, CRON_FIELDS)
+            )
+        except ValueError as e:
+            raise ValueError(f"cron expression '{expression}' is invalid: {e}")
+        self.weekdays = {day % 7 for day in weekdays}
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+
+    @property
+    def spec(self):
+        return self.expression
+
+    def _day_matches(self, moment):
+        day_matches = moment.day in self.days
+        weekday_matches = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day_matches and weekday_matches
+        return day_matches or weekday_matches
+
+    def next_fire(self, after):
+        """Return the first time matching the expression strictly after the timestamp 'after'."""
+        moment = datetime.fromtimestamp(after).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        for _ in range(CRON_SEARCH_LIMIT):
+            if moment.month not in self.months:
+                # Skip to the first minute of the next month
+                moment = (moment.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                later = [minute for minute in self.minutes if minute > moment.minute]
+                if later:
+                    moment = moment.replace(minute=min(later))
+                else:
+                    moment = moment.replace(minute=0) + timedelta(hours=1)
+            else:
+                return moment.timestamp()
+        raise ValueError(f"cron expression '{self.expression}' never fires")
+
+    def last_fire(self, first, now):
+        """Return the latest fire not after 'now', given that 'first' is a fire not after 'now'."""
+        fire = first
+        lookback = CRON_LOOKBACK
+        while now - lookback > fire:
+            candidate = self.next_fire(now - lookback)
+            if candidate <= now:
+                fire = candidate
+                break
+            lookback *= 2
+        while True:
+            next_fire = self.next_fire(fire)
+            if next_fire > now:
+                return fire
+            fire = next_fire
+
+class IntervalSchedule:
+    """Fires every 'seconds' seconds, counted from the previous fire."""
+
+    kind = "interval"
+
+    def __init__(self, seconds):
+        try:
+            self.seconds = float(seconds)
+        except ValueError:
+            raise ValueError(f"interval '{seconds}' is not a number of seconds")
+        if self.seconds <= 0:
+            raise ValueError(f"interval '{seconds}' must be greater than 0")
+
+    @property
+    def spec(self):
+        return f"{self.seconds:g}"
+
+    def next_fire(self, after):
+        return after + self.seconds
+
+    def last_fire(self, first, now):
+        """Return the latest fire not after 'now', given that 'first' is a fire not after 'now'."""
+        return first + (now - first) // self.seconds * self.seconds
+
+def parse_schedule(kind, spec):
+    """Return the schedule described by a row of the schedules file."""
+    if kind == CronSchedule.kind:
+        return CronSchedule(spec)
+    if kind == IntervalSchedule.kind:
+        return IntervalSchedule(spec)
+    raise ValueError(f"unknown schedule type '{kind}'")
+
+def load_schedules(schedules_file):
+    """Return a dict of chain name -> schedule read from 'schedules_file'."""
+    schedules = {}
+    try:
+        with open(schedules_file, "r", newline="") as f:
+            for row in csv.reader(f):
+                if not row:
+                    continue
+                if len(row) != 3:
+                    raise ValueError(f"schedule '{','.join(row)}' is improperly formatted")
+                chain_name, kind, spec = row
+                schedules[chain_name] = parse_schedule(kind, spec)
+    except FileNotFoundError:
+        pass
+    return schedules
+
+def save_schedules(schedules_file, schedules):
+    os.makedirs(os.path.dirname(schedules_file) or ".", exist_ok=True)
+    directory, filename = os.path.split(schedules_file)
+    temp_file = os.path.join(directory, f".{filename}.tmp")
+    with open(temp_file, "w", newline="") as f:
+        csv.writer(f, lineterminator="\n").writerows(
+            [chain_name, schedule.kind, schedule.spec] for chain_name, schedule in sorted(schedules.items())
+        )
+    os.replace(temp_file, schedules_file)
+
+class ScheduleState:
+    """The time each scheduled chain last fired, kept across restarts to detect missed runs.
+
+    Like the shell usage index, it is a journal of JSON lines that is appended to
+    on every fire and compacted when it grows to more than twice its entries.
+    """
+
+    def __init__(self, state_file):
+        self.state_file = state_file
+        self._last_fired = {}
+        self._journal_length = 0
+        try:
+            with open(state_file, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue # A partially written last line
+                    self._last_fired[record["chain"]] = record["fired"]
+                    self._journal_length += 1
+        except FileNotFoundError:
+            pass
+
+    def get(self, chain_name):
+        return self._last_fired.get(chain_name)
+
+    def record(self, chain_name, fired):
+        self._last_fired[chain_name] = fired
+        os.makedirs(os.path.dirname(self.state_file) or ".", exist_ok=True)
+        with open(self.state_file, "a") as f:
+            f.write(json.dumps({"chain": chain_name, "fired": fired}) + "\n")
+        self._journal_length += 1
+        if self._journal_length > 2 * len(self._last_fired) + 16:
+            self._compact()
+
+    def retain(self, chain_names):
+        """Forget the chains that are no longer scheduled."""
+        for chain_name in set(self._last_fired) - set(chain_names):
+            del self._last_fired[chain_name]
+
+    def _compact(self):
+        temp_file = self.state_file + ".tmp"
+        with open(temp_file, "w") as f:
+            for chain_name, fired in self._last_fired.items():
+                f.write(json.dumps({"chain": chain_name, "fired": fired}) + "\n")
+        os.replace(temp_file, self.state_file)
+        self._journal_length = len(self._last_fired)
+
+def count_fires(schedule, first, last, limit):
+    """Return the number of fires from the fire 'first' up to 'last', counting at most 'limit'."""
+    count = 0
+    fire = first
+    while fire <= last and count < limit:
+        count += 1
+        fire = schedule.next_fire(fire)
+    return count
+
+def get_missed_runs_policy():
+    policy = get_setting(MISSED_RUNS_FILE)
+    return policy if policy in MISSED_RUNS_OPTIONS else MISSED_RUNS_DEFAULT
+
+class Scheduler:
+    """Keeps the next fire time of every scheduled chain in a min-heap and dispatches due chains.
+
+    'dispatch' is called with the name of each chain to run. Fires that are more
+    than MISSED_RUN_GRACE seconds late, for example because the computer was
+    asleep or the application was not running, are handled according to the
+    missed runs setting: 'Run all' runs the chain once per missed fire (at most
+    MAX_MISSED_RUNS times), 'Run once' merges them into a single run and 'Skip'
+    drops them, running the chain once if its newest fire is not late. Replacing or removing a schedule leaves its old heap entry in
+    place; entries are tagged with a generation and stale ones are skipped.
+    """
+
+    def __init__(self, dispatch, state, clock=time.time):
+        self.dispatch = dispatch
+        self.state = state
+        self.clock = clock
+        self._schedules = {} # chain name -> (schedule, generation)
+        self._heap = [] # (fire time, generation, chain name)
+        self._generation = 0
+
+    def __len__(self):
+        return len(self._schedules)
+
+    def _push(self, chain_name, schedule, fire_time):
+        self._generation += 1
+        self._schedules[chain_name] = (schedule, self._generation)
+        heapq.heappush(self._heap, (fire_time, self._generation, chain_name))
+
+    def set_schedules(self, schedules):
+        """Replace the schedules. Chains whose schedule did not change keep their heap entry."""
+        now = self.clock()
+        for chain_name in set(self._schedules) - set(schedules):
+            del self._schedules[chain_name]
+        for chain_name, schedule in schedules.items():
+            current = self._schedules.get(chain_name)
+            if current is not None and (current[0].kind, current[0].spec) == (schedule.kind, schedule.spec):
+                continue
+            # Resume from the last fire so that runs missed while the application was closed are noticed
+            last_fired = self.state.get(chain_name)
+            self._push(chain_name, schedule, schedule.next_fire(last_fired if last_fired is not None else now))
+        self.state.retain(schedules)
+
+    def next_fire_time(self):
+        """Return the earliest pending fire time, or None if nothing is scheduled."""
+        while self._heap:
+            fire_time, generation, chain_name = self._heap[0]
+            current = self._schedules.get(chain_name)
+            if current is not None and current[1] == generation:
+                return fire_time
+            heapq.heappop(self._heap) # Stale entry of a replaced or removed schedule
+        return None
+
+    def run_due(self):
+        """Dispatch every chain whose fire time has passed. Returns the number of runs dispatched."""
+        now = self.clock()
+        policy = None
+        dispatched = 0
+        while True:
+            fire_time = self.next_fire_time()
+            if fire_time is None or fire_time > now:
+                return dispatched
+            _, generation, chain_name = heapq.heappop(self._heap)
+            schedule = self._schedules[chain_name][0]
+
+            # The newest fire is found without walking the whole backlog, which may be long after an outage
+            latest = schedule.last_fire(fire_time, now)
+
+            if policy is None:
+                policy = get_missed_runs_policy()
+            if policy == "Run all":
+                runs = count_fires(schedule, fire_time, now, MAX_MISSED_RUNS)
+            elif policy == "Run once":
+                runs = 1
+            else:
+                # Only the newest fire runs, and only if it is at most MISSED_RUN_GRACE seconds late
+                runs = 1 if latest >= now - MISSED_RUN_GRACE else 0
+
+            for _ in range(runs):
+                self.dispatch(chain_name)
+            dispatched += runs
+            self.state.record(chain_name, latest)
+            heapq.heappush(self._heap, (schedule.next_fire(latest), generation, chain_name))
+
+    def seconds_until_next(self, maximum):
+        """Return how long to sleep before the next fire, at most 'maximum' seconds."""
+        fire_time = self.next_fire_time()
+        if fire_time is None:
+            return maximum
+        return min(maximum, max(0.0, fire_time - self.clock()))
+
+class SchedulerLoop:
+    """Drives a Scheduler from the Tk event loop or from a plain loop, reloading the schedules file when it changes.
+
+    If the schedules file cannot be read, the previous schedules are kept and
+    the error is stored in 'error' until the file is fixed.
+    """
+
+    def __init__(self, dispatch, schedules_file=SCHEDULES_FILE, state_file=SCHEDULE_STATE_FILE):
+        self.scheduler = Scheduler(dispatch, ScheduleState(state_file))
+        self.schedules_file = schedules_file
+        self.error = None
+        self._signature = None
+
+    def reload_if_changed(self):
+        try:
+            stat = os.stat(self.schedules_file)
+            signature = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            signature = None
+        if signature == self._signature:
+            return
+        self._signature = signature
+        try:
+            self.scheduler.set_schedules(load_schedules(self.schedules_file))
+            self.error = None
+        except ValueError as e:
+            self.error = f"Failed to load schedules: {e}"
+
+    def tick(self):
+        """Dispatch the due chains. Returns the number of seconds until the next tick is needed."""
+        self.reload_if_changed()
+        self.scheduler.run_due()
+        return self.scheduler.seconds_until_next(SCHEDULER_MAX_SLEEP)
+
+    def run_in_tk(self, root):
+        """Run the scheduler inside the Tk event loop of 'root'."""
+        def step():
+            delay = self.tick()
+            root.after(max(1, int(delay * 1000)), step)
+        root.after(0, step)
+
+    def run_forever(self, stop_event=None):
+        """Run the scheduler in the calling thread until 'stop_event' (a threading.Event) is set."""
+        while stop_event is None or not stop_event.is_set():
+            delay = self.tick()
+            if stop_event is None:
+                time.sleep(delay)
+            else:
+                stop_event.wait(delay)
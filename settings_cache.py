@@ -0,0 +1,96 @@
+import os
+import threading
+from tracing import traced
+
+class Settings:
+    """Serves the values of the settings files from memory.
+
+    A settings file holds '# Selected', the selected value, '# Options' and one
+    supported option per line. Every file in the settings directory is read by
+    the first lookup, and a file is read again only when its modification time or
+    size changed. Values saved through 'set' are passed to the subscribed
+    callbacks as callback(settings_file, value).
+    """
+
+    def __init__(self, settings_dir):
+        self.settings_dir = settings_dir
+        self._entries = None # path -> (signature, selected value)
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def _signature(self, path):
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _read(self, path):
+        signature = self._signature(path)
+        with open(path, "r") as f:
+            lines = [line.strip() for line in f.readlines()]
+        selected = lines[1] if len(lines) >= 2 else None
+        self._entries[os.path.normpath(path)] = (signature, selected)
+
+    @traced
+    def _load_all(self):
+        self._entries = {}
+        try:
+            filenames = os.listdir(self.settings_dir)
+        except FileNotFoundError:
+            return
+        for filename in filenames:
+            path = os.path.join(self.settings_dir, filename)
+            if os.path.isfile(path):
+                self._read(path)
+
+    def _get_entry(self, path):
+        """Return the cached entry of 'path', reading the file if it changed. Raises FileNotFoundError."""
+        with self._lock:
+            if self._entries is None:
+                self._load_all()
+            key = os.path.normpath(path)
+            entry = self._entries.get(key)
+            try:
+                signature = self._signature(path)
+            except FileNotFoundError:
+                self._entries.pop(key, None)
+                raise
+            if entry is None or entry[0] != signature:
+                self._read(path)
+            return self._entries[key]
+
+    def get(self, path):
+        """Return the selected value of the settings file 'path', or None if it has none."""
+        return self._get_entry(path)[1]
+
+    def set(self, path, value):
+        """Save 'value' as the selected value of the settings file 'path' and notify the subscribers if it changed."""
+        with self._lock:
+            try:
+                with open(path, "r") as f:
+                    lines = f.readlines()
+            except FileNotFoundError:
+                lines = []
+            previous = lines[1].strip() if len(lines) >= 2 else None
+
+            # Replace or add the second line
+            if len(lines) >= 2:
+                lines[1] = value + "\n"
+            else:
+                while len(lines) < 1:
+                    lines.append("\n")
+                lines.append(value + "\n")
+
+            with open(path, "w") as f:
+                f.writelines(lines)
+            if self._entries is not None:
+                self._read(path)
+
+        if value != previous:
+            for callback in list(self._subscribers):
+                callback(path, value)
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
@@ -1,11 +1,13 @@
 import tkinter as tk
 from tkinter import Toplevel, StringVar, messagebox, ttk
-from utils import prevent_focus, load_dropdown
+from tracing import traced_methods
+from utils import prevent_focus, load_dropdown, settings
 
+@traced_methods
 class SettingsWindow:
     """A class to encapsulate the settings window logic."""
 
-    def __init__(self, root, file_display_file, exit_after_execution_file):
+    def __init__(self, root, file_display_file, exit_after_execution_file, max_parallel_links_file, storage_backend_file, capture_output_file, missed_runs_file, max_processes_file, batch_execution_file):
         self.root = root
         self.file_display_file = file_display_file
         self.file_display_var = StringVar()
@@ -13,6 +15,24 @@ class SettingsWindow:
         self.exit_after_execution_file = exit_after_execution_file
         self.exit_after_execution_var = StringVar()
         self.exit_after_execution_options = []
+        self.max_parallel_links_file = max_parallel_links_file
+        self.max_parallel_links_var = StringVar()
+        self.max_parallel_links_options = []
+        self.storage_backend_file = storage_backend_file
+        self.storage_backend_var = StringVar()
+        self.storage_backend_options = []
+        self.capture_output_file = capture_output_file
+        self.capture_output_var = StringVar()
+        self.capture_output_options = []
+        self.missed_runs_file = missed_runs_file
+        self.missed_runs_var = StringVar()
+        self.missed_runs_options = []
+        self.max_processes_file = max_processes_file
+        self.max_processes_var = StringVar()
+        self.max_processes_options = []
+        self.batch_execution_file = batch_execution_file
+        self.batch_execution_var = StringVar()
+        self.batch_execution_options = []
         self.focus_dropdown_var = StringVar()
         self.create_window()
         self.create_widgets()
@@ -21,7 +41,7 @@ class SettingsWindow:
         """Creates the settings window."""
         self.settings_window = Toplevel(self.root)
         self.settings_window.title("Settings")
-        self.settings_window.geometry("400x200")
+        self.settings_window.geometry("400x620")
         self.settings_window.resizable(False, False)
         self.settings_window.transient(self.root)
         self.settings_window.grab_set()
@@ -37,6 +57,12 @@ class SettingsWindow:
         label_frame.grid(row=0, column=0, sticky="nw", padx=5, pady=5)
         ttk.Label(label_frame, text="File Display:", width=15).grid(row=0, column=0, padx=5, pady=20, sticky="w")
         ttk.Label(label_frame, text="Exit After Execution:", width=18).grid(row=1, column=0, padx=5, pady=20, sticky="w")
+        ttk.Label(label_frame, text="Parallel Links:", width=15).grid(row=2, column=0, padx=5, pady=20, sticky="w")
+        ttk.Label(label_frame, text="Storage:", width=15).grid(row=3, column=0, padx=5, pady=20, sticky="w")
+        ttk.Label(label_frame, text="Capture Output:", width=15).grid(row=4, column=0, padx=5, pady=20, sticky="w")
+        ttk.Label(label_frame, text="Missed Runs:", width=15).grid(row=5, column=0, padx=5, pady=20, sticky="w")
+        ttk.Label(label_frame, text="Max Processes:", width=15).grid(row=6, column=0, padx=5, pady=20, sticky="w")
+        ttk.Label(label_frame, text="Batch Execution:", width=15).grid(row=7, column=0, padx=5, pady=20, sticky="w")
 
         # Dropdown frame
         dropdown_frame = tk.Frame(self.settings_window)
@@ -59,6 +85,60 @@ class SettingsWindow:
         self.exit_after_execution_dropdown.grid(row=1, column=0, padx=5, pady=20)
         self.exit_after_execution_dropdown.bind("<FocusIn>", prevent_focus)
 
+        self.max_parallel_links_dropdown = ttk.Combobox(
+            dropdown_frame,
+            textvariable=self.max_parallel_links_var,
+            state="readonly",
+            width=dropdown_width
+        )
+        self.max_parallel_links_dropdown.grid(row=2, column=0, padx=5, pady=20)
+        self.max_parallel_links_dropdown.bind("<FocusIn>", prevent_focus)
+
+        self.storage_backend_dropdown = ttk.Combobox(
+            dropdown_frame,
+            textvariable=self.storage_backend_var,
+            state="readonly",
+            width=dropdown_width
+        )
+        self.storage_backend_dropdown.grid(row=3, column=0, padx=5, pady=20)
+        self.storage_backend_dropdown.bind("<FocusIn>", prevent_focus)
+
+        self.capture_output_dropdown = ttk.Combobox(
+            dropdown_frame,
+            textvariable=self.capture_output_var,
+            state="readonly",
+            width=dropdown_width
+        )
+        self.capture_output_dropdown.grid(row=4, column=0, padx=5, pady=20)
+        self.capture_output_dropdown.bind("<FocusIn>", prevent_focus)
+
+        self.missed_runs_dropdown = ttk.Combobox(
+            dropdown_frame,
+            textvariable=self.missed_runs_var,
+            state="readonly",
+            width=dropdown_width
+        )
+        self.missed_runs_dropdown.grid(row=5, column=0, padx=5, pady=20)
+        self.missed_runs_dropdown.bind("<FocusIn>", prevent_focus)
+
+        self.max_processes_dropdown = ttk.Combobox(
+            dropdown_frame,
+            textvariable=self.max_processes_var,
+            state="readonly",
+            width=dropdown_width
+        )
+        self.max_processes_dropdown.grid(row=6, column=0, padx=5, pady=20)
+        self.max_processes_dropdown.bind("<FocusIn>", prevent_focus)
+
+        self.batch_execution_dropdown = ttk.Combobox(
+            dropdown_frame,
+            textvariable=self.batch_execution_var,
+            state="readonly",
+            width=dropdown_width
+        )
+        self.batch_execution_dropdown.grid(row=7, column=0, padx=5, pady=20)
+        self.batch_execution_dropdown.bind("<FocusIn>", prevent_focus)
+
         # Save button frame
         button_frame = tk.Frame(self.settings_window)
         button_frame.grid(row=1, column=0, columnspan=2, sticky="s", pady=20)
@@ -67,6 +147,12 @@ class SettingsWindow:
         # Initialize the dropdown menu
         load_dropdown(self.file_display_dropdown, self.file_display_file, self.file_display_var, self.file_display_options)
         load_dropdown(self.exit_after_execution_dropdown, self.exit_after_execution_file, self.exit_after_execution_var, self.exit_after_execution_options)
+        load_dropdown(self.max_parallel_links_dropdown, self.max_parallel_links_file, self.max_parallel_links_var, self.max_parallel_links_options)
+        load_dropdown(self.storage_backend_dropdown, self.storage_backend_file, self.storage_backend_var, self.storage_backend_options)
+        load_dropdown(self.capture_output_dropdown, self.capture_output_file, self.capture_output_var, self.capture_output_options)
+        load_dropdown(self.missed_runs_dropdown, self.missed_runs_file, self.missed_runs_var, self.missed_runs_options)
+        load_dropdown(self.max_processes_dropdown, self.max_processes_file, self.max_processes_var, self.max_processes_options)
+        load_dropdown(self.batch_execution_dropdown, self.batch_execution_file, self.batch_execution_var, self.batch_execution_options)
 
     def _on_close(self):
         """Release grab and close the edit chain window."""
@@ -74,22 +160,9 @@ class SettingsWindow:
         self.settings_window.destroy()
 
     def update_setting(self, value, settings_file):
-        """Save a setting selection to its file"""
+        """Save a setting selection to its file, notifying the windows subscribed to the settings"""
         try:
-            with open(settings_file, "r") as file:
-                lines = file.readlines()
-
-            # Replace or add the second line
-            if len(lines) >= 2:
-                lines[1] = value + "\n"
-            else:
-                while len(lines) < 1:
-                    lines.append("\n")
-                lines.append(value + "\n")
-
-            with open(settings_file, "w") as file:
-                file.writelines(lines)
-
+            settings.set(settings_file, value)
             return True
         except Exception as e:
             return False
@@ -100,5 +173,21 @@ class SettingsWindow:
         if not file_display_save_result: raise Exception("Error: could not save file display setting.")
         exit_after_execution_save_result = self.update_setting(self.exit_after_execution_var.get(), self.exit_after_execution_file)
         if not exit_after_execution_save_result: raise Exception("Error could not save exit after execution setting.")
-        messagebox.showinfo("Success", "Settings saved successfully!")
+        max_parallel_links_save_result = self.update_setting(self.max_parallel_links_var.get(), self.max_parallel_links_file)
+        if not max_parallel_links_save_result: raise Exception("Error: could not save parallel links setting.")
+        storage_backend_changed = self.storage_backend_options[1:2] != [self.storage_backend_var.get()]
+        storage_backend_save_result = self.update_setting(self.storage_backend_var.get(), self.storage_backend_file)
+        if not storage_backend_save_result: raise Exception("Error: could not save storage setting.")
+        capture_output_save_result = self.update_setting(self.capture_output_var.get(), self.capture_output_file)
+        if not capture_output_save_result: raise Exception("Error: could not save capture output setting.")
+        missed_runs_save_result = self.update_setting(self.missed_runs_var.get(), self.missed_runs_file)
+        if not missed_runs_save_result: raise Exception("Error: could not save missed runs setting.")
+        max_processes_save_result = self.update_setting(self.max_processes_var.get(), self.max_processes_file)
+        if not max_processes_save_result: raise Exception("Error: could not save max processes setting.")
+        batch_execution_save_result = self.update_setting(self.batch_execution_var.get(), self.batch_execution_file)
+        if not batch_execution_save_result: raise Exception("Error: could not save batch execution setting.")
+        if storage_backend_changed:
+            messagebox.showinfo("Success", "Settings saved successfully! The new storage setting takes effect after restarting the application.")
+        else:
+            messagebox.showinfo("Success", "Settings saved successfully!")
         self.settings_window.destroy()
@@ -0,0 +1,103 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils import SHELL_DETECTION_CACHE_FILE, detect_shell, identify_shell_by_path
+
+DETECTING_IDENTITY = "Detecting..." # Placeholder identity stored while detection runs in the background
+DETECTION_WORKERS = 8
+
+class DetectionCache:
+    """A persisted cache of detected shell identities keyed by (path, size, mtime)."""
+
+    def __init__(self, cache_file):
+        self.cache_file = cache_file
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def _key(self, path):
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        try:
+            with open(self.cache_file, "r") as f:
+                self._entries = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self._entries = {}
+
+    def get(self, path):
+        """Return the cached identity of 'path', or None if it is unknown or the file changed."""
+        try:
+            key = self._key(path)
+        except OSError:
+            return None
+        with self._lock:
+            self._load()
+            entry = self._entries.get(path)
+        if entry is None or entry["key"] != key:
+            return None
+        return entry["identity"]
+
+    def put(self, path, identity):
+        try:
+            key = self._key(path)
+        except OSError:
+            return
+        with self._lock:
+            self._load()
+            self._entries[path] = {"key": key, "identity": identity}
+
+    def save(self):
+        with self._lock:
+            if self._entries is None:
+                return
+            os.makedirs(os.path.dirname(self.cache_file) or ".", exist_ok=True)
+            temp_file = self.cache_file + ".tmp"
+            with open(temp_file, "w") as f:
+                json.dump(self._entries, f)
+            os.replace(temp_file, self.cache_file)
+
+detection_cache = DetectionCache(SHELL_DETECTION_CACHE_FILE)
+_executor = ThreadPoolExecutor(max_workers=DETECTION_WORKERS, thread_name_prefix="detect-shell")
+
+def needs_version_check(executable_path):
+    """Return True if the shell can only be identified by running it."""
+    return identify_shell_by_path(executable_path) == "Unknown Shell"
+
+def _detect(executable_path):
+    identity = detection_cache.get(executable_path)
+    if identity is None:
+        identity = detect_shell(executable_path)
+        if not identity.startswith("Error identifying shell"): # Retry failed detections next time
+            detection_cache.put(executable_path, identity)
+    return identity
+
+def detect_shell_cached(executable_path):
+    """Identify a shell, reusing the cached result while the executable is unchanged."""
+    if not needs_version_check(executable_path):
+        return identify_shell_by_path(executable_path)
+    identity = _detect(executable_path)
+    detection_cache.save()
+    return identity
+
+def detect_shells(executable_paths):
+    """Identify many shells in parallel. Returns a dict of path -> identity."""
+    identities = {}
+    unknown = []
+    for path in executable_paths:
+        if needs_version_check(path):
+            unknown.append(path)
+        else:
+            identities[path] = identify_shell_by_path(path)
+    for path, identity in zip(unknown, _executor.map(_detect, unknown)):
+        identities[path] = identity
+    if unknown:
+        detection_cache.save()
+    return identities
+
+def submit_detection(executable_path):
+    """Identify a shell on a worker thread. Returns a concurrent.futures.Future."""
+    return _executor.submit(detect_shell_cached, executable_path)
@@ -0,0 +1,83 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from shell_detection import detect_shells
+from utils import SHELL_MAPPING, normalize_path
+
+DISCOVERY_WORKERS = 16
+WINDOWS_EXECUTABLE_EXTENSIONS = (".exe", ".com", ".bat", ".cmd")
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="discover-shells")
+
+def is_known_shell_name(filename):
+    """Return True if 'filename' is listed in SHELL_MAPPING."""
+    name = filename.lower()
+    if name in SHELL_MAPPING:
+        return True
+    stem, extension = os.path.splitext(name)
+    return os.name == "nt" and extension in WINDOWS_EXECUTABLE_EXTENSIONS and stem in SHELL_MAPPING
+
+def scan_directory(directory):
+    """Return the paths of the known shell executables in 'directory'."""
+    shells = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not is_known_shell_name(entry.name):
+                    continue
+                try:
+                    if entry.is_file() and os.access(entry.path, os.X_OK):
+                        shells.append(normalize_path(entry.path))
+                except OSError:
+                    continue # Broken symlink or unreadable entry
+    except OSError:
+        pass # PATH entries that do not exist or cannot be read are skipped
+    return shells
+
+def get_path_directories(path=None):
+    """Return the distinct absolute directories of the PATH environment variable, in order.
+
+    Relative entries such as '.' or 'bin' are skipped, as they depend on the
+    working directory and the shells found there would be registered with a
+    path that breaks once the application runs from elsewhere.
+    """
+    if path is None:
+        path = os.environ.get("PATH", "")
+    directories = []
+    seen = set()
+    for directory in path.split(os.pathsep):
+        if directory and os.path.isabs(directory) and directory not in seen:
+            seen.add(directory)
+            directories.append(directory)
+    return directories
+
+def discover_shells(registered_shells=(), path=None):
+    """Scan every PATH directory in parallel for known shells that are not registered yet.
+
+    Shells reachable under several paths (for example through a symlinked
+    directory) are reported once, under the first path found in PATH order.
+    Returns a list of (shell, identity) tuples.
+    """
+    directories = get_path_directories(path)
+    known = {os.path.realpath(shell) for shell in registered_shells} | set(registered_shells)
+    discovered = []
+    with ThreadPoolExecutor(max_workers=DISCOVERY_WORKERS) as pool:
+        for shells in pool.map(scan_directory, directories):
+            for shell in shells:
+                real_path = os.path.realpath(shell)
+                if shell in known or real_path in known:
+                    continue
+                known.update((shell, real_path))
+                discovered.append(shell)
+    identities = detect_shells(discovered)
+    return [(shell, identities[shell]) for shell in discovered]
+
+def register_discovered_shells(storage, path=None):
+    """Discover new shells and register them with a single batched write. Returns the registered shells."""
+    discovered = discover_shells(storage.list_shells(), path)
+    if discovered:
+        storage.add_shells([(shell, identity, None) for shell, identity in discovered])
+    return discovered
+
+def submit_discovery(storage, path=None):
+    """Run register_discovered_shells on a worker thread. Returns a concurrent.futures.Future."""
+    return _executor.submit(register_discovered_shells, storage, path)
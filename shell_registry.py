@@ -0,0 +1,146 @@
+import csv
+import os
+import threading
+from collections import Counter
+from tracing import traced
+
+class ShellRegistry:
+    """An in-memory index of the shells, identities and shell options files.
+
+    The three files are read once and kept keyed by shell path. The index is
+    reloaded automatically whenever the modification time or size of any of
+    the files changes.
+    """
+
+    def __init__(self, shells_file, identities_file, shell_options_file):
+        self.shells_file = shells_file
+        self.identities_file = identities_file
+        self.shell_options_file = shell_options_file
+        self._signature = None
+        self._lock = threading.Lock()
+
+        # Rows in file order, as parsed by csv.reader.
+        self._shell_rows = []
+        self._identity_rows = []
+        self._option_rows = []
+
+        # Keyed indexes: shell path -> position, identity and options.
+        self._positions = {}
+        self._identities = {}
+        self._options = {}
+
+        # Number of entries per shell path in each file, used by the validators.
+        self._shell_counts = Counter()
+        self._identity_counts = Counter()
+        self._option_counts = Counter()
+
+    def _file_signatures(self):
+        signatures = []
+        for file in (self.shells_file, self.identities_file, self.shell_options_file):
+            try:
+                stat = os.stat(file)
+                signatures.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signatures.append(None)
+        return tuple(signatures)
+
+    def _read_rows(self, file):
+        with open(file, "r", newline="") as f:
+            return [row for row in csv.reader(f) if row]
+
+    def _ensure_loaded(self):
+        """Reload the index if any of the three files changed since it was built."""
+        signature = self._file_signatures()
+        if signature == self._signature:
+            return
+        with self._lock:
+            if signature != self._signature:
+                self._load(signature)
+
+    @traced
+    def _load(self, signature):
+        shell_rows = self._read_rows(self.shells_file)
+        identity_rows = self._read_rows(self.identities_file)
+        option_rows = self._read_rows(self.shell_options_file)
+
+        positions = {}
+        for i, row in enumerate(shell_rows):
+            positions.setdefault(row[0], i)
+        identities = {}
+        for row in identity_rows:
+            identities.setdefault(row[0], row[1] if len(row) > 1 else "")
+        options = {}
+        for row in option_rows:
+            options.setdefault(row[0], row)
+
+        self._shell_rows = shell_rows
+        self._identity_rows = identity_rows
+        self._option_rows = option_rows
+        self._positions = positions
+        self._identities = identities
+        self._options = options
+        self._shell_counts = Counter(row[0] for row in shell_rows)
+        self._identity_counts = Counter(row[0] for row in identity_rows)
+        self._option_counts = Counter(row[0] for row in option_rows)
+        self._signature = signature
+
+    def get_signature(self):
+        """Return the (mtime, size) pairs of the three files the index was built from."""
+        self._ensure_loaded()
+        return self._signature
+
+    def invalidate(self):
+        """Force the next lookup to reload the files."""
+        self._signature = None
+
+    def get_shells(self):
+        """Return the registered shell paths in file order."""
+        self._ensure_loaded()
+        return [row[0] for row in self._shell_rows]
+
+    def get_shell_rows(self):
+        self._ensure_loaded()
+        return [list(row) for row in self._shell_rows]
+
+    def get_identity_rows(self):
+        self._ensure_loaded()
+        return [list(row) for row in self._identity_rows]
+
+    def get_option_rows(self):
+        self._ensure_loaded()
+        return [list(row) for row in self._option_rows]
+
+    def get_position(self, shell):
+        """Return the line index of 'shell' in the shells file, or None."""
+        self._ensure_loaded()
+        return self._positions.get(shell)
+
+    def get_identity(self, shell):
+        self._ensure_loaded()
+        return self._identities.get(shell)
+
+    def get_options(self, shell):
+        """Return a copy of the options row for 'shell', or None."""
+        self._ensure_loaded()
+        options = self._options.get(shell)
+        return list(options) if options is not None else None
+
+    def get_shell_by_index(self, index):
+        self._ensure_loaded()
+        return self._shell_rows[index][0]
+
+    def get_identity_by_index(self, index):
+        self._ensure_loaded()
+        row = self._identity_rows[index]
+        return row[1] if len(row) > 1 else ""
+
+    def get_identity_row_by_index(self, index):
+        self._ensure_loaded()
+        if index < len(self._identity_rows):
+            return list(self._identity_rows[index])
+        return None
+
+    def count_entries(self, shell):
+        """Return how many times 'shell' appears in the shells, options and identities files."""
+        self._ensure_loaded()
+        return self._shell_counts[shell], self._option_counts[shell], self._identity_counts[shell]
@@ -0,0 +1,179 @@
+import csv
+import json
+import os
+
+class ShellUsageIndex:
+    """A persisted index from shell paths to the chains that use them.
+
+    The index is stored as a journal of JSON lines, one per chain change, so
+    recording a change only appends a line. The journal is compacted when it
+    grows to more than twice the number of chains. When the index is loaded,
+    chain files whose modification time or size differ from the index are read
+    again. Queries do not touch the chain files; chains edited by other
+    programs later on are picked up by 'refresh', which the application calls
+    for the chains its ChainsWatcher reports.
+    """
+
+    def __init__(self, chains_dir, index_file):
+        self.chains_dir = chains_dir
+        self.index_file = index_file
+        self._chains = None # chain name -> {"shells": [...], "signature": [mtime, size]}
+        self._usage = {} # shell path -> set of chain names
+        self._journal_length = 0
+
+    def _chain_file(self, chain_name):
+        return os.path.join(self.chains_dir, f"{chain_name}.csv")
+
+    def _file_signature(self, path):
+        stat = os.stat(path)
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def _read_shells(self, chain_name):
+        with open(self._chain_file(chain_name), "r", newline="") as f:
+            return sorted({row[0] for row in csv.reader(f) if row})
+
+    def _set(self, chain_name, shells, signature):
+        self._discard(chain_name)
+        self._chains[chain_name] = {"shells": shells, "signature": signature}
+        for shell in shells:
+            self._usage.setdefault(shell, set()).add(chain_name)
+
+    def _discard(self, chain_name):
+        entry = self._chains.pop(chain_name, None)
+        if entry is None:
+            return
+        for shell in entry["shells"]:
+            chains = self._usage.get(shell)
+            if chains is not None:
+                chains.discard(chain_name)
+                if not chains:
+                    del self._usage[shell]
+
+    def _load(self):
+        """Read the journal and bring it up to date with the chain files, once per process."""
+        if self._chains is not None:
+            return
+        self._chains = {}
+        self._usage = {}
+        self._journal_length = 0
+        try:
+            with open(self.index_file, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue # A partially written last line
+                    self._journal_length += 1
+                    if record.get("shells") is None:
+                        self._discard(record["chain"])
+                    else:
+                        self._set(record["chain"], record["shells"], record["signature"])
+        except FileNotFoundError:
+            pass
+        self._reconcile()
+
+    def _reconcile(self):
+        """Re-read the chain files whose modification time or size changed since they were indexed."""
+        changed = False
+        chain_names = set()
+        try:
+            filenames = os.listdir(self.chains_dir)
+        except FileNotFoundError:
+            filenames = []
+        for filename in filenames:
+            if not filename.endswith(".csv"):
+                continue
+            chain_name = os.path.splitext(filename)[0]
+            try:
+                signature = self._file_signature(self._chain_file(chain_name))
+            except FileNotFoundError:
+                continue # Deleted since it was listed
+            chain_names.add(chain_name)
+            entry = self._chains.get(chain_name)
+            if entry is None or entry["signature"] != signature:
+                self._set(chain_name, self._read_shells(chain_name), signature)
+                changed = True
+        for chain_name in set(self._chains) - chain_names:
+            self._discard(chain_name)
+            changed = True
+
+        if changed or not self._journal_length:
+            self._compact()
+
+    def _append(self, record):
+        os.makedirs(os.path.dirname(self.index_file) or ".", exist_ok=True)
+        with open(self.index_file, "a") as f:
+            f.write(json.dumps(record) + "\n")
+        self._journal_length += 1
+        if self._journal_length > 2 * len(self._chains) + 16:
+            self._compact()
+
+    def _compact(self):
+        """Rewrite the journal with one line per chain."""
+        os.makedirs(os.path.dirname(self.index_file) or ".", exist_ok=True)
+        temp_file = self.index_file + ".tmp"
+        with open(temp_file, "w") as f:
+            for chain_name, entry in self._chains.items():
+                f.write(json.dumps({"chain": chain_name, "shells": entry["shells"], "signature": entry["signature"]}) + "\n")
+        os.replace(temp_file, self.index_file)
+        self._journal_length = len(self._chains)
+
+    def update_chain(self, chain_name, rows):
+        """Record the shells used by a chain that was just written."""
+        self._load()
+        shells = sorted({row[0] for row in rows if row})
+        signature = self._file_signature(self._chain_file(chain_name))
+        self._set(chain_name, shells, signature)
+        self._append({"chain": chain_name, "shells": shells, "signature": signature})
+
+    def remove_chain(self, chain_name):
+        """Record that a chain was deleted."""
+        self._load()
+        self._discard(chain_name)
+        self._append({"chain": chain_name, "shells": None})
+
+    def get_chains(self, shells):
+        """Return the names of the chains that use any of 'shells'."""
+        self._load()
+        chains = set()
+        for shell in shells:
+            chains.update(self._usage.get(shell, ()))
+        return chains
+
+    def get_chain_counts(self):
+        """Return the number of chains using each shell."""
+        self._load()
+        return {shell: len(chains) for shell, chains in self._usage.items()}
+
+    def refresh(self, chain_names=None):
+        """Re-read the chain files changed by other programs since they were indexed.
+
+        Only the chains in 'chain_names' are checked if it is given, otherwise
+        every chain file is.
+        """
+        if self._chains is None:
+            self._load() # Checks every chain file
+            return
+        if chain_names is None:
+            self._reconcile()
+            return
+        for chain_name in chain_names:
+            try:
+                signature = self._file_signature(self._chain_file(chain_name))
+                entry = self._chains.get(chain_name)
+                if entry is not None and entry["signature"] == signature:
+                    continue
+                shells = self._read_shells(chain_name)
+            except FileNotFoundError:
+                if chain_name in self._chains:
+                    self.remove_chain(chain_name)
+                continue
+            self._set(chain_name, shells, signature)
+            self._append({"chain": chain_name, "shells": shells, "signature": signature})
+
+    def rebuild(self):
+        """Discard the index and rebuild it from the chain files."""
+        self._chains = {}
+        self._usage = {}
+        self._journal_length = 0
+        self._reconcile()
@@ -1,26 +1,32 @@
 import os
-import csv
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 from edit_shell_window import EditShellWindow
-from utils import listbox_clicked_dead_space, get_setting, normalize_path, detect_shell, get_shell_by_index, get_shell_identity_by_index, SHELL_OPTIONS_FILE, SCRIPT_PLACEHOLDER, delete_file_row
+from storage import get_storage
+from shell_discovery import submit_discovery
+from shell_detection import DETECTING_IDENTITY, detect_shell_cached, needs_version_check, submit_detection
+from tracing import traced_methods
+from utils import EXECUTION_POLL_INTERVAL, listbox_clicked_dead_space, get_setting, normalize_path, settings
 
+@traced_methods
 class ShellsWindow:
-    def __init__(self, root, shells_file, identities_file, file_display_file, chains_dir):
+    def __init__(self, root, file_display_file):
         self.root = root
-        self.shells_file = shells_file
-        self.identities_file = identities_file
         self.file_display_file = file_display_file
-        self.chains_dir = chains_dir
+        self.shells = [] # The shells in the order they are listed
+        self.pending_detections = set() # Shells whose identity is being detected on a worker thread
+        self.chain_counts = {} # Number of chains using each shell
 
         self.shells_window = tk.Toplevel(self.root)
         self.shells_window.title("Shells")
-        self.shells_window.geometry("400x300")
+        self.shells_window.geometry("480x300")
         self.shells_window.resizable(False, False)
         self.shells_window.bind("<Button-1>", self.handle_outside_click)
         self.shells_window.transient(self.root)
         self.shells_window.grab_set()
         self.shells_window.protocol("WM_DELETE_WINDOW", self._on_close)
+        self.shells_window.bind("<Destroy>", self._on_destroy)
+        settings.subscribe(self._on_setting_changed)
 
         self._setup_ui()
         self.load_shells()
@@ -49,6 +55,9 @@ class ShellsWindow:
         self.add_shell_button = tk.Button(shell_button_frame, text="Add Shell", command=self.add_shell)
         self.add_shell_button.pack(side=tk.LEFT, padx=5)
 
+        self.discover_shells_button = tk.Button(shell_button_frame, text="Discover Shells", command=self.discover_shells)
+        self.discover_shells_button.pack(side=tk.LEFT, padx=5)
+
         self.edit_shell_button = tk.Button(shell_button_frame, text="Edit Options", command=self.open_edit_shell_window)
         self.edit_shell_button.pack(side=tk.LEFT, padx=5)
         self.edit_shell_button.config(state="disabled")
@@ -57,21 +66,36 @@ class ShellsWindow:
         self.remove_shell_button.pack(side=tk.LEFT, padx=5)
         self.remove_shell_button.config(state="disabled")
 
+    def _on_destroy(self, event):
+        if event.widget == self.shells_window:
+            settings.unsubscribe(self._on_setting_changed)
+
+    def _on_setting_changed(self, settings_file, value):
+        if settings_file == self.file_display_file:
+            self.display_shells()
+
     def load_shells(self):
-        """Load shells from the CSV file."""
-        self.shell_listbox.delete(0, tk.END)
+        """Load shells from storage."""
         try:
-            with open(self.shells_file, "r") as f:
-                reader = csv.reader(f)
-                for row in reader:
-                    if row:
-                        file_display_setting = get_setting(self.file_display_file)
-                        if file_display_setting == "Full path":
-                            self.shell_listbox.insert(tk.END, row[0])
-                        elif file_display_setting == "File name only":
-                            self.shell_listbox.insert(tk.END, os.path.basename(row[0]))
+            self.shells = get_storage().list_shells()
+            self.chain_counts = get_storage().get_chain_counts()
+            for shell in self.shells:
+                if get_storage().get_shell_identity(shell) == DETECTING_IDENTITY and shell not in self.pending_detections:
+                    self.detect_in_background(shell) # Detection was interrupted before it finished
         except Exception as e:
             messagebox.showerror("Error", f"Failed to load shells: {e}")
+        self.display_shells()
+
+    def display_shells(self):
+        """Fill the listbox with the loaded shells, displayed according to the file display setting."""
+        self.shell_listbox.delete(0, tk.END)
+        file_display_setting = get_setting(self.file_display_file)
+        for shell in self.shells:
+            usage = f" (used by {self.chain_counts.get(shell, 0)} chains)"
+            if file_display_setting == "Full path":
+                self.shell_listbox.insert(tk.END, shell + usage)
+            elif file_display_setting == "File name only":
+                self.shell_listbox.insert(tk.END, os.path.basename(shell) + usage)
 
     def add_shell(self):
         """Add a new shell program."""
@@ -79,22 +103,65 @@ class ShellsWindow:
         if filepath:
             try:
                 normalized_path = normalize_path(filepath)
-                with open(self.shells_file, "a", newline="") as f:
-                    writer = csv.writer(f)
-                    writer.writerow([normalized_path])
-                with open(self.identities_file, "a", newline="") as f:
-                    writer = csv.writer(f)
-                    writer.writerow([normalized_path, detect_shell(normalized_path)])
-                with open(SHELL_OPTIONS_FILE, "a", newline="") as f:
-                    writer = csv.writer(f)
-                    writer.writerow([normalized_path, "", SCRIPT_PLACEHOLDER, ""])
+                if needs_version_check(normalized_path):
+                    # Store a placeholder identity and run the shell on a worker thread to identify it
+                    get_storage().add_shell(normalized_path, DETECTING_IDENTITY)
+                    self.detect_in_background(normalized_path)
+                else:
+                    get_storage().add_shell(normalized_path, detect_shell_cached(normalized_path))
 
                 self.load_shells()
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to add shell: {e}")
 
+    def discover_shells(self):
+        """Register every known shell found in the PATH directories that is not registered yet."""
+        self.discover_shells_button.config(state="disabled")
+        future = submit_discovery(get_storage())
+
+        def report():
+            if not future.done():
+                self.root.after(EXECUTION_POLL_INTERVAL, report)
+                return
+            if not self.shells_window.winfo_exists():
+                return
+            self.discover_shells_button.config(state="normal")
+            try:
+                discovered = future.result()
+            except Exception as e:
+                messagebox.showerror("Error", f"Failed to discover shells: {e}")
+                return
+            self.load_shells()
+            if discovered:
+                messagebox.showinfo("Success", f"Registered {len(discovered)} new shell(s).")
+            else:
+                messagebox.showinfo("Discover Shells", "No new shells were found.")
+
+        self.root.after(EXECUTION_POLL_INTERVAL, report)
+
+    def detect_in_background(self, shell):
+        """Detect the identity of 'shell' on a worker thread and store it once it is known."""
+        self.pending_detections.add(shell)
+        future = submit_detection(shell)
+
+        def store_identity():
+            if not future.done():
+                self.root.after(EXECUTION_POLL_INTERVAL, store_identity)
+                return
+            self.pending_detections.discard(shell)
+            try:
+                storage = get_storage()
+                # Keep any identity the user entered while detection was running
+                if storage.get_shell_identity(shell) == DETECTING_IDENTITY:
+                    storage.update_shell(shell, future.result(), storage.get_shell_options(shell))
+            except Exception:
+                pass # The shell was removed in the meantime
+
+        self.root.after(EXECUTION_POLL_INTERVAL, store_identity)
+
     def open_edit_shell_window(self):
-        EditShellWindow(self.root, get_shell_by_index(self.shell_listbox.curselection()[0]).rstrip(), get_shell_identity_by_index(self.shell_listbox.curselection()[0]).rstrip(), self.shell_listbox.curselection()[0])
+        shell = self.shells[self.shell_listbox.curselection()[0]]
+        EditShellWindow(self.root, shell, get_storage().get_shell_identity(shell) or "")
 
     def remove_selected_shell(self):
         """Remove the selected shell from the list."""
@@ -105,30 +172,8 @@ class ShellsWindow:
 
         if messagebox.askyesno("Confirm Delete", "WARNING: deleting a shell program will remove all execution chain links that use it. Are you sure you want to delete the selected shell program?"):
             try:
-                # Read all shells, filter out selected ones
-                with open(self.shells_file, "r") as f:
-                    rows = list(csv.reader(f))
-                remaining_rows = [row for i, row in enumerate(rows) if i not in selected_indices]
-
-                # Write back the remaining rows
-                with open(self.shells_file, "w", newline="") as f:
-                    writer = csv.writer(f)
-                    writer.writerows(remaining_rows)
-                
-                delete_file_row(self.identities_file, selected_indices)
-                delete_file_row(SHELL_OPTIONS_FILE, selected_indices)
-
-                # Remove all links that use the selected shell from all chains
-                selected_shells = {rows[i][0] for i in selected_indices} # Get selected shell names
-                for chain_file in os.listdir(self.chains_dir):
-                    chain_path = os.path.join(self.chains_dir, chain_file)
-                    if os.path.isfile(chain_path) and chain_file.endswith(".csv"):
-                        with open(chain_path, "r") as chain_f:
-                            chain_links = list(csv.reader(chain_f))
-                            filtered_links = [link for link in chain_links if link[0] not in selected_shells]
-                        with open(chain_path, "w", newline="") as chain_f:
-                            writer = csv.writer(chain_f)
-                            writer.writerows(filtered_links)
+                # Remove the selected shells and all links that use them
+                get_storage().remove_shells([self.shells[i] for i in selected_indices])
 
                 # Reload shells and reset the button state
                 self.load_shells()
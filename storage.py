@@ -0,0 +1,469 @@
+import contextlib
+import csv
+import json
+import os
+import sqlite3
+import threading
+from shell_usage_index import ShellUsageIndex
+from utils import SHELL_USAGE_INDEX_FILE, CHAINS_DIR, SHELLS_FILE, IDENTITIES_FILE, SHELL_OPTIONS_FILE, DATABASE_FILE, SCRIPT_PLACEHOLDER, shell_registry, get_shell_options, get_storage_backend, is_chain_link, split_link_row, join_link_row, remove_chain_links, get_link_dependencies, validate_file, validate_link_options, validate_once
+
+def _file_signature(file):
+    stat = os.stat(file)
+    return (stat.st_mtime_ns, stat.st_size)
+
+class CsvStorage:
+    """Stores each chain in its own CSV file and the shells in three line-aligned CSV files."""
+
+    name = "CSV"
+
+    def __init__(self, chains_dir=CHAINS_DIR, usage_index_file=SHELL_USAGE_INDEX_FILE):
+        self.chains_dir = chains_dir
+        self.usage_index = ShellUsageIndex(chains_dir, usage_index_file)
+
+    def transaction(self):
+        """The CSV layout has no transactions, changes are written immediately."""
+        return contextlib.nullcontext()
+
+    def _chain_file(self, chain_name):
+        return os.path.join(self.chains_dir, f"{chain_name}.csv")
+
+    def _write_rows(self, file, rows):
+        with open(file, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerows(rows)
+
+    def _write_rows_atomic(self, file, rows):
+        """Write to a temporary file next to 'file' and rename it over 'file'."""
+        directory, filename = os.path.split(file)
+        temp_file = os.path.join(directory, f".{filename}.tmp") # Not listed as a chain while it is written
+        try:
+            self._write_rows(temp_file, rows)
+            os.replace(temp_file, file)
+        except BaseException:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
+
+    def list_chains(self):
+        return [os.path.splitext(filename)[0] for filename in os.listdir(self.chains_dir) if filename.endswith(".csv")]
+
+    def chain_exists(self, chain_name):
+        return os.path.isfile(self._chain_file(chain_name))
+
+    def load_chain(self, chain_name):
+        with open(self._chain_file(chain_name), "r", newline="") as f:
+            return [row for row in csv.reader(f) if row]
+
+    def get_plan_signature(self, chain_name):
+        """Return the (mtime, size) of the chain file and of the shell options file. Raises FileNotFoundError."""
+        return [_file_signature(self._chain_file(chain_name)), _file_signature(SHELL_OPTIONS_FILE)]
+
+    def save_chain(self, chain_name, rows):
+        self._write_rows_atomic(self._chain_file(chain_name), rows)
+        self.usage_index.update_chain(chain_name, rows)
+
+    def delete_chain(self, chain_name):
+        os.remove(self._chain_file(chain_name))
+        self.usage_index.remove_chain(chain_name)
+
+    def get_chain_counts(self):
+        """Return the number of chains using each shell."""
+        return self.usage_index.get_chain_counts()
+
+    def refresh_chain_usage(self, chain_names=None):
+        """Update the shell usage of chains written by other programs, all of them if 'chain_names' is None."""
+        self.usage_index.refresh(chain_names)
+
+    def list_shells(self):
+        return shell_registry.get_shells()
+
+    def get_shell_identity(self, shell):
+        return shell_registry.get_identity(shell)
+
+    def get_shell_options(self, shell):
+        return get_shell_options(shell)
+
+    def add_shell(self, shell, identity, options=None):
+        self.add_shells([(shell, identity, options)])
+
+    def add_shells(self, shells):
+        """Register several (shell, identity, options) entries with one write per file. 'options' may be None."""
+        shells = [(shell, identity, options or [shell, "", SCRIPT_PLACEHOLDER, ""]) for shell, identity, options in shells]
+        with open(SHELLS_FILE, "a", newline="") as f:
+            csv.writer(f).writerows([shell] for shell, _, _ in shells)
+        with open(IDENTITIES_FILE, "a", newline="") as f:
+            csv.writer(f).writerows([shell, identity] for shell, identity, _ in shells)
+        with open(SHELL_OPTIONS_FILE, "a", newline="") as f:
+            csv.writer(f).writerows(options for _, _, options in shells)
+        shell_registry.invalidate()
+
+    def update_shell(self, shell, identity, options):
+        """Replace the identity and options of a registered shell."""
+        position = shell_registry.get_position(shell)
+        if position is None:
+            raise Exception(f"shell '{shell}' is not registered")
+
+        identity_rows = shell_registry.get_identity_rows()
+        identity_rows[position] = [shell, identity]
+        self._write_rows(IDENTITIES_FILE, identity_rows)
+
+        option_rows = shell_registry.get_option_rows()
+        for i, row in enumerate(option_rows):
+            if row[0] == shell:
+                option_rows[i] = list(options)
+                break
+        self._write_rows(SHELL_OPTIONS_FILE, option_rows)
+        shell_registry.invalidate()
+
+    def remove_shells(self, shells):
+        """Remove shells and every chain link that uses them."""
+        shells = set(shells)
+        self._write_rows(SHELLS_FILE, [row for row in shell_registry.get_shell_rows() if row[0] not in shells])
+        self._write_rows(IDENTITIES_FILE, [row for row in shell_registry.get_identity_rows() if row[0] not in shells])
+        self._write_rows(SHELL_OPTIONS_FILE, [row for row in shell_registry.get_option_rows() if row[0] not in shells])
+        shell_registry.invalidate()
+
+        # Remove all links that use the selected shells from the chains that reference them
+        for chain_name in sorted(self.usage_index.get_chains(shells)):
+            rows = self.load_chain(chain_name)
+            removed = [i for i, row in enumerate(rows) if row[0] in shells]
+            if removed:
+                self.save_chain(chain_name, remove_chain_links(rows, removed))
+
+    def clear(self):
+        """Delete every chain and shell."""
+        for chain_name in self.list_chains():
+            self.delete_chain(chain_name)
+        for file in (SHELLS_FILE, IDENTITIES_FILE, SHELL_OPTIONS_FILE):
+            self._write_rows(file, [])
+        shell_registry.invalidate()
+        self.usage_index.rebuild()
+
+class SqliteStorage:
+    """Stores chains and shells in an SQLite database with indexed tables.
+
+    Every change runs in a transaction, and several changes can be grouped into
+    one with 'transaction()'. The connection is shared between threads and
+    guarded by a lock.
+    """
+
+    name = "SQLite"
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS shells (
+            id INTEGER PRIMARY KEY,
+            path TEXT NOT NULL UNIQUE,
+            position INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS identities (
+            shell_id INTEGER PRIMARY KEY REFERENCES shells(id) ON DELETE CASCADE,
+            identity TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS options (
+            shell_id INTEGER PRIMARY KEY REFERENCES shells(id) ON DELETE CASCADE,
+            pre_script TEXT NOT NULL,
+            script TEXT NOT NULL,
+            post_script TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS chains (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        );
+        CREATE TABLE IF NOT EXISTS links (
+            chain_id INTEGER NOT NULL REFERENCES chains(id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            shell TEXT NOT NULL,
+            script TEXT NOT NULL,
+            run_after TEXT,
+            options TEXT,
+            PRIMARY KEY (chain_id, position)
+        );
+        CREATE INDEX IF NOT EXISTS links_by_shell ON links(shell);
+        CREATE INDEX IF NOT EXISTS shells_by_position ON shells(position);
+    """
+
+    def __init__(self, database_file=DATABASE_FILE):
+        self.database_file = database_file
+        os.makedirs(os.path.dirname(database_file) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(database_file, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA foreign_keys = ON")
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.executescript(self.SCHEMA)
+        link_columns = [name for _, name, *_ in self._connection.execute("PRAGMA table_info(links)")]
+        if "options" not in link_columns:
+            self._connection.execute("ALTER TABLE links ADD COLUMN options TEXT") # Databases created before link options
+        self._lock = threading.RLock()
+        self._depth = 0
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Group several operations into one transaction. Transactions can be nested."""
+        with self._lock:
+            if self._depth == 0:
+                self._connection.execute("BEGIN IMMEDIATE")
+            self._depth += 1
+            try:
+                yield self._connection
+            except BaseException:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._connection.execute("ROLLBACK")
+                raise
+            self._depth -= 1
+            if self._depth == 0:
+                self._connection.execute("COMMIT")
+
+    def _query(self, sql, parameters=()):
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def close(self):
+        self._connection.close()
+
+    def list_chains(self):
+        return [name for (name,) in self._query("SELECT name FROM chains ORDER BY name")]
+
+    def chain_exists(self, chain_name):
+        return bool(self._query("SELECT 1 FROM chains WHERE name = ?", (chain_name,)))
+
+    def load_chain(self, chain_name):
+        with self._lock:
+            if not self.chain_exists(chain_name):
+                raise Exception(f"chain '{chain_name}' does not exist")
+            rows = self._connection.execute(
+                "SELECT links.shell, links.script, links.run_after, links.options FROM links JOIN chains ON chains.id = links.chain_id "
+                "WHERE chains.name = ? ORDER BY links.position",
+                (chain_name,)
+            ).fetchall()
+        return [
+            join_link_row([shell, script] if run_after is None else [shell, script, run_after], json.loads(options) if options else {})
+            for shell, script, run_after, options in rows
+        ]
+
+    def get_plan_signature(self, chain_name):
+        """Return the (mtime, size) of the database and its write-ahead log, which change with every commit."""
+        wal_file = self.database_file + "-wal"
+        return [_file_signature(self.database_file), _file_signature(wal_file) if os.path.exists(wal_file) else None]
+
+    def save_chain(self, chain_name, rows):
+        with self.transaction() as connection:
+            connection.execute("INSERT OR IGNORE INTO chains (name) VALUES (?)", (chain_name,))
+            (chain_id,) = connection.execute("SELECT id FROM chains WHERE name = ?", (chain_name,)).fetchone()
+            connection.execute("DELETE FROM links WHERE chain_id = ?", (chain_id,))
+            links = []
+            for i, row in enumerate(rows):
+                columns, options = split_link_row(row)
+                links.append((chain_id, i, columns[0], columns[1], columns[2] if len(columns) > 2 else None, json.dumps(options) if options else None))
+            connection.executemany(
+                "INSERT INTO links (chain_id, position, shell, script, run_after, options) VALUES (?, ?, ?, ?, ?, ?)",
+                links
+            )
+
+    def delete_chain(self, chain_name):
+        with self.transaction() as connection:
+            connection.execute("DELETE FROM chains WHERE name = ?", (chain_name,))
+
+    def list_shells(self):
+        return [path for (path,) in self._query("SELECT path FROM shells ORDER BY position")]
+
+    def get_chain_counts(self):
+        """Return the number of chains using each shell."""
+        return dict(self._query("SELECT shell, COUNT(DISTINCT chain_id) FROM links GROUP BY shell"))
+
+    def get_shell_identity(self, shell):
+        rows = self._query("SELECT identity FROM identities JOIN shells ON shells.id = identities.shell_id WHERE shells.path = ?", (shell,))
+        return rows[0][0] if rows else None
+
+    def get_shell_options(self, shell):
+        rows = self._query(
+            "SELECT shells.path, options.pre_script, options.script, options.post_script FROM options "
+            "JOIN shells ON shells.id = options.shell_id WHERE shells.path = ?",
+            (shell,)
+        )
+        if not rows:
+            raise Exception("Error: could not find shell options for shell: " + str(shell))
+        return list(rows[0])
+
+    def add_shell(self, shell, identity, options=None):
+        self.add_shells([(shell, identity, options)])
+
+    def add_shells(self, shells):
+        """Register several (shell, identity, options) entries in one transaction. 'options' may be None."""
+        with self.transaction() as connection:
+            (position,) = connection.execute("SELECT COALESCE(MAX(position) + 1, 0) FROM shells").fetchone()
+            for shell, identity, options in shells:
+                if options is None:
+                    options = [shell, "", SCRIPT_PLACEHOLDER, ""]
+                shell_id = connection.execute("INSERT INTO shells (path, position) VALUES (?, ?)", (shell, position)).lastrowid
+                connection.execute("INSERT INTO identities (shell_id, identity) VALUES (?, ?)", (shell_id, identity))
+                connection.execute("INSERT INTO options (shell_id, pre_script, script, post_script) VALUES (?, ?, ?, ?)", (shell_id, options[1], options[2], options[3]))
+                position += 1
+
+    def update_shell(self, shell, identity, options):
+        """Replace the identity and options of a registered shell."""
+        with self.transaction() as connection:
+            row = connection.execute("SELECT id FROM shells WHERE path = ?", (shell,)).fetchone()
+            if row is None:
+                raise Exception(f"shell '{shell}' is not registered")
+            connection.execute("INSERT OR REPLACE INTO identities (shell_id, identity) VALUES (?, ?)", (row[0], identity))
+            connection.execute("INSERT OR REPLACE INTO options (shell_id, pre_script, script, post_script) VALUES (?, ?, ?, ?)", (row[0], options[1], options[2], options[3]))
+
+    def remove_shells(self, shells):
+        """Remove shells and every chain link that uses them."""
+        shells = list(shells)
+        with self.transaction() as connection:
+            placeholders = ",".join("?" * len(shells))
+            affected_chains = connection.execute(
+                f"SELECT DISTINCT chains.name FROM links JOIN chains ON chains.id = links.chain_id WHERE links.shell IN ({placeholders})",
+                shells
+            ).fetchall()
+            for (chain_name,) in affected_chains:
+                rows = self.load_chain(chain_name)
+                removed = [i for i, row in enumerate(rows) if row[0] in shells]
+                self.save_chain(chain_name, remove_chain_links(rows, removed))
+            connection.execute(f"DELETE FROM shells WHERE path IN ({placeholders})", shells)
+
+    def clear(self):
+        """Delete every chain and shell."""
+        with self.transaction() as connection:
+            connection.execute("DELETE FROM chains")
+            connection.execute("DELETE FROM shells")
+
+    def validate(self):
+        """Validate the stored shells and chains."""
+        try:
+            for shell in self.list_shells():
+                validate_file(shell)
+                options = self.get_shell_options(shell)
+                if options[2] != SCRIPT_PLACEHOLDER:
+                    raise Exception(f"invalid third option '{options[2]}' for shell {shell}.")
+        except Exception as e:
+            raise Exception(f"shells table is invalid ---> {e}")
+
+        shells = set(self.list_shells())
+        chains = self.list_chains()
+        chain_names = set(chains)
+        results = {}
+        for chain_name in chains:
+            try:
+                for i, row in enumerate(self.load_chain(chain_name)):
+                    try:
+                        if is_chain_link(row):
+                            if row[1] not in chain_names:
+                                raise Exception(f"included chain '{row[1]}' does not exist")
+                        elif row[0] not in shells:
+                            raise Exception(f"shell '{row[0]}' is not registered")
+                        else:
+                            validate_once(validate_file, row[1], results)
+                        validate_link_options(split_link_row(row)[1])
+                        get_link_dependencies(row, i)
+                    except Exception as e:
+                        raise Exception(f"link {i} is invalid ---> {e}.")
+            except Exception as e:
+                raise Exception(f"chains table is invalid ---> chain '{chain_name}' is invalid ---> {e}")
+
+_storage = None
+
+def get_storage():
+    """Return the storage backend selected in the settings.
+
+    The backend is chosen once per process. The first time the SQLite backend is
+    used, the database is created and filled from the CSV layout.
+    """
+    global _storage
+    if _storage is None:
+        if get_storage_backend() == "SQLite":
+            if not os.path.exists(DATABASE_FILE):
+                _build_database(DATABASE_FILE)
+            _storage = SqliteStorage(DATABASE_FILE)
+        else:
+            _storage = CsvStorage()
+    return _storage
+
+def _remove_database_files(database_file):
+    for file in (database_file, database_file + "-wal", database_file + "-shm"):
+        if os.path.exists(file):
+            os.remove(file)
+
+def _build_database(database_file):
+    """Create 'database_file' from the CSV layout.
+
+    The database is filled under a temporary name and only renamed into place
+    once the whole layout was copied, so a failed import is retried on the next
+    launch instead of leaving an empty database behind.
+    """
+    directory, filename = os.path.split(database_file)
+    temp_file = os.path.join(directory, f".{filename}.tmp")
+    _remove_database_files(temp_file) # Left over from an import that was interrupted
+    try:
+        storage = SqliteStorage(temp_file)
+        try:
+            copy_storage(CsvStorage(), storage)
+        finally:
+            storage.close() # Checkpoints the write-ahead log into the database file
+        os.replace(temp_file, database_file)
+    except BaseException:
+        _remove_database_files(temp_file)
+        raise
+
+def copy_storage(source, target):
+    """Replace the chains and shells of 'target' with those of 'source'."""
+    with target.transaction():
+        target.clear()
+        for shell in source.list_shells():
+            target.add_shell(shell, source.get_shell_identity(shell) or "", source.get_shell_options(shell))
+        for chain_name in source.list_chains():
+            target.save_chain(chain_name, source.load_chain(chain_name))
+
+def import_csv(database_file=DATABASE_FILE):
+    """Replace the contents of the database with the CSV layout."""
+    copy_storage(CsvStorage(), SqliteStorage(database_file))
+
+def export_csv(database_file=DATABASE_FILE):
+    """Replace the CSV layout with the contents of the database.
+
+    The layout is written to a staging directory and temporary shell files
+    first, and swapped in only once the whole database was read, so a failed
+    export leaves the CSV layout untouched. Chain files are moved into the
+    existing Chains directory one by one so a running ChainsWatcher keeps its
+    watch.
+    """
+    import shutil # Imported here, as only the export needs it
+    source = SqliteStorage(database_file)
+    staging_dir = f".{CHAINS_DIR}.export.tmp"
+    shell_files = (SHELLS_FILE, IDENTITIES_FILE, SHELL_OPTIONS_FILE)
+    temp_files = [os.path.join(os.path.dirname(file), f".{os.path.basename(file)}.tmp") for file in shell_files]
+    if os.path.exists(staging_dir):
+        shutil.rmtree(staging_dir)
+    try:
+        staging = CsvStorage(staging_dir, os.path.join(staging_dir, "shell_usage.jsonl"))
+        os.makedirs(staging_dir)
+        chain_names = source.list_chains()
+        for chain_name in chain_names:
+            staging._write_rows(staging._chain_file(chain_name), source.load_chain(chain_name))
+        shells = source.list_shells()
+        staging._write_rows(temp_files[0], [[shell] for shell in shells])
+        staging._write_rows(temp_files[1], [[shell, source.get_shell_identity(shell) or ""] for shell in shells])
+        staging._write_rows(temp_files[2], [source.get_shell_options(shell) for shell in shells])
+    except BaseException:
+        for file in temp_files:
+            if os.path.exists(file):
+                os.remove(file)
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+    finally:
+        source.close()
+
+    # Everything was read, swap the staged layout in
+    target = CsvStorage()
+    exported = set(chain_names)
+    for chain_name in target.list_chains():
+        if chain_name not in exported:
+            os.remove(target._chain_file(chain_name))
+    for chain_name in chain_names:
+        os.replace(staging._chain_file(chain_name), target._chain_file(chain_name))
+    for temp_file, file in zip(temp_files, shell_files):
+        os.replace(temp_file, file)
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    shell_registry.invalidate()
+    target.usage_index.rebuild()
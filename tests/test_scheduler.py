@@ -0,0 +1,66 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+import scheduler
+from scheduler import IntervalSchedule, ScheduleState, Scheduler
+from utils import MAX_MISSED_RUNS, MISSED_RUN_GRACE
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+class RunDueTest(unittest.TestCase):
+    """Scheduler.run_due with each missed runs policy, driven by a fake clock."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.state = ScheduleState(os.path.join(directory.name, "schedule_state.jsonl"))
+        self.clock = FakeClock(1000.0)
+        self.dispatched = []
+        self.scheduler = Scheduler(self.dispatched.append, self.state, clock=self.clock)
+        self.scheduler.set_schedules({"chain": IntervalSchedule(5)}) # First fire at 1005
+
+    def run_due(self, policy):
+        with mock.patch.object(scheduler, "get_missed_runs_policy", return_value=policy):
+            return self.scheduler.run_due()
+
+    def test_on_time_fire_runs_once_with_every_policy(self):
+        for policy in ("Run all", "Run once", "Skip"):
+            with self.subTest(policy=policy):
+                self.dispatched.clear()
+                self.clock.now += 5
+                self.assertEqual(self.run_due(policy), 1)
+                self.assertEqual(self.dispatched, ["chain"])
+
+    def test_skip_runs_newest_fire_within_grace_once(self):
+        self.clock.now += 55 # Fires at 1005, 1010, ..., 1055 are all inside the grace window
+        self.assertEqual(self.run_due("Skip"), 1)
+        self.assertEqual(self.state.get("chain"), 1055)
+        self.assertEqual(self.scheduler.next_fire_time(), 1060)
+
+    def test_skip_drops_fires_after_outage(self):
+        self.scheduler.set_schedules({"chain": IntervalSchedule(3600)}) # First fire at 4600
+        self.clock.now = 4600 + 3 * 3600 + MISSED_RUN_GRACE + 1 # Newest fire at 15400 is late beyond the grace window
+        self.assertEqual(self.run_due("Skip"), 0)
+        self.assertEqual(self.dispatched, [])
+        self.assertEqual(self.state.get("chain"), 15400)
+        self.assertEqual(self.scheduler.next_fire_time(), 19000)
+
+    def test_run_once_merges_missed_fires(self):
+        self.clock.now += 3600
+        self.assertEqual(self.run_due("Run once"), 1)
+        self.assertEqual(self.state.get("chain"), 4600)
+
+    def test_run_all_makes_up_at_most_max_missed_runs(self):
+        self.clock.now += 3600
+        self.assertEqual(self.run_due("Run all"), MAX_MISSED_RUNS)
+        self.assertEqual(self.state.get("chain"), 4600)
+        self.assertEqual(self.scheduler.next_fire_time(), 4605)
+
+if __name__ == "__main__":
+    unittest.main()
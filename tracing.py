@@ -0,0 +1,166 @@
+"""Timing spans written as Chrome trace events, and an optional cProfile dump.
+
+Functions decorated with 'traced', the methods of classes decorated with
+'traced_methods' and the blocks run in a 'span' are recorded once tracing is
+enabled, either by 'enable_tracing' (the command line's --trace and --profile
+options) or by the AUTOMATION_HUB_TRACE and AUTOMATION_HUB_PROFILE environment
+variables. A function's span is named after its qualified name, such as
+'validate_state' or 'EditChainWindow._save_chain', so a trace reads like the
+code. While tracing is disabled a decorated function costs one extra call and
+a check of a global.
+
+The trace is written when the process exits and can be opened in
+chrome://tracing or https://ui.perfetto.dev. The profile only covers the
+thread that enabled it, the Tk main thread for the application, and can be
+read with the pstats module or a viewer such as snakeviz.
+
+This module only uses the standard library and must not import utils, which
+is traced.
+"""
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+import types
+
+TRACE_ENV_VAR = "AUTOMATION_HUB_TRACE" # Path of the trace file to write
+PROFILE_ENV_VAR = "AUTOMATION_HUB_PROFILE" # Path of the cProfile dump to write
+TRACE_MAX_EVENTS = 1000000 # Spans kept at most, later ones are counted but dropped
+
+_tracer = None
+
+class Tracer:
+    """Collects the spans of every thread and writes them to 'trace_file' as Chrome trace events."""
+
+    def __init__(self, trace_file=None, profile_file=None):
+        # Resolved now, as the command line changes directory after enabling tracing
+        self.trace_file = os.path.abspath(trace_file) if trace_file else None
+        self.profile_file = os.path.abspath(profile_file) if profile_file else None
+        self.profiler = None
+        self._origin = time.perf_counter_ns()
+        self._pid = os.getpid()
+        self._events = []
+        self._dropped = 0
+        self._thread_names = {} # native thread id -> name
+        self._written = False
+
+    def start(self):
+        if self.profile_file:
+            import cProfile # Imported here so tracing without profiling does not load it
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def add(self, name, start, end, args=None):
+        """Record a span of the current thread that started and ended at the given perf_counter_ns times."""
+        if self.trace_file is None:
+            return
+        if len(self._events) >= TRACE_MAX_EVENTS:
+            self._dropped += 1
+            return
+        tid = threading.get_native_id()
+        if tid not in self._thread_names:
+            self._thread_names[tid] = threading.current_thread().name
+        event = {"name": name, "ph": "X", "ts": (start - self._origin) / 1000, "dur": (end - start) / 1000, "pid": self._pid, "tid": tid}
+        if args:
+            event["args"] = args
+        self._events.append(event)
+
+    def write(self):
+        """Write the trace and the profile. Only the first call writes anything."""
+        if self._written:
+            return
+        self._written = True
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile_file)
+        if self.trace_file is None:
+            return
+        events = [
+            {"name": "thread_name", "ph": "M", "pid": self._pid, "tid": tid, "args": {"name": name}}
+            for tid, name in list(self._thread_names.items())
+        ]
+        events.extend(self._events[:]) # Threads that are still running may add spans meanwhile
+        directory, filename = os.path.split(self.trace_file)
+        temp_file = os.path.join(directory, f".{filename}.tmp")
+        with open(temp_file, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"dropped_events": self._dropped}}, f)
+        os.replace(temp_file, self.trace_file)
+
+def enable_tracing(trace_file=None, profile_file=None):
+    """Record spans to 'trace_file' and profile to 'profile_file' until the process exits.
+
+    Either falls back to its environment variable when not given. Returns True
+    if tracing or profiling was enabled.
+    """
+    global _tracer
+    trace_file = trace_file or os.environ.get(TRACE_ENV_VAR) or None
+    profile_file = profile_file or os.environ.get(PROFILE_ENV_VAR) or None
+    if _tracer is not None or (trace_file is None and profile_file is None):
+        return False
+    tracer = Tracer(trace_file, profile_file)
+    tracer.start()
+    atexit.register(tracer.write)
+    _tracer = tracer
+    return True
+
+def is_tracing_enabled():
+    return _tracer is not None
+
+class _Span:
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer.add(self.name, self.start, time.perf_counter_ns(), self.args)
+        return False
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NO_SPAN = _NoSpan()
+
+def span(name, **args):
+    """Return a context manager recording the block it runs as a span called 'name', with 'args' attached."""
+    tracer = _tracer
+    if tracer is None:
+        return _NO_SPAN
+    return _Span(tracer, name, args)
+
+def traced(func):
+    """Record every call of 'func' as a span named after its qualified name."""
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        tracer = _tracer
+        if tracer is None:
+            return func(*args, **kwargs)
+        start = time.perf_counter_ns()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            tracer.add(name, start, time.perf_counter_ns())
+    return wrapper
+
+def traced_methods(cls):
+    """Apply 'traced' to every method defined by 'cls', except the special methods other than __init__."""
+    for name, value in list(vars(cls).items()):
+        if isinstance(value, types.FunctionType) and (name == "__init__" or not name.startswith("__")):
+            setattr(cls, name, traced(value))
+    return cls
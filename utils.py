@@ -1,8 +1,14 @@
-from tkinter import messagebox
-import tkinter as tk
 import os
+import signal
 import subprocess
 import csv
+from settings_cache import Settings
+from shell_registry import ShellRegistry
+from tracing import traced
+from validation_cache import ValidationCache
+
+# tkinter is imported inside the functions that need it so that the command line
+# interface can use this module without loading Tk.
 
 # Constants
 ## Settings
@@ -10,6 +16,18 @@ EXIT_AFTER_EXECUTION_DEFAULT = "Never"
 EXIT_AFTER_EXECUTION_OPTIONS = ["Always", "After success only", "After failure only", "Never"]
 FILE_DISPLAY_DEFAULT = "File name only"
 FILE_DISPLAY_OPTIONS = ["Full path", "File name only"]
+MAX_PARALLEL_LINKS_DEFAULT = "4"
+MAX_PARALLEL_LINKS_OPTIONS = ["1", "2", "4", "8", "16"]
+STORAGE_BACKEND_DEFAULT = "CSV"
+STORAGE_BACKEND_OPTIONS = ["CSV", "SQLite"]
+CAPTURE_OUTPUT_DEFAULT = "Disabled"
+CAPTURE_OUTPUT_OPTIONS = ["Enabled", "Disabled"]
+MISSED_RUNS_DEFAULT = "Run once"
+MISSED_RUNS_OPTIONS = ["Run all", "Run once", "Skip"]
+MAX_PROCESSES_DEFAULT = "16"
+MAX_PROCESSES_OPTIONS = ["4", "8", "16", "32", "64", "Unlimited"]
+BATCH_EXECUTION_DEFAULT = "Sequential"
+BATCH_EXECUTION_OPTIONS = ["Sequential", "Parallel"]
 
 ## Files
 CHAINS_DIR = "Chains"
@@ -19,16 +37,96 @@ ICON_WINDOW_FILE = "Resources/icon_window.ico"
 SETTINGS_DIR = "Settings"
 FILE_DISPLAY_FILE = "Settings/file_display.csv"
 EXIT_AFTER_EXECUTION_FILE = "Settings/exit_after_execution.csv"
+MAX_PARALLEL_LINKS_FILE = "Settings/max_parallel_links.csv"
+STORAGE_BACKEND_FILE = "Settings/storage_backend.csv"
+CAPTURE_OUTPUT_FILE = "Settings/capture_output.csv"
+MISSED_RUNS_FILE = "Settings/missed_runs.csv"
+MAX_PROCESSES_FILE = "Settings/max_processes.csv"
+BATCH_EXECUTION_FILE = "Settings/batch_execution.csv"
 SHELLS_DIR = "Shells"
 IDENTITIES_FILE = "Shells/identities.csv"
 SHELL_OPTIONS_FILE = "Shells/shell_options.csv"
 SHELLS_FILE = "Shells/shells.csv"
+SHELL_LIMITS_FILE = "Shells/limits.csv"
+CACHE_DIR = "Cache"
+VALIDATION_CACHE_FILE = "Cache/validation.json"
+SHELL_USAGE_INDEX_FILE = "Cache/shell_usage.jsonl"
+SHELL_DETECTION_CACHE_FILE = "Cache/shell_detection.json"
+SCHEDULE_STATE_FILE = "Cache/schedule_state.jsonl"
+DAEMON_SOCKET_FILE = "Cache/daemon.sock"
+PLANS_DIR = "Cache/Plans"
+FINGERPRINTS_FILE = "Cache/fingerprints.jsonl"
+SCHEDULES_DIR = "Schedules"
+SCHEDULES_FILE = "Schedules/schedules.csv"
+INCREMENTAL_DIR = "Incremental"
+INCREMENTAL_CHAINS_FILE = "Incremental/chains.csv"
+DATABASE_DIR = "Database"
+DATABASE_FILE = "Database/automation_hub.db"
+HISTORY_FILE = "Database/history.db"
+LOGS_DIR = "Logs"
 
 ## Misc
 LISTBOX_ITEM_HEIGHT = 16
 DELIMITER = ","
+DEPENDENCY_DELIMITER = ";" # Separates link indices in the optional third column of a chain file
 SCRIPT_PLACEHOLDER = "<your-script>"
-
+CHAIN_LINK_SHELL = "@chain" # Shell column of a link that includes the chain named in its script column
+LINK_OPTION_SEPARATOR = "=" # Separates the name and value of an option column of a link, as in 'inputs=a.txt;b.txt'
+LINK_OPTIONS = ["inputs", "timeout", "retries"] # Options a link may have
+INPUT_DELIMITER = ";" # Separates the files in the inputs option of a link
+EXECUTION_POLL_INTERVAL = 100 # Milliseconds between checks for execution progress
+CHAINS_WATCH_INTERVAL = 1000 # Milliseconds between checks for chains added or removed by other programs
+SHELL_VERSION_TIMEOUT = 5 # Seconds to wait for '<shell> --version' during shell detection
+LOG_CHUNK_SIZE = 64 * 1024 # Bytes read from a link's output at a time when capturing it
+LOG_MAX_FILE_SIZE = 10 * 1024 * 1024 # Bytes written to a log file before it is rotated
+LOG_BACKUP_COUNT = 2 # Rotated files kept per log file
+LOG_MAX_RUNS = 20 # Runs kept in the Logs directory per chain
+LOG_DRAIN_TIMEOUT = 1 # Seconds the output of an exited link is still copied before its pipes are closed
+LOG_POLL_INTERVAL = 0.25 # Seconds between checks of whether the copying of a link's output should stop
+SCHEDULER_MAX_SLEEP = 30 # Seconds the scheduler sleeps at most, so clock changes and sleep are noticed
+MISSED_RUN_GRACE = 60 # Seconds a scheduled run may be late before it counts as missed
+MAX_MISSED_RUNS = 10 # Runs made up at most per chain with the 'Run all' missed runs setting
+DAEMON_MAX_REQUEST_SIZE = 64 * 1024 # Bytes a daemon request line may take
+DAEMON_MAX_FINISHED_RUNS = 100 # Finished runs the daemon keeps reporting the status of
+HASH_CHUNK_SIZE = 1024 * 1024 # Bytes read from a file at a time when hashing it
+RETRY_BACKOFF_BASE = 1 # Seconds waited before the first retry of a failed link, doubled for every further retry
+RETRY_BACKOFF_MAX = 300 # Seconds waited at most before a retry
+BATCH_MAX_REPORTED_FAILURES = 10 # Failed chains listed by name in the outcome of a batch
+
+## Mapping of shell executables to their names
+SHELL_MAPPING = {
+    "cmd.exe": "Command Prompt",
+    "powershell.exe": "Windows PowerShell",
+    "pwsh": "PowerShell Core",
+    "bash": "Bash",
+    "zsh": "Z Shell",
+    "fish": "Fish Shell",
+    "tcsh": "Tcsh",
+    "dash": "Dash",
+    "busybox": "BusyBox Shell",
+    "sh": "Bourne Shell",
+    "ksh": "Korn Shell",
+    "git-bash.exe": "Git Bash",
+    "mingw32.exe": "MinGW32 Shell",
+    "msys2.exe": "MSYS2 Shell",
+    "cygwin": "Cygwin Bash",
+    "alacritty": "Alacritty Terminal",
+    "hyper": "Hyper Terminal",
+    "iterm2": "iTerm2 (macOS Terminal)",
+    "terminal.app": "macOS Terminal",
+    "wsl.exe": "Windows Subsystem for Linux (WSL)",
+    "nu": "NuShell",
+    "xonsh": "Xonsh",
+    "elvish": "Elvish Shell",
+    "eshell": "Emacs Shell (EShell)",
+    "clink": "Clink",
+}
+
+# Shared index of the Shells directory. All reads of the three shell files go through it.
+shell_registry = ShellRegistry(SHELLS_FILE, IDENTITIES_FILE, SHELL_OPTIONS_FILE)
+settings = Settings(SETTINGS_DIR)
+
+@traced
 def delete_file_row(file, index):
     with open(file, "r") as f:
         rows = list(csv.reader(f))
@@ -37,8 +135,10 @@ def delete_file_row(file, index):
         writer = csv.writer(f)
         writer.writerows(remaining_rows)
 
+@traced
 def load_dropdown(dropdown, file, var, options):
     """Load file display options into the dropdown menu."""
+    from tkinter import messagebox
     try:
         with open(file, "r") as f:
             reader = csv.reader(f)
@@ -55,6 +155,7 @@ def load_dropdown(dropdown, file, var, options):
             "Error", f"Failed to load dropdown options: {e}"
         )
 
+@traced
 def setup_application_files():
     confirm_dir_existence(CHAINS_DIR)
     confirm_dir_existence(RESOURCES_DIR)
@@ -63,10 +164,22 @@ def setup_application_files():
     confirm_dir_existence(SETTINGS_DIR)
     confirm_file_existence(FILE_DISPLAY_FILE)
     confirm_file_existence(EXIT_AFTER_EXECUTION_FILE)
+    confirm_file_existence(MAX_PARALLEL_LINKS_FILE)
+    confirm_file_existence(STORAGE_BACKEND_FILE)
+    confirm_file_existence(CAPTURE_OUTPUT_FILE)
+    confirm_file_existence(MISSED_RUNS_FILE)
+    confirm_file_existence(MAX_PROCESSES_FILE)
+    confirm_file_existence(BATCH_EXECUTION_FILE)
     confirm_dir_existence(SHELLS_DIR)
     confirm_file_existence(IDENTITIES_FILE)
     confirm_file_existence(SHELL_OPTIONS_FILE)
     confirm_file_existence(SHELLS_FILE)
+    confirm_file_existence(SHELL_LIMITS_FILE)
+    confirm_dir_existence(CACHE_DIR)
+    confirm_dir_existence(SCHEDULES_DIR)
+    confirm_file_existence(SCHEDULES_FILE)
+    confirm_dir_existence(INCREMENTAL_DIR)
+    confirm_file_existence(INCREMENTAL_CHAINS_FILE)
 
 def confirm_dir_existence(dir):
     os.makedirs(dir, exist_ok=True)
@@ -76,31 +189,16 @@ def confirm_file_existence(file):
         with open(file, "w") as f:
             pass
     
+@traced
 def get_detected_identity(shell):
-    shell = shell + "\n"
-    shell_line = 0
-    shell_found = False
-    with open(SHELLS_FILE) as shell_file:
-        for line in shell_file:
-            if line == shell:
-                shell_found = True
-                break
-            else:
-                shell_line += 1
-    if not shell_found: return "Unknown"
-
-    detected_identities_line = 0
-    detected_identity = None
-    with open(IDENTITIES_FILE) as detected_identities_file:
-        for line in detected_identities_file:
-            if shell_line == detected_identities_line:
-                detected_identity = line
-                break
-            else:
-                detected_identities_line += 1
+    shell_line = shell_registry.get_position(shell)
+    if shell_line is None: return "Unknown"
+
+    detected_identity = shell_registry.get_identity_row_by_index(shell_line)
     if detected_identity == None: return "Unknown"
-    return detected_identity[:-1]
+    return DELIMITER.join(detected_identity)
 
+@traced
 def detect_shell(executable_path: str) -> str:
     shell = identify_shell_by_path(executable_path)
     if shell == "Unknown Shell":
@@ -108,54 +206,54 @@ def detect_shell(executable_path: str) -> str:
         return f"{version_info}"
     return shell
 
+@traced
+def kill_process_group(process, wait=True):
+    """Kill a process started with start_new_session=True, together with its children.
+
+    Waits for the process to exit unless 'wait' is False, as for asyncio
+    subprocesses, whose wait method has to be awaited.
+    """
+    try:
+        if hasattr(os, "killpg"):
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except (ProcessLookupError, PermissionError):
+        pass # The process already exited
+    if wait:
+        process.wait()
+
+@traced
 def get_shell_version(executable_path: str) -> str:
     try:
-        result = subprocess.run(
+        process = subprocess.Popen(
             [executable_path, "--version"], 
             stdout=subprocess.PIPE, 
             stderr=subprocess.PIPE,
-            text=True
+            stdin=subprocess.DEVNULL,
+            text=True,
+            start_new_session=True
         )
-        return result.stdout.splitlines()[0]
+        try:
+            stdout, _ = process.communicate(timeout=SHELL_VERSION_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            kill_process_group(process)
+            process.stdout.close()
+            process.stderr.close()
+            return f"Error identifying shell: no response within {SHELL_VERSION_TIMEOUT} seconds"
+        return stdout.splitlines()[0]
     except Exception as e:
         return f"Error identifying shell: {e}"
 
+@traced
 def identify_shell(executable_path: str) -> str:
     executable_name = os.path.basename(executable_path).lower()
     parent_dir = os.path.dirname(executable_path).lower()
 
-    # Mapping of shell executables to their names
-    shell_mapping = {
-        "cmd.exe": "Command Prompt",
-        "powershell.exe": "Windows PowerShell",
-        "pwsh": "PowerShell Core",
-        "bash": "Bash",
-        "zsh": "Z Shell",
-        "fish": "Fish Shell",
-        "tcsh": "Tcsh",
-        "dash": "Dash",
-        "busybox": "BusyBox Shell",
-        "sh": "Bourne Shell",
-        "ksh": "Korn Shell",
-        "git-bash.exe": "Git Bash",
-        "mingw32.exe": "MinGW32 Shell",
-        "msys2.exe": "MSYS2 Shell",
-        "cygwin": "Cygwin Bash",
-        "alacritty": "Alacritty Terminal",
-        "hyper": "Hyper Terminal",
-        "iterm2": "iTerm2 (macOS Terminal)",
-        "terminal.app": "macOS Terminal",
-        "wsl.exe": "Windows Subsystem for Linux (WSL)",
-        "nu": "NuShell",
-        "xonsh": "Xonsh",
-        "elvish": "Elvish Shell",
-        "eshell": "Emacs Shell (EShell)",
-        "clink": "Clink",
-    }
 
     # Check by executable name
-    if executable_name in shell_mapping:
-        return shell_mapping[executable_name]
+    if executable_name in SHELL_MAPPING:
+        return SHELL_MAPPING[executable_name]
 
     # Check specific hints from parent directory for more context
     if "cygwin" in parent_dir:
@@ -176,6 +274,7 @@ def identify_shell(executable_path: str) -> str:
     return "Unknown Shell"
 
 
+@traced
 def identify_shell_by_path(executable_path: str) -> str:
     executable_name = os.path.basename(executable_path).lower()
     parent_dir = os.path.dirname(executable_path).lower()
@@ -195,21 +294,36 @@ def prevent_focus(event):
     event.widget.tk_focusNext().focus()
 
 def get_setting(filename):
-    """Return the second line in the file 'filename'."""
+    """Return the second line in the file 'filename', served from the settings cache."""
     try:
-        with open(filename, "r") as file:
-            lines = file.readlines()
-            if len(lines) >= 2:
-                return lines[1].strip() # Strip any leading/trailing whitespace or newline
-            else:
-                return None # Return None if the file has fewer than 2 lines
+        return settings.get(filename) # None if the file has fewer than 2 lines
     except FileNotFoundError:
         return None # Return None if the file doesn't exist
     except Exception as e:
+        from tkinter import messagebox
         messagebox.showerror("Error", f"Failed to read setting from {filename}: {e}")
         return None
 
+def get_max_parallel_links():
+    """Return the maximum number of links of a chain that may run at the same time."""
+    setting = get_setting(MAX_PARALLEL_LINKS_FILE)
+    if setting not in MAX_PARALLEL_LINKS_OPTIONS:
+        setting = MAX_PARALLEL_LINKS_DEFAULT
+    return int(setting)
+
+def get_max_processes():
+    """Return the maximum number of link processes that may run at the same time, or None for no limit."""
+    setting = get_setting(MAX_PROCESSES_FILE)
+    if setting not in MAX_PROCESSES_OPTIONS:
+        setting = MAX_PROCESSES_DEFAULT
+    return None if setting == "Unlimited" else int(setting)
+
+def is_batch_execution_parallel():
+    """Return True if the chains of a batch start together rather than one after another."""
+    return get_setting(BATCH_EXECUTION_FILE) == "Parallel"
+
 def listbox_clicked_dead_space(event):
+    import tkinter as tk
     widget = event.widget
     if isinstance(widget, tk.Listbox):
         clicked_index = widget.nearest(event.y)
@@ -221,22 +335,19 @@ def listbox_clicked_dead_space(event):
     return False
 
 def get_shell_by_index(index):
-    with open(SHELLS_FILE) as f:
-        return f.readlines()[index]
+    return shell_registry.get_shell_by_index(index)
 
 def get_shell_identity_by_index(index):
-    with open(IDENTITIES_FILE) as f:
-        return f.readlines()[index].split(",")[1].rstrip()
+    return shell_registry.get_identity_by_index(index)
 
+@traced
 def get_shell_options(shell):
-    with open(SHELL_OPTIONS_FILE) as f:
-        lines = f.readlines()
-        for line in lines:
-            options = line.split(",")
-            if options[0] == shell:
-                return options
-    raise Exception("Error: could not find shell options for shell: " + str(shell))
+    options = shell_registry.get_options(shell)
+    if options is None:
+        raise Exception("Error: could not find shell options for shell: " + str(shell))
+    return options
 
+@traced
 def is_valid_settings_file(file, supported_options):
     try:
         if not os.path.isfile(file):
@@ -257,6 +368,7 @@ def is_valid_settings_file(file, supported_options):
     except Exception as e:
         raise Exception(f"settings file '{file}' is invalid ---> {e}.")
 
+@traced
 def validate_file(file):
     normalized_file = file
     normalized_file = normalize_path(normalized_file)
@@ -270,60 +382,263 @@ def validate_file(file):
     except Exception as e:
         raise Exception(f"file '{file}' is invalid ---> {e}.")
 
+@traced
 def validate_shell(shell):
     try:
         validate_file(shell)
+        shells_count, options_count, identities_count = shell_registry.count_entries(shell)
+
         # Check if shell has exactly one entry in SHELLS_FILE
-        with open(SHELLS_FILE) as shells_file:
-            shells = shells_file.readlines()
-            if shells.count(shell + "\n") != 1:
-                raise Exception(f"did not find exactly one corresponding entry in {SHELLS_FILE}")
+        if shells_count != 1:
+            raise Exception(f"did not find exactly one corresponding entry in {SHELLS_FILE}")
 
         # Check if shell has exactly one entry in SHELLS_OPTIONS_FILE
-        with open(SHELL_OPTIONS_FILE) as options_file:
-            options = [line.split(",")[0] for line in options_file]
-            if options.count(shell) != 1:
-                raise Exception(f"did not find exactly one corresponding entry in {SHELL_OPTIONS_FILE}")
+        if options_count != 1:
+            raise Exception(f"did not find exactly one corresponding entry in {SHELL_OPTIONS_FILE}")
 
         # Check if shell has exactly one entry in IDENTITIES_FILE
-        with open(IDENTITIES_FILE) as identities_file:
-            identities = [line.split(",")[0] for line in identities_file]
-            if identities.count(shell) != 1:
-                raise Exception(f"did not find exactly one corresponding entry in {IDENTITIES_FILE}")
+        if identities_count != 1:
+            raise Exception(f"did not find exactly one corresponding entry in {IDENTITIES_FILE}")
     except Exception as e:
         raise Exception(f"shell '{shell}' is invalid ---> {e}")
 
-def validate_link(link):
+def split_link_row(row):
+    """Split a chain file row into its columns (shell, script and the optional run after column) and a dict of its options.
+
+    Options are 'name=value' columns after the run after column, or after the
+    script if there is none. A run after column never contains
+    LINK_OPTION_SEPARATOR, so the two cannot be confused.
+    """
+    columns = list(row[:2])
+    options = {}
+    for column in row[2:]:
+        if LINK_OPTION_SEPARATOR in column:
+            name, value = column.split(LINK_OPTION_SEPARATOR, 1)
+            options[name] = value
+        elif len(columns) == 2 and not options:
+            columns.append(column)
+        else:
+            raise Exception(f"column '{column}' is not an option")
+    return columns, options
+
+def join_link_row(columns, options):
+    """Return the chain file row for the columns and options of a link. Empty options are left out."""
+    return list(columns) + [f"{name}{LINK_OPTION_SEPARATOR}{value}" for name, value in options.items() if value != ""]
+
+def get_link_inputs(options):
+    """Return the input files declared by the options of a link."""
+    return [path for path in options.get("inputs", "").split(INPUT_DELIMITER) if path != ""]
+
+def get_link_timeout(options):
+    """Return the seconds a link may run before it is killed, or None if it has no timeout."""
+    value = options.get("timeout", "")
+    if value == "":
+        return None
+    try:
+        timeout = float(value)
+    except ValueError:
+        timeout = 0
+    if not timeout > 0 or timeout == float("inf"):
+        raise Exception(f"timeout '{value}' is not a positive number of seconds")
+    return timeout
+
+def get_link_retries(options):
+    """Return how many times a failed link is run again."""
+    value = options.get("retries", "")
+    if value == "":
+        return 0
+    if not value.isdigit():
+        raise Exception(f"retries '{value}' is not a whole number")
+    return int(value)
+
+def get_link_dependencies(row, index):
+    """Return the indices of the links that must succeed before link 'index' can run.
+
+    A link without a third column runs after the previous link, so two column
+    chains keep running strictly in order. Otherwise the third column lists the
+    indices of earlier links separated by DEPENDENCY_DELIMITER, and an empty
+    third column means the link can start immediately.
+    """
+    row = split_link_row(row)[0] if len(row) > 2 else row
+    if len(row) < 3:
+        return (index - 1,) if index > 0 else ()
+    dependencies = []
+    for part in row[2].split(DEPENDENCY_DELIMITER):
+        part = part.strip()
+        if part == "":
+            continue
+        if not part.isdigit():
+            raise Exception(f"dependency '{part}' is not a link index")
+        dependency = int(part)
+        if dependency >= index:
+            raise Exception(f"dependency '{part}' does not refer to an earlier link")
+        if dependency not in dependencies:
+            dependencies.append(dependency)
+    return tuple(dependencies)
+
+@traced
+def remove_chain_links(rows, indices):
+    """Return the rows of a chain without the links at 'indices'.
+
+    Dependencies on removed links are dropped and the remaining dependencies are
+    renumbered so they keep pointing at the same links.
+    """
+    indices = set(indices)
+    new_indices = {}
+    for i in range(len(rows)):
+        if i not in indices:
+            new_indices[i] = len(new_indices)
+
+    remaining_rows = []
+    for i, row in enumerate(rows):
+        if i in indices:
+            continue
+        columns, options = split_link_row(row)
+        if len(columns) > 2:
+            dependencies = []
+            for part in columns[2].split(DEPENDENCY_DELIMITER):
+                part = part.strip()
+                if part.isdigit() and int(part) in new_indices:
+                    dependencies.append(str(new_indices[int(part)]))
+            columns[2] = DEPENDENCY_DELIMITER.join(dependencies)
+        remaining_rows.append(join_link_row(columns, options))
+    return remaining_rows
+
+def is_output_capture_enabled():
+    """Return True if the output of links should be saved to the Logs directory."""
+    return get_setting(CAPTURE_OUTPUT_FILE) == "Enabled"
+
+def get_storage_backend():
+    """Return the selected storage backend."""
+    setting = get_setting(STORAGE_BACKEND_FILE)
+    if setting not in STORAGE_BACKEND_OPTIONS:
+        setting = STORAGE_BACKEND_DEFAULT
+    return setting
+
+def validate_once(validator, path, results):
+    """Run 'validator' on 'path' unless it already ran during this validation pass."""
+    if results is None:
+        validator(path)
+        return
+    key = (validator.__name__, path)
+    if key not in results:
+        try:
+            validator(path)
+            results[key] = None
+        except Exception as e:
+            results[key] = str(e)
+    if results[key] is not None:
+        raise Exception(results[key])
+
+def is_chain_link(row):
+    """Return True if a chain file row includes another chain instead of running a script."""
+    return row[0] == CHAIN_LINK_SHELL
+
+@traced
+def validate_included_chain(chain_name):
+    if not os.path.isfile(os.path.join(CHAINS_DIR, f"{chain_name}.csv")):
+        raise Exception(f"included chain '{chain_name}' does not exist.")
+
+def validate_link_options(options):
+    for name in options:
+        if name not in LINK_OPTIONS:
+            raise Exception(f"option '{name}' is not supported")
+    for path in get_link_inputs(options):
+        if path != normalize_path(path) or DELIMITER in path:
+            raise Exception(f"input file '{path}' is not normalized")
+    get_link_timeout(options)
+    get_link_retries(options)
+
+@traced
+def validate_link(link, index=0, results=None):
     parts = link.split(DELIMITER)
     try:
-        if len(parts) != 2:
+        if len(parts) < 2:
             raise Exception(f"improperly formatted.")
-        shell, script = parts
-        validate_shell(shell)
-        validate_file(script)
+        shell, script = parts[:2]
+        if is_chain_link(parts):
+            validate_once(validate_included_chain, script, results)
+        else:
+            validate_once(validate_shell, shell, results)
+            validate_once(validate_file, script, results)
+        validate_link_options(split_link_row(parts)[1])
+        get_link_dependencies(parts, index)
     except Exception as e:
         raise Exception(f"link '{link}' is invalid ---> {e}.") 
 
+@traced
+def validate_chain_file(chain_path, results=None):
+    """Validate every link of a chain file. Returns the scripts and the names of the chains it references directly."""
+    scripts = []
+    chains = []
+    with open(chain_path) as f:
+        links = f.readlines()
+        for i, link in enumerate(links):
+            link = link.strip()
+            validate_link(link, i, results)
+            parts = link.split(DELIMITER)
+            if is_chain_link(parts):
+                chains.append(parts[1])
+            else:
+                scripts.append(parts[1])
+    return scripts, chains
+
+@traced
 def validate_chains_directory():
-    """Validates the Chains directory and its contents."""
+    """Validates the Chains directory and its contents.
+
+    The shell tables are loaded once and each distinct shell and script is checked
+    once. Chain files that were valid on a previous run and have not changed since
+    are not parsed again, only the existence of their scripts and included chains
+    is confirmed.
+    """
     # Check if CHAINS_DIR exists
     if not os.path.isdir(CHAINS_DIR):
         raise Exception(f"chains directory does not exist")
 
-    for chain_file in os.listdir(CHAINS_DIR):
+    cache = ValidationCache(VALIDATION_CACHE_FILE)
+    cache.set_context(shell_registry.get_signature())
+    results = {}
+    chain_files = []
+    first_error = None
+
+    for chain_file in sorted(os.listdir(CHAINS_DIR)):
         chain_path = os.path.join(CHAINS_DIR, chain_file)
         if not chain_file.endswith(".csv"):
             continue
+        chain_files.append(chain_file)
 
         try:
+            stat = os.stat(chain_path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+            cached = cache.get(chain_file, signature)
+            if cached is not None:
+                try:
+                    scripts, chains = cached
+                    for script in scripts:
+                        validate_once(validate_file, script, results)
+                    for chain_name in chains:
+                        validate_once(validate_included_chain, chain_name, results)
+                    continue
+                except Exception:
+                    pass # A script or an included chain changed, validate the whole chain again
+
             # Check if each link is valid in each chain file
-            with open(chain_path) as f:
-                links = f.readlines()
-                for link in links:
-                    validate_link(link.strip())
+            cache.put(chain_file, signature, *validate_chain_file(chain_path, results))
         except Exception as e:
-            raise Exception(f"chains directory is invalid ---> chain file '{chain_file}' is invalid ---> {e}")
+            cache.discard(chain_file)
+            if first_error is None:
+                first_error = f"chains directory is invalid ---> chain file '{chain_file}' is invalid ---> {e}"
+
+    cache.retain(chain_files)
+    try:
+        cache.save()
+    except OSError:
+        pass # The cache only speeds up the next validation
+    if first_error is not None:
+        raise Exception(first_error)
 
+@traced
 def validate_settings_directory():
     """Validates the Settings directory and its contents."""
     if not os.path.isdir(SETTINGS_DIR):
@@ -335,20 +650,61 @@ def validate_settings_directory():
     # Validate file_display.csv
     is_valid_settings_file(FILE_DISPLAY_FILE, FILE_DISPLAY_OPTIONS)
 
+    # Validate max_parallel_links.csv
+    is_valid_settings_file(MAX_PARALLEL_LINKS_FILE, MAX_PARALLEL_LINKS_OPTIONS)
+
+    # Validate storage_backend.csv
+    is_valid_settings_file(STORAGE_BACKEND_FILE, STORAGE_BACKEND_OPTIONS)
+
+    # Validate capture_output.csv
+    is_valid_settings_file(CAPTURE_OUTPUT_FILE, CAPTURE_OUTPUT_OPTIONS)
+
+    # Validate missed_runs.csv
+    is_valid_settings_file(MISSED_RUNS_FILE, MISSED_RUNS_OPTIONS)
+
+    # Validate max_processes.csv
+    is_valid_settings_file(MAX_PROCESSES_FILE, MAX_PROCESSES_OPTIONS)
+
+    # Validate batch_execution.csv
+    is_valid_settings_file(BATCH_EXECUTION_FILE, BATCH_EXECUTION_OPTIONS)
+
+@traced
+def validate_schedules_file():
+    """Validates the schedules file, if there is one."""
+    from scheduler import load_schedules # Imported here because scheduler depends on this module
+    try:
+        load_schedules(SCHEDULES_FILE)
+    except Exception as e:
+        raise Exception(f"schedules file '{SCHEDULES_FILE}' is invalid ---> {e}.")
+
+@traced
+def validate_shell_limits_file():
+    """Validates the shell limits file, if there is one."""
+    from dispatcher import load_shell_limits # Imported here because dispatcher depends on this module
+    try:
+        load_shell_limits(SHELL_LIMITS_FILE)
+    except Exception as e:
+        raise Exception(f"shell limits file '{SHELL_LIMITS_FILE}' is invalid ---> {e}.")
+
+@traced
+def validate_incremental_chains_file():
+    """Validates the incremental chains file, if there is one."""
+    from incremental import load_incremental_chains # Imported here because incremental depends on this module
+    try:
+        load_incremental_chains(INCREMENTAL_CHAINS_FILE)
+    except Exception as e:
+        raise Exception(f"incremental chains file '{INCREMENTAL_CHAINS_FILE}' is invalid ---> {e}.")
+
+@traced
 def validate_shells_directory():
     """Validates the Shells directory and its contents."""
     if not os.path.isdir(SHELLS_DIR):
         raise Exception(f"shells directory does not exist")
 
     try:
-        with open(SHELLS_FILE) as shells_file:
-            shells = shells_file.readlines()
-
-        with open(IDENTITIES_FILE) as identities_file:
-            identities = identities_file.readlines()
-
-        with open(SHELL_OPTIONS_FILE) as options_file:
-            options = options_file.readlines()
+        shells = shell_registry.get_shells()
+        identities = shell_registry.get_identity_rows()
+        options = shell_registry.get_option_rows()
 
         if len(shells) != len(identities):
             raise Exception(f"found unequal number of shells ({len(shells)}) and shell identities ({len(identities)}).")
@@ -356,16 +712,15 @@ def validate_shells_directory():
             raise Exception(f"found unequal number of shells ({len(shells)}) and shell option lists ({len(options)}).")
 
         for i, shell in enumerate(shells):
-            shell = shell.strip()
             validate_file(shell)
 
-            identity_parts = identities[i].strip().split(DELIMITER)
+            identity_parts = identities[i]
             if len(identity_parts) != 2:
                 raise Exception(f"invalid identity entry '{identity_parts}' for shell {shell}.")
             if identity_parts[0] != shell:
                 raise Exception(f"invalid identity '{identity_parts[0]}' for shell {shell}.")
 
-            option_parts = options[i].strip().split(DELIMITER)
+            option_parts = options[i]
             if len(option_parts) != 4:
                 raise Exception(f"invalid options entry '{option_parts}' for shell {shell}.")
             if option_parts[0] != shell:
@@ -375,11 +730,20 @@ def validate_shells_directory():
     except Exception as e:
         raise Exception(f"shells directory is invalid ---> {e}")
 
+@traced
 def validate_state():
     """Validates the overall state of the application."""
     try:
-        validate_chains_directory()
-        validate_settings_directory()
-        validate_shells_directory()
+        if get_storage_backend() == "SQLite":
+            from storage import get_storage # Imported here because storage depends on this module
+            validate_settings_directory()
+            get_storage().validate()
+        else:
+            validate_chains_directory()
+            validate_settings_directory()
+            validate_shells_directory()
+        validate_schedules_file()
+        validate_shell_limits_file()
+        validate_incremental_chains_file()
     except Exception as e:
         raise Exception(e)
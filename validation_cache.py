@@ -0,0 +1,67 @@
+import json
+import os
+
+class ValidationCache:
+    """Remembers which chain files were found valid, keyed by file signature.
+
+    An entry is only reused while the chain file's modification time and size,
+    and the signature of the shell tables it was validated against, are unchanged.
+    Each entry also records the scripts and the included chains the chain
+    references so callers can confirm they still exist without parsing the
+    chain again.
+    """
+
+    def __init__(self, cache_file):
+        self.cache_file = cache_file
+        self._entries = {}
+        self._context = None
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.cache_file, "r") as f:
+                data = json.load(f)
+            self._context = data.get("context")
+            self._entries = data.get("chains", {})
+        except (FileNotFoundError, ValueError, AttributeError):
+            self._context = None
+            self._entries = {}
+
+    def set_context(self, context):
+        """Set the shell table signature, discarding every entry if it changed."""
+        context = json.loads(json.dumps(context)) # Normalize tuples to lists
+        if context != self._context:
+            self._context = context
+            self._entries = {}
+            self._dirty = True
+
+    def get(self, chain_file, signature):
+        """Return the (scripts, included chains) of a chain validated with 'signature', or None if it must be validated again."""
+        entry = self._entries.get(chain_file)
+        if entry is None or entry["signature"] != list(signature) or "chains" not in entry:
+            return None # Entries written before included chains were recorded are validated again
+        return entry["scripts"], entry["chains"]
+
+    def put(self, chain_file, signature, scripts, chains):
+        self._entries[chain_file] = {"signature": list(signature), "scripts": sorted(set(scripts)), "chains": sorted(set(chains))}
+        self._dirty = True
+
+    def discard(self, chain_file):
+        if self._entries.pop(chain_file, None) is not None:
+            self._dirty = True
+
+    def retain(self, chain_files):
+        """Drop the entries of chain files that no longer exist."""
+        for chain_file in set(self._entries) - set(chain_files):
+            self.discard(chain_file)
+
+    def save(self):
+        if not self._dirty:
+            return
+        os.makedirs(os.path.dirname(self.cache_file) or ".", exist_ok=True)
+        temp_file = self.cache_file + ".tmp"
+        with open(temp_file, "w") as f:
+            json.dump({"context": self._context, "chains": self._entries}, f)
+        os.replace(temp_file, self.cache_file)
+        self._dirty = False
@@ -0,0 +1,167 @@
+import tkinter as tk
+from utils import LISTBOX_ITEM_HEIGHT
+
+class VirtualListbox:
+    """A scrollable list that only creates Listbox rows for the items in view.
+
+    The items are kept in a Python list and the inner tk.Listbox ('listbox')
+    holds just the rows that fit in the window, refilled whenever the view
+    scrolls. Indices passed to and returned by the methods below refer to the
+    whole item list, whose items must be distinct. The selection is kept by
+    item, so it survives scrolling and changes of the item list that keep the
+    selected items.
+    """
+
+    def __init__(self, master, **listbox_options):
+        self.listbox = tk.Listbox(master, activestyle=tk.NONE, exportselection=False, **listbox_options)
+        self.scrollbar = tk.Scrollbar(master, orient=tk.VERTICAL, command=self.yview)
+        self.items = []
+        self.offset = 0 # Index of the item in the first row
+        self._selected = set() # Selected items
+        self._positions = None # item -> index, built when first needed
+        self._rendered = 0 # Number of rows in the listbox
+
+        self.listbox.bind("<<ListboxSelect>>", self._on_select, add="+")
+        self.listbox.bind("<Configure>", lambda event: self.render())
+        self.listbox.bind("<MouseWheel>", self._on_mouse_wheel)
+        self.listbox.bind("<Button-4>", lambda event: self._scroll(-3))
+        self.listbox.bind("<Button-5>", lambda event: self._scroll(3))
+        self.listbox.bind("<Up>", lambda event: self._move_selection(-1))
+        self.listbox.bind("<Down>", lambda event: self._move_selection(1))
+
+    def pack_listbox(self):
+        self.listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+    def _row_height(self):
+        first, second = self.listbox.bbox(0), self.listbox.bbox(1)
+        if first and second:
+            return second[1] - first[1]
+        return LISTBOX_ITEM_HEIGHT
+
+    def _visible_rows(self):
+        """Return the number of rows that fit entirely in the listbox."""
+        return max(1, self.listbox.winfo_height() // self._row_height())
+
+    def _clamp_offset(self):
+        self.offset = max(0, min(self.offset, len(self.items) - self._visible_rows()))
+
+    def render(self):
+        """Fill the listbox with the items in view and update the scrollbar."""
+        self._clamp_offset()
+        rows = self.items[self.offset:self.offset + self._visible_rows() + 1] # One partial row at the bottom
+        self.listbox.delete(0, tk.END)
+        if rows:
+            self.listbox.insert(tk.END, *rows)
+        for row, item in enumerate(rows):
+            if item in self._selected:
+                self.listbox.selection_set(row)
+        self._rendered = len(rows)
+
+        if self.items:
+            first = self.offset / len(self.items)
+            last = min(1.0, (self.offset + self._visible_rows()) / len(self.items))
+        else:
+            first, last = 0.0, 1.0
+        self.scrollbar.set(first, last)
+
+    def set_items(self, items):
+        """Replace the items, keeping the selected items that are still present and the scroll position."""
+        self.items = list(items)
+        self._positions = None
+        self._selected.intersection_update(self.items)
+        self.render()
+
+    def insert_item(self, index, item):
+        """Insert an item before 'index' without moving the items in view. Call render() after a batch of changes."""
+        self.items.insert(index, item)
+        self._positions = None
+        if index < self.offset:
+            self.offset += 1
+
+    def delete_item(self, index):
+        """Delete the item at 'index' without moving the items in view. Call render() after a batch of changes."""
+        item = self.items.pop(index)
+        self._positions = None
+        self._selected.discard(item)
+        if index < self.offset:
+            self.offset -= 1
+
+    def _on_select(self, event):
+        visible = set(self.items[self.offset:self.offset + self._rendered])
+        selected = {self.listbox.get(row) for row in self.listbox.curselection()}
+        if self.listbox.cget("selectmode") in (tk.BROWSE, tk.SINGLE):
+            self._selected = selected
+        else:
+            # Items scrolled out of view keep their state
+            self._selected = (self._selected - visible) | selected
+
+    def yview(self, *args):
+        """Scroll the view. Accepts the arguments a Scrollbar passes to its command."""
+        if not args:
+            return self.scrollbar.get()
+        if args[0] == tk.MOVETO:
+            self.offset = int(float(args[1]) * len(self.items))
+        elif args[0] == tk.SCROLL:
+            amount = int(args[1])
+            self.offset += amount * self._visible_rows() if args[2] == tk.PAGES else amount
+        self.render()
+
+    def _scroll(self, amount):
+        self.offset += amount
+        self.render()
+        return "break"
+
+    def _on_mouse_wheel(self, event):
+        return self._scroll(-3 if event.delta > 0 else 3)
+
+    def _move_selection(self, step):
+        selection = self.curselection()
+        if not selection:
+            return "break"
+        index = max(0, min(len(self.items) - 1, selection[0] + step))
+        self.selection_clear(0, tk.END)
+        self.selection_set(index)
+        self.see(index)
+        self.listbox.event_generate("<<ListboxSelect>>")
+        return "break"
+
+    def see(self, index):
+        """Scroll so the item at 'index' is in view."""
+        if index < self.offset:
+            self.offset = index
+        elif index >= self.offset + self._visible_rows():
+            self.offset = index - self._visible_rows() + 1
+        self.render()
+
+    def size(self):
+        return len(self.items)
+
+    def get(self, index):
+        return self.items[index]
+
+    def curselection(self):
+        """Return the indices of the selected items in ascending order."""
+        if not self._selected:
+            return ()
+        if self._positions is None:
+            self._positions = {item: i for i, item in enumerate(self.items)}
+        return tuple(sorted(self._positions[item] for item in self._selected))
+
+    def selection_set(self, index):
+        self._selected.add(self.items[index])
+        row = index - self.offset
+        if 0 <= row < self._rendered:
+            self.listbox.selection_set(row)
+
+    def selection_clear(self, first, last=None):
+        """Deselect the items from 'first' to 'last'. Passing tk.END as 'last' deselects everything."""
+        if first == 0 and last == tk.END:
+            self._selected.clear()
+        else:
+            last = len(self.items) - 1 if last == tk.END else first if last is None else last
+            self._selected.difference_update(self.items[first:last + 1])
+        self.listbox.selection_clear(0, tk.END)
+        for row in range(self._rendered):
+            if self.items[self.offset + row] in self._selected:
+                self.listbox.selection_set(row)